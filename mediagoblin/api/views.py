@@ -14,20 +14,26 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
 import json
 import io
 import mimetypes
 
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased
 from werkzeug.datastructures import FileStorage
 
 from mediagoblin.decorators import oauth_required
 from mediagoblin.api.decorators import user_has_privilege
 from mediagoblin.db.models import (
-    LocalUser, MediaEntry, TextComment, Activity, Location)
+    LocalUser, MediaEntry, TextComment, Activity, Location, Comment,
+    GenericModelReference)
+from mediagoblin.db.util import query_validators
 from mediagoblin.tools.federation import create_activity, create_generator
 from mediagoblin.tools.routing import extract_url_arguments
 from mediagoblin.tools.response import (
-    redirect, json_response, json_error, render_to_response)
+    redirect, json_response, json_error, render_to_response, make_etag,
+    not_modified_response, add_validators)
 from mediagoblin.meddleware.csrf import csrf_exempt
 from mediagoblin.submit.lib import new_upload_entry, api_upload_request, \
                                     api_add_to_feed
@@ -167,8 +173,16 @@ def inbox_endpoint(request, inbox=None):
     if inbox is None:
         inbox = Activity.query
 
+    # Don't rebuild the inbox if the client already has it
+    validators, last_modified = query_validators(
+        inbox, Activity.published, Activity.updated)
+    etag = make_etag(user.id, validators)
+    not_modified = not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
     # Count how many items for the "totalItems" field
-    total_items = inbox.count()
+    total_items = validators[0]
 
     # We want to make a query for all media on the site and then apply GET
     # limits where we can.
@@ -210,7 +224,7 @@ def inbox_endpoint(request, inbox=None):
             # should just skip them.
             pass
 
-    return json_response(feed)
+    return add_validators(json_response(feed), etag, last_modified)
 
 @oauth_required
 @csrf_exempt
@@ -405,6 +419,9 @@ def feed_endpoint(request, outbox=None):
                         "Invalid 'comment' with id '{}'".format(obj["id"])
                     )
 
+                # The object endpoint of the media uses this to tell
+                # clients the reply changed
+                comment.updated = datetime.datetime.utcnow()
                 comment.save()
 
                 # Create an update activity
@@ -440,6 +457,7 @@ def feed_endpoint(request, outbox=None):
                         f"Invalid 'image' with id '{obj_id}'"
                     )
                 image.generate_slug()
+                image.updated = datetime.datetime.utcnow()
                 image.save()
 
                 # Create an update activity
@@ -578,6 +596,15 @@ def feed_endpoint(request, outbox=None):
     else:
         outbox = outbox.filter_by(actor=requested_user.id)
 
+    # Don't rebuild the feed if the client already has it, the feed may
+    # differ depending on who is asking.
+    validators, last_modified = query_validators(
+        outbox, Activity.published, Activity.updated)
+    etag = make_etag(request.user.id, validators)
+    not_modified = not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
     # We want the newest things at the top (issue: #1055)
     outbox = outbox.order_by(Activity.published.desc())
 
@@ -615,7 +642,7 @@ def feed_endpoint(request, outbox=None):
             pass
     feed["totalItems"] = len(feed["items"])
 
-    return json_response(feed)
+    return add_validators(json_response(feed), etag, last_modified)
 
 @oauth_required
 def feed_minor_endpoint(request):
@@ -673,7 +700,24 @@ def object_endpoint(request):
             status=404
         )
 
-    return json_response(media.serialize(request))
+    # The object includes its comments, so they count too, edits included
+    comment_reference = aliased(GenericModelReference)
+    comments = media.get_comments() \
+        .outerjoin(comment_reference,
+                   Comment.comment_id == comment_reference.id) \
+        .outerjoin(TextComment, and_(
+            comment_reference.model_type == TextComment.__tablename__,
+            comment_reference.obj_pk == TextComment.id))
+    validators, last_modified = query_validators(
+        comments, Comment.added, TextComment.updated)
+    last_modified = max(filter(None, (media.updated, last_modified)))
+    etag = make_etag(media.id, media.updated, validators)
+    not_modified = not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    return add_validators(
+        json_response(media.serialize(request)), etag, last_modified)
 
 @oauth_required
 def object_comments(request):
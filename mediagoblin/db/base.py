@@ -96,6 +96,7 @@ class GMGTableBase:
         # Import here to prevent cyclic imports.
         from mediagoblin.db.models import CollectionItem, GenericModelReference, \
                                           Report, Notification, Comment
+        from mediagoblin.notifications import recount_unseen_notifications
         
         # Some of the models don't have an "id" field which means they can't be
         # used with GMR, these models won't be in collections because they
@@ -120,7 +121,12 @@ class GMGTableBase:
                 notifications = Notification.query.filter_by(
                     object_id=gmr.id
                 )
+                unseen_user_ids = [user_id for (user_id,) in
+                    notifications.filter_by(seen=False).with_entities(
+                        Notification.user_id)]
                 notifications.delete()
+                if unseen_user_ids:
+                    recount_unseen_notifications(unseen_user_ids)
                 
                 # Delete this as a comment
                 comments = Comment.query.filter_by(
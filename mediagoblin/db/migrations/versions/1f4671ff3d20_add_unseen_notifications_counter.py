@@ -0,0 +1,47 @@
+"""add unseen notifications counter to LocalUser
+
+Revision ID: 1f4671ff3d20
+Revises: 5fa8cd7a3dd9
+Create Date: 2026-10-18 22:04:51.519306
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f4671ff3d20'
+down_revision = '5fa8cd7a3dd9'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    """
+    LocalUser.unseen_notifications keeps the number of unseen notifications
+    so the header doesn't have to count them on every page. Fill it in for
+    the notifications that already exist.
+    """
+    op.add_column(
+        'core__local_users',
+        sa.Column('unseen_notifications', sa.Integer(), nullable=False,
+                  server_default='0'))
+
+    local_users = sa.table(
+        'core__local_users',
+        sa.column('id', sa.Integer),
+        sa.column('unseen_notifications', sa.Integer))
+    notifications = sa.table(
+        'core__notifications',
+        sa.column('user_id', sa.Integer),
+        sa.column('seen', sa.Boolean))
+
+    unseen_count = sa.select([sa.func.count()]).where(sa.and_(
+        notifications.c.user_id == local_users.c.id,
+        notifications.c.seen == sa.false())).as_scalar()
+    op.execute(local_users.update().values(unseen_notifications=unseen_count))
+
+
+def downgrade():
+    with op.batch_alter_table('core__local_users') as batch_op:
+        batch_op.drop_column('unseen_notifications')
@@ -0,0 +1,36 @@
+"""add keyset pagination indexes
+
+Revision ID: 5fa8cd7a3dd9
+Revises: cc3651803714
+Create Date: 2026-10-18 20:31:12.084213
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5fa8cd7a3dd9'
+down_revision = 'cc3651803714'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+
+
+def upgrade():
+    """
+    KeysetPagination seeks on (created, id) for media galleries and on
+    (added, id) for the comments on a media entry, give it indexes to do
+    so without sorting.
+    """
+    op.create_index(
+        'ix_core__media_entries_actor_created_id', 'core__media_entries',
+        ['actor', 'created', 'id'])
+    op.create_index(
+        'ix_core__comment_links_target_added_id', 'core__comment_links',
+        ['target_id', 'added', 'id'])
+
+
+def downgrade():
+    op.drop_index(
+        'ix_core__comment_links_target_added_id', 'core__comment_links')
+    op.drop_index(
+        'ix_core__media_entries_actor_created_id', 'core__media_entries')
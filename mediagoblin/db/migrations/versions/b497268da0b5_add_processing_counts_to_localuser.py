@@ -0,0 +1,57 @@
+"""add processing counts to LocalUser
+
+Revision ID: b497268da0b5
+Revises: 1f4671ff3d20
+Create Date: 2026-10-18 22:47:13.660271
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b497268da0b5'
+down_revision = '1f4671ff3d20'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    """
+    LocalUser.num_processing and num_failed count the user's media entries
+    in those states, so the processing_info plugin doesn't have to count
+    them on every page. Fill them in for the existing media.
+    """
+    op.add_column(
+        'core__local_users',
+        sa.Column('num_processing', sa.Integer(), nullable=False,
+                  server_default='0'))
+    op.add_column(
+        'core__local_users',
+        sa.Column('num_failed', sa.Integer(), nullable=False,
+                  server_default='0'))
+
+    local_users = sa.table(
+        'core__local_users',
+        sa.column('id', sa.Integer),
+        sa.column('num_processing', sa.Integer),
+        sa.column('num_failed', sa.Integer))
+    media_entries = sa.table(
+        'core__media_entries',
+        sa.column('actor', sa.Integer),
+        sa.column('state', sa.Unicode))
+
+    def count_state(state):
+        return sa.select([sa.func.count()]).where(sa.and_(
+            media_entries.c.actor == local_users.c.id,
+            media_entries.c.state == state)).as_scalar()
+
+    op.execute(local_users.update().values(
+        num_processing=count_state('processing'),
+        num_failed=count_state('failed')))
+
+
+def downgrade():
+    with op.batch_alter_table('core__local_users') as batch_op:
+        batch_op.drop_column('num_failed')
+        batch_op.drop_column('num_processing')
@@ -0,0 +1,43 @@
+"""store rendered markdown
+
+Revision ID: f523021fdc2d
+Revises: b497268da0b5
+Create Date: 2026-10-18 23:31:08.114527
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f523021fdc2d'
+down_revision = 'b497268da0b5'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+MARKDOWN_COLUMNS = [
+    ('core__users', 'rendered_bio'),
+    ('core__media_entries', 'rendered_description'),
+    ('core__media_comments', 'rendered_content'),
+    ('core__collections', 'rendered_description'),
+    ('core__collection_items', 'rendered_note'),
+]
+
+
+def upgrade():
+    """
+    Keep the HTML of the Markdown fields next to them, along with the version
+    of the renderer that made it.  They start out empty, the HTML gets made
+    on the fly until "gmg rendermarkdown" fills them in.
+    """
+    for table, column in MARKDOWN_COLUMNS:
+        op.add_column(table, sa.Column(column, sa.UnicodeText()))
+        op.add_column(table, sa.Column('markdown_version', sa.Integer()))
+
+
+def downgrade():
+    for table, column in MARKDOWN_COLUMNS:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('markdown_version')
+            batch_op.drop_column(column)
@@ -37,7 +37,7 @@ from werkzeug.utils import cached_property
 from mediagoblin.media_types import FileTypeNotSupported
 from mediagoblin.tools import common, licenses
 from mediagoblin.tools.pluginapi import hook_handle
-from mediagoblin.tools.text import cleaned_markdown_conversion
+from mediagoblin.tools.text import rendered_markdown
 from mediagoblin.tools.url import slugify
 from mediagoblin.tools.translate import pass_to_ugettext as _
 
@@ -123,7 +123,7 @@ class UserMixin:
 
     @property
     def bio_html(self):
-        return cleaned_markdown_conversion(self.bio)
+        return rendered_markdown(self, 'bio')
 
     def url_for_self(self, urlgen, **kwargs):
         """Generate a URL for this User's home page."""
@@ -224,7 +224,7 @@ class MediaEntryMixin(GenerateSlugMixin, GeneratePublicIDMixin):
         Rendered version of the description, run through
         Markdown and cleaned with our cleaning tool.
         """
-        return cleaned_markdown_conversion(self.description)
+        return rendered_markdown(self, 'description')
 
     def get_display_media(self):
         """Find the best media for display.
@@ -317,6 +317,62 @@ class MediaEntryMixin(GenerateSlugMixin, GeneratePublicIDMixin):
             thumb_url = self._app.staticdirector(manager['default_thumb'])
         return thumb_url
 
+    def alternative_media(self, keyname):
+        """
+        Return the other formats the keyname file is stored in, as
+        (mimetype, url) pairs for <picture> sources, smallest first.
+
+        Formats that came out larger than the file itself are left out.
+        They're stored under "<keyname>@<format>" by the image media type.
+        """
+        size = self.get_file_metadata(keyname, 'bytes')
+        alternatives = []
+        for alt_keyname in self.media_files.keys():
+            if not alt_keyname.startswith(keyname + '@'):
+                continue
+            alt_size = self.get_file_metadata(alt_keyname, 'bytes')
+            if size and alt_size and alt_size >= size:
+                continue
+            alternatives.append((
+                alt_size or 0,
+                'image/' + alt_keyname.split('@', 1)[1],
+                self._app.public_store.file_url(
+                    self.media_files[alt_keyname])))
+
+        return [(mimetype, url)
+                for alt_size, mimetype, url in sorted(alternatives)]
+
+    def image_srcset(self, keyname, mimetype=None):
+        """
+        Return the srcset of the keyname file along with the widths of the
+        srcset ladder ("srcset_<width>" files, see the image media type),
+        or None if there's no ladder.
+
+        If mimetype is one of the alternative formats, the files in that
+        format are used.
+        """
+        suffix = '@' + mimetype.split('/', 1)[1] if mimetype else ''
+        width = (self.get_file_metadata(keyname, 'dimensions') or [None])[0]
+        if not width:
+            return None
+
+        candidates = []
+        for ladder_keyname in self.media_files.keys():
+            if not (ladder_keyname.startswith('srcset_')
+                    and ladder_keyname.endswith(suffix)
+                    and ladder_keyname.count('@') == suffix.count('@')):
+                continue
+            candidates.append((
+                int(ladder_keyname.split('@', 1)[0][7:]),
+                self.media_files[ladder_keyname]))
+        if not candidates or keyname + suffix not in self.media_files:
+            return None
+
+        candidates.append((width, self.media_files[keyname + suffix]))
+        return ', '.join(
+            '{} {}w'.format(self._app.public_store.file_url(filepath), width)
+            for width, filepath in sorted(candidates))
+
     @property
     def original_url(self):
         """ Returns the URL for the original image
@@ -439,7 +495,7 @@ class TextCommentMixin(GeneratePublicIDMixin):
         the actual html-rendered version of the comment displayed.
         Run through Markdown and the HTML cleaner.
         """
-        return cleaned_markdown_conversion(self.content)
+        return rendered_markdown(self, 'content')
 
     def __unicode__(self):
         return '<{klass} #{id} {actor} "{comment}">'.format(
@@ -471,7 +527,7 @@ class CollectionMixin(GenerateSlugMixin, GeneratePublicIDMixin):
         Rendered version of the description, run through
         Markdown and cleaned with our cleaning tool.
         """
-        return cleaned_markdown_conversion(self.description)
+        return rendered_markdown(self, 'description')
 
     @property
     def slug_or_id(self):
@@ -521,7 +577,7 @@ class CollectionItemMixin:
         the actual html-rendered version of the note displayed.
         Run through Markdown and the HTML cleaner.
         """
-        return cleaned_markdown_conversion(self.note)
+        return rendered_markdown(self, 'note')
 
 class ActivityMixin(GeneratePublicIDMixin):
     object_type = "activity"
@@ -24,7 +24,8 @@ import datetime
 
 from sqlalchemy import (
     Column, Integer, Unicode, UnicodeText, DateTime, Boolean, ForeignKey,
-    UniqueConstraint, PrimaryKeyConstraint, SmallInteger, Date, Float)
+    UniqueConstraint, PrimaryKeyConstraint, SmallInteger, Date, Float, Index,
+    event)
 from sqlalchemy.orm import relationship, backref, class_mapper
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.sql import and_
@@ -41,7 +42,8 @@ from mediagoblin.db.mixin import UserMixin, MediaEntryMixin, \
 from mediagoblin.tools.files import delete_media_files
 from mediagoblin.tools.common import import_component
 from mediagoblin.tools.routing import extract_url_arguments
-from mediagoblin.tools.text import convert_to_tag_list_of_dicts
+from mediagoblin.tools.text import convert_to_tag_list_of_dicts, \
+    render_markdown_field
 
 from urllib.parse import urljoin
 from pytz import UTC
@@ -73,10 +75,19 @@ class GenericModelReference(Base):
         if self.model_type is None or self.obj_pk is None:
             return None
 
+        obj = getattr(self, "_cached_object", None)
+        if obj is not None:
+            return obj
+
         model = self._get_model_from_type(self.model_type)
         return model.query.filter_by(id=self.obj_pk).first()
 
+    def cache_object(self, obj):
+        """ Remember obj (loaded in bulk elsewhere) for get_object() """
+        self._cached_object = obj
+
     def set_object(self, obj):
+        self._cached_object = None
         model = obj.__class__
 
         # Check we've been given a object
@@ -237,6 +248,8 @@ class User(Base, UserMixin):
     url = Column(Unicode)
     bio = Column(UnicodeText)
     name = Column(Unicode)
+    rendered_bio = Column(UnicodeText)
+    markdown_version = Column(Integer)
 
     # This is required for the polymorphic inheritance
     type = Column(Unicode)
@@ -306,10 +319,10 @@ class User(Base, UserMixin):
                                 even if the user hasn't been given the
                                 privilege. (defaults to True)
         """
-        priv = Privilege.query.filter_by(privilege_name=privilege).one()
-        if priv in self.all_privileges:
+        privilege_names = self._privilege_names()
+        if privilege in privilege_names:
             return True
-        elif allow_admin and self.has_privilege('admin', allow_admin=False):
+        elif allow_admin and 'admin' in privilege_names:
             return True
 
         return False
@@ -321,7 +334,28 @@ class User(Base, UserMixin):
             :returns                True if self is banned
             :returns                False if self is not
         """
-        return UserBan.query.get(self.id) is not None
+        banned = self.__dict__.get('_banned')
+        if banned is None:
+            banned = self._banned = UserBan.query.get(self.id) is not None
+        return banned
+
+    def _privilege_names(self):
+        privilege_names = self.__dict__.get('_privilege_names_cache')
+        if privilege_names is None:
+            privilege_names = self._privilege_names_cache = frozenset(
+                priv.privilege_name for priv in self.all_privileges)
+        return privilege_names
+
+    def clear_permission_cache(self):
+        """
+        Forget the privileges and ban status remembered by has_privilege()
+        and is_banned().
+
+        This happens whenever the user is expired (e.g. on commit), call it
+        directly after changing privileges or bans without committing.
+        """
+        self.__dict__.pop('_privilege_names_cache', None)
+        self.__dict__.pop('_banned', None)
 
     def serialize(self, request):
         published = UTC.localize(self.created)
@@ -352,6 +386,14 @@ class User(Base, UserMixin):
         if "location" in data:
             Location.create(data, self)
 
+
+@event.listens_for(User, 'expire', propagate=True)
+def _user_expired(user, attrs):
+    # user is None if it has been garbage collected in the meantime
+    if user is not None:
+        user.clear_permission_cache()
+
+
 class LocalUser(User):
     """ This represents a user registered on this instance """
     __tablename__ = "core__local_users"
@@ -371,6 +413,13 @@ class LocalUser(User):
     wants_notifications = Column(Boolean, default=True)
     license_preference = Column(Unicode)
     uploaded = Column(Integer, default=0)
+    # Number of unseen Notifications, kept up to date by
+    # mediagoblin.notifications so the header doesn't have to count them
+    unseen_notifications = Column(Integer, nullable=False, default=0)
+    # Number of MediaEntries in the processing and failed states, kept up
+    # to date by mediagoblin.db.util.update_processing_counts
+    num_processing = Column(Integer, nullable=False, default=0)
+    num_failed = Column(Integer, nullable=False, default=0)
     upload_limit = Column(Integer)
 
     __mapper_args__ = {
@@ -526,6 +575,8 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
     title = Column(Unicode, nullable=False)
     slug = Column(Unicode)
     description = Column(UnicodeText) # ??
+    rendered_description = Column(UnicodeText)
+    markdown_version = Column(Integer)
     media_type = Column(Unicode, nullable=False)
     state = Column(Unicode, default='unprocessed', nullable=False)
         # or use sqlalchemy.types.Enum?
@@ -550,6 +601,9 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
 
     __table_args__ = (
         UniqueConstraint('actor', 'slug'),
+        # For KeysetPagination of user galleries
+        Index('ix_core__media_entries_actor_created_id',
+              'actor', 'created', 'id'),
         {})
 
     deletion_mode = Base.SOFT_DELETE
@@ -623,10 +677,12 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
             GenericModelReference.model_type == self.__tablename__
         ))
 
+        # Sort on the id too so comments added at the same time keep a
+        # stable order across pages.
         if ascending:
-            query = query.order_by(Comment.added.asc())
+            query = query.order_by(Comment.added.asc(), Comment.id.asc())
         else:
-            query = query.order_by(Comment.added.desc())
+            query = query.order_by(Comment.added.desc(), Comment.id.desc())
 
         return query
 
@@ -654,11 +710,13 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
         """
         Return the file_metadata dict of a MediaFile. If metadata_key is given,
         return the value of the key.
+
+        The MediaFile comes from media_files_helper, so looking up several
+        files (or keys) of an entry loads the media files only once.
         """
-        media_file = MediaFile.query.filter_by(media_entry=self.id,
-                                               name=str(file_key)).first()
+        media_file = self.media_files_helper.get(str(file_key))
 
-        if media_file:
+        if media_file and media_file.file_metadata is not None:
             if metadata_key:
                 return media_file.file_metadata.get(metadata_key, None)
 
@@ -668,16 +726,23 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
         """
         Update the file_metadata of a MediaFile.
         """
-        media_file = MediaFile.query.filter_by(media_entry=self.id,
-                                               name=str(file_key)).first()
+        self.set_files_metadata({file_key: kwargs})
 
-        file_metadata = media_file.file_metadata or {}
+    def set_files_metadata(self, files_metadata, commit=True):
+        """
+        Update the file_metadata of several MediaFiles at once.
+
+        files_metadata maps file keys to dicts of metadata to update, all
+        of which get saved with a single flush.
+        """
+        for file_key, metadata in files_metadata.items():
+            media_file = self.media_files_helper[str(file_key)]
 
-        for key, value in kwargs.items():
-            file_metadata[key] = value
+            file_metadata = dict(media_file.file_metadata or {})
+            file_metadata.update(metadata)
+            media_file.file_metadata = file_metadata
 
-        media_file.file_metadata = file_metadata
-        media_file.save()
+        self.save(commit=commit)
 
     @property
     def media_data(self):
@@ -746,8 +811,12 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
             #       This cries for refactoring
             from mediagoblin.db.util import clean_orphan_tags
             clean_orphan_tags(commit=False)
+        state, actor = self.state, self.actor
         # pass through commit=False/True in kwargs
         super().delete(**kwargs)
+        if state in ('processing', 'failed'):
+            from mediagoblin.db.util import update_processing_counts
+            update_processing_counts(actor, commit=kwargs.get('commit', True))
 
     def serialize(self, request, show_comments=True):
         """ Unserialize MediaEntry to object """
@@ -1021,6 +1090,12 @@ class Comment(Base):
     # When it was added
     added = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
 
+    __table_args__ = (
+        # For KeysetPagination of the comments on an object
+        Index('ix_core__comment_links_target_added_id',
+              'target_id', 'added', 'id'),
+        {})
+
     @property
     def get_author(self):
         # for compatibility
@@ -1053,6 +1128,8 @@ class TextComment(Base, TextCommentMixin, CommentingMixin):
     created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     updated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     content = Column(UnicodeText, nullable=False)
+    rendered_content = Column(UnicodeText)
+    markdown_version = Column(Integer)
     location = Column(Integer, ForeignKey("core__locations.id"))
     get_location = relationship("Location", lazy="joined")
 
@@ -1157,6 +1234,8 @@ class Collection(Base, CollectionMixin, CommentingMixin):
                      index=True)
     updated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     description = Column(UnicodeText)
+    rendered_description = Column(UnicodeText)
+    markdown_version = Column(Integer)
     actor = Column(Integer, ForeignKey(User.id), nullable=False)
     num_items = Column(Integer, default=0)
 
@@ -1222,6 +1301,8 @@ class CollectionItem(Base, CollectionItemMixin):
 
     collection = Column(Integer, ForeignKey(Collection.id), nullable=False)
     note = Column(UnicodeText, nullable=True)
+    rendered_note = Column(UnicodeText)
+    markdown_version = Column(Integer)
     added = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     position = Column(Integer)
     # Cascade: CollectionItems are owned by their Collection. So do the full thing.
@@ -1636,6 +1717,26 @@ class Graveyard(Base):
             context["actor"] = self.actor().serialize(request)
 
         return context
+
+
+# The Markdown fields which keep their HTML in a rendered_<field> column,
+# made when the field is set.  See mediagoblin.tools.text.rendered_markdown
+MARKDOWN_FIELDS = [
+    (User, 'bio'), (MediaEntry, 'description'), (TextComment, 'content'),
+    (Collection, 'description'), (CollectionItem, 'note')]
+
+
+def _render_markdown_on_set(field):
+    def render(target, value, oldvalue, initiator):
+        render_markdown_field(target, field, value)
+    return render
+
+
+for model, field in MARKDOWN_FIELDS:
+    event.listen(getattr(model, field), 'set',
+                 _render_markdown_on_set(field), propagate=True)
+
+
 MODELS = [
     LocalUser, RemoteUser, User, MediaEntry, Tag, MediaTag, Comment, TextComment,
     Collection, CollectionItem, MediaFile, FileKeynames, MediaAttachmentFile, MediaSubtitleFile,
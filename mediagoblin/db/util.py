@@ -16,8 +16,12 @@
 
 import sys
 
+from sqlalchemy import func, inspect
+from sqlalchemy.orm import joinedload, selectinload, with_polymorphic
+
 from mediagoblin import mg_globals as mgg
-from mediagoblin.db.models import MediaEntry, Tag, MediaTag, Collection
+from mediagoblin.db.models import MediaEntry, Tag, MediaTag, Collection, \
+    CollectionItem, GenericModelReference, User, LocalUser
 from mediagoblin.gmg_commands.dbupdate import gather_database_data
 
 from mediagoblin.tools.transition import DISABLE_GLOBALS
@@ -36,6 +40,43 @@ def atomic_update(table, query_dict, update_values):
     Session.commit()
 
 
+def update_processing_counts(user_id, commit=True):
+    """
+    Recount how many of a user's media entries are processing or failed
+
+    The counts end up in LocalUser.num_processing and num_failed, which the
+    processing_info plugin shows on every page. Call this whenever the
+    state of a MediaEntry changes.
+    """
+    counts = dict(Session.query(MediaEntry.state, func.count(MediaEntry.id))
+        .filter(MediaEntry.actor == user_id)
+        .filter(MediaEntry.state.in_(('processing', 'failed')))
+        .group_by(MediaEntry.state))
+
+    LocalUser.query.filter_by(id=user_id).update(
+        {'num_processing': counts.get('processing', 0),
+         'num_failed': counts.get('failed', 0)},
+        synchronize_session='evaluate')
+    if commit:
+        Session.commit()
+
+
+def query_validators(query, *columns):
+    """
+    Cheap cache validators for the rows of query
+
+    Returns (values, last_modified), where values is the number of rows and
+    the newest value of each of the (timestamp) columns, to be fed to
+    make_etag(), and last_modified is the newest of those timestamps.
+    """
+    values = tuple(query.order_by(None).with_entities(
+        func.count(), *[func.max(column) for column in columns]).one())
+
+    timestamps = [value for value in values[1:] if value is not None]
+    last_modified = max(timestamps) if timestamps else None
+    return values, last_modified
+
+
 def check_media_slug_used(uploader_id, slug, ignore_m_id):
     query = MediaEntry.query.filter_by(actor=uploader_id, slug=slug)
     if ignore_m_id is not None:
@@ -53,6 +94,66 @@ def media_entries_for_tag_slug(dummy_db, tag_slug):
             & (Tag.slug == tag_slug))
 
 
+def gallery_load_options():
+    """
+    Loader options for MediaEntry queries shown as galleries or feeds
+
+    Thumbnails need the media files, links need the (polymorphic) actor
+    and some listings show tags; loading those up front takes a constant
+    number of queries instead of several per entry.
+    """
+    return (
+        joinedload(MediaEntry.get_actor.of_type(
+            with_polymorphic(User, '*', flat=True))),
+        selectinload(MediaEntry.media_files_helper),
+        selectinload(MediaEntry.tags_helper).joinedload(MediaTag.tag_helper),
+    )
+
+
+def media_data_load_options():
+    """
+    Loader options for the media_data of MediaEntry queries
+
+    Every media type keeps its media_data in a table of its own, behind a
+    "<media type>__media_data" backref of MediaEntry.  Each of them is
+    loaded with one query for all of the entries, instead of one query per
+    entry.
+    """
+    return tuple(
+        selectinload(getattr(MediaEntry, key))
+        for key in inspect(MediaEntry).relationships.keys()
+        if key.endswith('__media_data'))
+
+
+def collection_item_load_options():
+    """
+    Loader options for CollectionItem queries, see
+    load_collection_item_objects()
+    """
+    return (joinedload(CollectionItem.object_helper),)
+
+
+def load_collection_item_objects(collection_items):
+    """
+    Load the objects of a page of CollectionItems with one query per type
+
+    Afterwards item.get_object() doesn't have to hit the database.
+    """
+    gmrs_by_type = {}
+    for item in collection_items:
+        gmr = item.object_helper
+        gmrs_by_type.setdefault(gmr.model_type, {})[gmr.obj_pk] = gmr
+
+    for model_type, gmrs in gmrs_by_type.items():
+        model = GenericModelReference()._get_model_from_type(model_type)
+        query = model.query.filter(model.id.in_(list(gmrs)))
+        if model is MediaEntry:
+            query = query.options(*gallery_load_options())
+
+        for obj in query:
+            gmrs[obj.id].cache_object(obj)
+
+
 def clean_orphan_tags(commit=True):
     """Search for unused MediaTags and delete them"""
     q1 = Session.query(Tag).outerjoin(MediaTag).filter(MediaTag.id==None)
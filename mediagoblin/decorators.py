@@ -25,6 +25,7 @@ from mediagoblin import mg_globals as mgg
 from mediagoblin import messages
 from mediagoblin.db.models import (
     MediaEntry, LocalUser, AccessToken, Comment)
+from mediagoblin.tools.pagination import get_pagination_marker
 from mediagoblin.tools.response import (
     redirect, render_404,
     render_user_banned, json_response)
@@ -157,6 +158,9 @@ def user_may_alter_collection(controller):
 def uses_pagination(controller):
     """
     Check request GET 'page' key for wrong values
+
+    Also decodes the 'before'/'after' markers used by KeysetPagination
+    into request.pagination_marker.
     """
     @wraps(controller)
     def wrapper(request, *args, **kwargs):
@@ -164,6 +168,7 @@ def uses_pagination(controller):
             page = int(request.GET.get('page', 1))
             if page < 0:
                 return render_404(request)
+            request.pagination_marker = get_pagination_marker(request.GET)
         except ValueError:
             return render_404(request)
 
@@ -84,6 +84,8 @@ def edit_media(request, media):
 
             media.license = str(form.license.data) or None
             media.slug = slug
+            # Feeds and the API use this to tell clients what changed
+            media.updated = datetime.utcnow()
             media.save()
 
             return redirect_obj(request, media)
@@ -383,6 +385,7 @@ def edit_collection(request, collection):
             collection.title = str(form.title.data)
             collection.description = str(form.description.data)
             collection.slug = str(form.slug.data)
+            collection.updated = datetime.utcnow()
 
             collection.save()
 
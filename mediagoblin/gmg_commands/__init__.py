@@ -78,6 +78,10 @@ SUBCOMMAND_MAP = {
         'setup': 'mediagoblin.gmg_commands.batchaddmedia:parser_setup',
         'func': 'mediagoblin.gmg_commands.batchaddmedia:batchaddmedia',
         'help': 'Add many media entries at once'},
+    'rendermarkdown': {
+        'setup': 'mediagoblin.gmg_commands.rendermarkdown:parser_setup',
+        'func': 'mediagoblin.gmg_commands.rendermarkdown:rendermarkdown',
+        'help': 'Store the HTML of Markdown fields made by an older renderer'},
     'alembic': {
         'setup': 'mediagoblin.gmg_commands.alembic_commands:parser_setup',
         'func': 'mediagoblin.gmg_commands.alembic_commands:raw_alembic_cli',
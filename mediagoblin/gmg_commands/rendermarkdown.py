@@ -0,0 +1,74 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy import or_
+
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import MARKDOWN_FIELDS
+from mediagoblin.gmg_commands import util as commands_util
+from mediagoblin.tools.text import MARKDOWN_RENDERER_VERSION, \
+    render_markdown_field
+
+
+def parser_setup(subparser):
+    subparser.add_argument(
+        '--all',
+        action='store_true',
+        help='Render all of the Markdown again, not just the outdated HTML')
+    subparser.add_argument(
+        '--batch-size',
+        type=int,
+        default=100,
+        help='Number of rows to render per transaction')
+
+
+def render_markdown_fields(model, field, all_rows=False, batch_size=100):
+    """
+    Store the HTML of model.<field> for every row where it's missing or
+    made by another renderer version (or every row at all, with all_rows)
+
+    Returns the number of rows rendered.
+    """
+    query = model.query.order_by(model.id)
+    if not all_rows:
+        query = query.filter(or_(
+            model.markdown_version == None,
+            model.markdown_version != MARKDOWN_RENDERER_VERSION))
+
+    rendered = 0
+    last_id = 0
+    while True:
+        batch = query.filter(model.id > last_id).limit(batch_size).all()
+        if not batch:
+            return rendered
+
+        for obj in batch:
+            render_markdown_field(obj, field, getattr(obj, field))
+        last_id = batch[-1].id
+        rendered += len(batch)
+        Session.commit()
+
+
+def rendermarkdown(args):
+    commands_util.setup_app(args)
+
+    for model, field in MARKDOWN_FIELDS:
+        rendered = render_markdown_fields(
+            model, field, all_rows=args.all, batch_size=args.batch_size)
+        print('Rendered {} {}.{} field(s).'.format(
+            rendered, model.__name__, field))
+
+    print('Done.')
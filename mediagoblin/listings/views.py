@@ -16,12 +16,15 @@
 
 from mediagoblin import mg_globals
 from mediagoblin.db.models import MediaEntry
-from mediagoblin.db.util import media_entries_for_tag_slug
+from mediagoblin.db.util import media_entries_for_tag_slug, \
+    gallery_load_options, query_validators
 from mediagoblin.decorators import uses_pagination
 from mediagoblin.plugins.api.tools import get_media_file_paths
-from mediagoblin.tools.feeds import AtomFeedWithLinks
-from mediagoblin.tools.pagination import Pagination
-from mediagoblin.tools.response import render_to_response
+from mediagoblin.tools.feeds import AtomFeedWithLinks, get_cached_feed, \
+    cache_feed
+from mediagoblin.tools.pagination import KeysetPagination
+from mediagoblin.tools.response import render_to_response, make_etag, \
+    not_modified_response, add_validators
 from mediagoblin.tools.translate import pass_to_ugettext as _
 
 from werkzeug.wrappers import Response
@@ -48,10 +51,12 @@ def tag_listing(request, page):
     """'Gallery'/listing for this tag slug"""
     tag_slug = request.matchdict['tag']
 
-    cursor = media_entries_for_tag_slug(request.db, tag_slug)
-    cursor = cursor.order_by(MediaEntry.created.desc())
+    cursor = media_entries_for_tag_slug(request.db, tag_slug) \
+        .options(*gallery_load_options())
 
-    pagination = Pagination(page, cursor)
+    pagination = KeysetPagination(
+        page, cursor, (MediaEntry.created, MediaEntry.id),
+        marker=request.pagination_marker)
     media_entries = pagination()
 
     tag_name = _get_tag_name_from_entries(media_entries, tag_slug)
@@ -83,8 +88,22 @@ def atom_feed(request):
         feed_title += " for all recent items"
         link = request.urlgen('index', qualified=True)
         cursor = MediaEntry.query.filter_by(state='processed')
+
+    validators, last_modified = query_validators(
+        cursor, MediaEntry.created, MediaEntry.updated)
+    etag = make_etag(validators)
+    not_modified = not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    feed_data = get_cached_feed(request, etag)
+    if feed_data is not None:
+        response = Response(feed_data, mimetype='application/atom+xml')
+        return add_validators(response, etag, last_modified)
+
     cursor = cursor.order_by(MediaEntry.created.desc())
     cursor = cursor.limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
+    cursor = cursor.options(*gallery_load_options())
 
     """
     ATOM feed id is a tag URI (see http://en.wikipedia.org/wiki/Tag_URI)
@@ -130,8 +149,8 @@ def atom_feed(request):
             updateddate=entry.get('created'),
         )
 
-    response = Response(
-        feed.writeString(encoding='utf-8'),
-        mimetype='application/atom+xml'
-    )
-    return response
+    feed_data = feed.writeString(encoding='utf-8')
+    cache_feed(request, etag, feed_data)
+
+    response = Response(feed_data, mimetype='application/atom+xml')
+    return add_validators(response, etag, last_modified)
@@ -136,10 +136,15 @@ def type_match_handler(media_file, filename):
     raise TypeNotFound(_('Sorry, I don\'t support that file type :('))
 
 
-def sniff_media(media_file, filename):
+def sniff_media(media_file, filename, media_data=None):
     '''
     Iterate through the enabled media types and find those suited
     for a certain file.
+
+    Sniffers can leave what they found out about the file, as keyword
+    arguments for MediaEntry.media_data_init(), in the sniffed_media_data
+    attribute of the file they check.  If media_data is a dict, that gets
+    added to it.
     '''
     # copy the contents to a .name-enabled temporary file for further checks
     # TODO: there are cases when copying is not required
@@ -147,6 +152,13 @@ def sniff_media(media_file, filename):
     shutil.copyfileobj(media_file, tmp_media_file)
     media_file.seek(0)
     tmp_media_file.seek(0)
+    result = _sniff_media(tmp_media_file, filename)
+    if media_data is not None:
+        media_data.update(getattr(tmp_media_file, 'sniffed_media_data', {}))
+    return result
+
+
+def _sniff_media(tmp_media_file, filename):
     try:
         return type_match_handler(tmp_media_file, filename)
     except TypeNotFound as e:
@@ -42,6 +42,8 @@ SPECTROGRAM_WIDTH_PERSECOND = [(240, (  0,     20)),
                                (  6, (240, 100000))] # Upper limit is arbitrary. Sounds with longer
                                                      # duration will still get assigned to the last bucket
 SPECTROGRAM_HEIGHT = 500
+# Number of audio blocks whose FFT is computed at once
+BATCH_SIZE = 256
 
 class AudioBlocksFFT:
 
@@ -74,57 +76,84 @@ class AudioBlocksFFT:
         """
         return self.totalSamples / self.sampleRate
 
+    def totalBlocks(self):
+        """
+        Number of blocks the audio data is read in
+        """
+        if self.totalSamples == 0:
+            return 0
+        # The first block is read whole, the following ones only past the overlap
+        step = self.blockSize - self.overlap
+        return 1 + -(-max(0, self.totalSamples - self.blockSize) // step)
+
     def _filterFreqRange(self, fftAmplitude):
         """
-        Given a FFT amplitudes array keep only bins between minFreq, maxFreq
+        Given FFT amplitudes, one row per block, keep only bins between minFreq, maxFreq
         """
         nyquistFreq = self.sampleRate // 2
-        numBins = len(fftAmplitude)
+        numBins = fftAmplitude.shape[-1]
         sliceWidth = nyquistFreq / numBins
         startIdx = int(self.minFreq / sliceWidth)
         endIdx = int(self.maxFreq / sliceWidth)
         if numBins <= endIdx:
-            fftAmplitude = numpy.pad(fftAmplitude, (0, 1 + endIdx - numBins), 'constant', constant_values=(0))
+            fftAmplitude = numpy.pad(fftAmplitude, ((0, 0), (0, 1 + endIdx - numBins)), 'constant', constant_values=(0))
         else:
-            fftAmplitude = fftAmplitude[:endIdx + 1]
-        return fftAmplitude[startIdx:]
+            fftAmplitude = fftAmplitude[:, :endIdx + 1]
+        return fftAmplitude[:, startIdx:]
 
     def _resizeAmplitudeArray(self, amplitudeValues, newSize):
         """
-        Resize amplitude values array
+        Resize the rows of an amplitude values array
         """
-        if len(amplitudeValues) == newSize:
+        length = amplitudeValues.shape[-1]
+        if length == newSize:
             return amplitudeValues
-        if newSize > len(amplitudeValues):
+        if newSize > length:
             # Resize up
-            result = numpy.zeros(newSize)
-            for idx in range(0, newSize):
-                srcIdx = (idx * len(amplitudeValues)) // newSize
-                result[idx] = amplitudeValues[srcIdx]
-            return result
-        # Resize down keeping peaks
-        result = numpy.zeros(newSize)
-        idx = 0
-        for slice in numpy.array_split(amplitudeValues, newSize):
-            result[idx] = slice.max()
-            idx = idx + 1
-        return result
+            return amplitudeValues[..., (numpy.arange(newSize) * length) // newSize]
+        # Resize down keeping peaks, in the slices numpy.array_split would make
+        sliceSize, numLarger = divmod(length, newSize)
+        sliceSizes = numpy.repeat([sliceSize + 1, sliceSize], [numLarger, newSize - numLarger])
+        sliceStarts = numpy.concatenate(([0], numpy.cumsum(sliceSizes)[:-1]))
+        return numpy.maximum.reduceat(amplitudeValues, sliceStarts, axis=-1)
+
+    def _readBlocks(self):
+        """
+        Read the audio data in batches of BATCH_SIZE blocks, mixed down to mono
+        """
+        batch = []
+        for fileBlock in self.audioData.blocks(blocksize = self.blockSize, overlap = self.overlap,
+                                               always_2d = True):
+            # On the last block it may be necessary to pad with zeros
+            if len(fileBlock) < self.blockSize:
+                fileBlock = numpy.pad(fileBlock, ((0, self.blockSize - len(fileBlock)), (0, 0)), 'constant', constant_values=(0))
+            batch.append(fileBlock)
+            if len(batch) == BATCH_SIZE:
+                yield self._mixDown(numpy.stack(batch))
+                batch = []
+        if batch:
+            yield self._mixDown(numpy.stack(batch))
+
+    def _mixDown(self, fileBlocks):
+        """
+        Mix down all channels of a batch of blocks to mono
+        """
+        # Add the channels in order, so the result doesn't depend on how
+        # numpy would pair them up in a sum()
+        audioBlocks = fileBlocks[:, :, 0]
+        for channel in range(1, self.numChannels):
+            audioBlocks = audioBlocks + fileBlocks[:, :, channel]
+        return audioBlocks
 
     def __iter__(self):
         """
-        Read a block of audio data and compute FFT amplitudes
+        Read batches of audio blocks and compute their FFT amplitudes, one
+        row per block
         """
         self.audioData.seek(0)
-        for fileBlock in self.audioData.blocks(blocksize = self.blockSize, overlap = self.overlap):
-            # Mix down all channels to mono
-            audioBlock = fileBlock[:,0]
-            for channel in range(1, self.numChannels):
-                audioBlock = numpy.add(audioBlock, fileBlock[:,channel])
-            # On the last block it may be necessary to pad with zeros
-            if len(audioBlock) < self.blockSize:
-                audioBlock = numpy.pad(audioBlock, (0, self.blockSize - len(audioBlock)), 'constant', constant_values=(0))
-            # Compute FFT amplitude of this block
-            fftAmplitude = self._filterFreqRange(numpy.abs(numpy.fft.rfft(audioBlock * self.windowValues)))
+        for audioBlocks in self._readBlocks():
+            # Compute FFT amplitude of these blocks
+            fftAmplitude = self._filterFreqRange(numpy.abs(numpy.fft.rfft(audioBlocks * self.windowValues, axis=-1)))
             self.peakFFTValue = max(self.peakFFTValue, fftAmplitude.max())
             # Resize if requested
             if not self.numBins is None:
@@ -162,22 +191,20 @@ class SpectrogramColorMap:
         for i in range(1, len(colorPoints)):
             for p in range(0, 200):
                 self.colors.append(self._colorBetween(colorPoints[i - 1], colorPoints[i], p / 200))
+        self.palette = numpy.array(self.colors, dtype=numpy.uint8)
 
     def getColorData(self, progressCallback = None):
         """
-        Map spectrogram data to pixel colors
+        Map spectrogram data to pixel colors, as an array of height rows
+        of width RGB values
         """
-        pixels = [self.colors[0]] * (self.width * self.height)
-        for x in range(0, self.width):
-            for y in range(0, self.height):
-                idx = x + self.width * y
-                amplitudeVal = self.columnData[x][self.height - y - 1]
-                colorIdx = int(len(self.colors) * amplitudeVal)
-                colorIdx = colorIdx if colorIdx > 0 else 0
-                colorIdx = colorIdx if colorIdx < len(self.colors) else len(self.colors) - 1
-                pixels[idx] = self.colors[colorIdx]
-            if progressCallback:
-                progressCallback(100 * x / self.width)
+        amplitudeValues = numpy.asarray(self.columnData)
+        colorIdx = numpy.clip((len(self.colors) * amplitudeValues).astype(numpy.intp),
+                              0, len(self.colors) - 1)
+        # Columns become rows, with the lowest frequencies at the bottom
+        pixels = self.palette[colorIdx.T[::-1]]
+        if progressCallback:
+            progressCallback(100)
         return pixels
 
 def drawSpectrogram(audioFileName, imageFileName, fftSize = 1024, fftOverlap = 0, progressCallback = None):
@@ -216,21 +243,7 @@ def drawSpectrogram(audioFileName, imageFileName, fftSize = 1024, fftOverlap = 0
                                      minFreq = SPECTROGRAM_MIN_FREQUENCY, maxFreq = SPECTROGRAM_MAX_FREQUENCY,
                                      numBins = imageHeight)
     soundLength = fftBlocksSource.totalSeconds()
-    fftAmplitudeBlocks = []
-    for fftAmplitude, positionSeconds in fftBlocksSource:
-        fftAmplitudeBlocks.append(fftAmplitude)
-        wrapProgressCallback(STEP_PERCENTAGE_FFT * (positionSeconds / soundLength))
-
-    totalProgress = STEP_PERCENTAGE_FFT
-
-    # Normalize FFT amplitude and convert to log scale
-    specRange = SPECTROGRAM_DB_RANGE
-    for i in range(0, len(fftAmplitudeBlocks)):
-        normalized = numpy.divide(fftAmplitudeBlocks[i], fftBlocksSource.peakFFTAmplitude())
-        fftAmplitudeBlocks[i] = ((20*(numpy.log10(normalized + 1e-60))).clip(-specRange, 0.0) + specRange)/specRange
-        wrapProgressCallback(totalProgress + STEP_PERCENTAGE_NORMALIZE * (i / len(fftAmplitudeBlocks)))
-
-    totalProgress = totalProgress + STEP_PERCENTAGE_NORMALIZE
+    numBlocks = fftBlocksSource.totalBlocks()
 
     # Compute spectrogram width in pixels
     imageWidthPerSecond, lengthRage = imageWidthLookup[-1]
@@ -241,32 +254,45 @@ def drawSpectrogram(audioFileName, imageFileName, fftSize = 1024, fftOverlap = 0
             break
     imageWidth = int(imageWidthPerSecond * soundLength)
 
-    # Compute spectrogram values
-    columnValues = numpy.zeros(imageHeight)
-    spectrogram = []
-    x = 0
-    for idx in range(0, len(fftAmplitudeBlocks)):
-        newX = (idx * imageWidth) // len(fftAmplitudeBlocks)
-        if newX != x:
-            # Save column
-            spectrogram.append(numpy.copy(columnValues))
-            x = newX
-            columnValues.fill(0)
-        columnValues = numpy.maximum(columnValues, fftAmplitudeBlocks[idx])
-        wrapProgressCallback(totalProgress + STEP_PERCENTAGE_ACCUMULATE * (idx / len(fftAmplitudeBlocks)))
-    spectrogram.append(numpy.copy(columnValues))
-
-    totalProgress = totalProgress + STEP_PERCENTAGE_ACCUMULATE
+    # Compute spectrogram values while reading: each column keeps the peaks
+    # of the blocks that fall on the same x, so only one row per column is
+    # held no matter how long the audio is
+    columnValues = numpy.zeros((max(1, imageWidth), imageHeight))
+    usedColumns = numpy.zeros(max(1, imageWidth), dtype=bool)
+    usedColumns[0] = True
+    firstIdx = 0
+    for fftAmplitude, positionSeconds in fftBlocksSource:
+        blockX = ((firstIdx + numpy.arange(len(fftAmplitude))) * imageWidth) // max(1, numBlocks)
+        # In case the file holds more audio than its header says
+        blockX = blockX.clip(0, len(columnValues) - 1)
+        columnStarts = numpy.flatnonzero(numpy.diff(blockX, prepend=-1))
+        columnX = blockX[columnStarts]
+        columnValues[columnX] = numpy.maximum(
+            columnValues[columnX], numpy.maximum.reduceat(fftAmplitude, columnStarts, axis=0))
+        usedColumns[columnX] = True
+        firstIdx = firstIdx + len(fftAmplitude)
+        wrapProgressCallback((STEP_PERCENTAGE_FFT + STEP_PERCENTAGE_ACCUMULATE)
+                             * (positionSeconds / soundLength))
+    spectrogram = columnValues[usedColumns]
+
+    totalProgress = STEP_PERCENTAGE_FFT + STEP_PERCENTAGE_ACCUMULATE
+
+    # Normalize FFT amplitude and convert to log scale.  This keeps the order
+    # of the values, so it may as well be done after taking the peaks.
+    specRange = SPECTROGRAM_DB_RANGE
+    normalized = numpy.divide(spectrogram, fftBlocksSource.peakFFTAmplitude())
+    spectrogram = ((20*(numpy.log10(normalized + 1e-60))).clip(-specRange, 0.0) + specRange)/specRange
+
+    totalProgress = totalProgress + STEP_PERCENTAGE_NORMALIZE
+    wrapProgressCallback(totalProgress)
 
     # Draw spectrogram
-    imageWidth = len(spectrogram)
     colorData = SpectrogramColorMap(spectrogram).getColorData(progressCallback = mapColorsProgressCallback)
 
     totalProgress = totalProgress + STEP_PERCENTAGE_DRAW
 
     # Save final image
-    image = Image.new('RGB', (imageWidth, imageHeight))
-    image.putdata(colorData)
+    image = Image.fromarray(colorData, 'RGB')
     image.save(imageFileName)
 
     if progressCallback:
@@ -27,6 +27,7 @@ from mediagoblin.processing import (
 
 from mediagoblin.media_types.audio.transcoders import (
     AudioTranscoder, AudioThumbnailer)
+from mediagoblin.media_types.audio.waveform import write_waveform
 from mediagoblin.media_types.tools import discover
 
 _log = logging.getLogger(__name__)
@@ -68,6 +69,11 @@ class CommonAudioProcessor(MediaProcessor):
         self.transcoder = AudioTranscoder()
         self.thumbnailer = AudioThumbnailer()
 
+        # The decoded audio and the spectrogram, once they're made in the
+        # workbench, so they don't need to be made again
+        self.decoded_filename = None
+        self.spectrogram_filename = None
+
     def copy_original(self):
         if self.audio_config['keep_original']:
             copy_original(
@@ -103,10 +109,19 @@ class CommonAudioProcessor(MediaProcessor):
         elif keyname == 'thumb':
             if kwargs.get('size') != file_metadata.get('size'):
                 skip = False
+        elif keyname == 'waveform':
+            if kwargs.get('points') != file_metadata.get('points'):
+                skip = False
 
         return skip
 
-    def transcode(self, quality=None):
+    def transcode(self, quality=None, keep_decoded=False):
+        """
+        Transcode the audio to webm
+
+        If keep_decoded is set, the decoded audio is written to the workbench
+        from the same pass, for the spectrogram and waveform.
+        """
         if not quality:
             quality = self.audio_config['quality']
 
@@ -117,12 +132,20 @@ class CommonAudioProcessor(MediaProcessor):
         webm_audio_tmp = os.path.join(self.workbench.dir,
                                       self.name_builder.fill(
                                           '{basename}{ext}'))
+        decoded_tmp = None
+        if keep_decoded and not self.decoded_filename:
+            decoded_tmp = os.path.join(self.workbench.dir,
+                                       self.name_builder.fill(
+                                           '{basename}-decoded.wav'))
 
         self.transcoder.transcode(
             self.process_filename,
             webm_audio_tmp,
             quality=quality,
-            progress_callback=progress_callback)
+            progress_callback=progress_callback,
+            pcm_dst=decoded_tmp)
+        if decoded_tmp:
+            self.decoded_filename = decoded_tmp
 
         self._keep_best()
 
@@ -132,6 +155,20 @@ class CommonAudioProcessor(MediaProcessor):
 
         self.entry.set_file_metadata('webm_audio', **{'quality': quality})
 
+    def decode(self):
+        """
+        Get the decoded audio, decoding it if the transcode didn't
+        """
+        if not self.decoded_filename:
+            _log.info('Decoding audio')
+            decoded_tmp = os.path.join(self.workbench.dir,
+                                       self.name_builder.fill(
+                                           '{basename}-decoded.wav'))
+            self.transcoder.transcode(self.process_filename, None,
+                                      pcm_dst=decoded_tmp)
+            self.decoded_filename = decoded_tmp
+        return self.decoded_filename
+
     def create_spectrogram(self, max_width=None, fft_size=None):
         if not max_width:
             max_width = mgg.global_config['media:medium']['max_width']
@@ -141,16 +178,11 @@ class CommonAudioProcessor(MediaProcessor):
         if self._skip_processing('spectrogram', max_width=max_width,
                                  fft_size=fft_size):
             return
-        wav_tmp = os.path.join(self.workbench.dir, self.name_builder.fill(
-            '{basename}.ogg'))
-        _log.info('Creating OGG source for spectrogram')
-        self.transcoder.transcode(self.process_filename, wav_tmp,
-                                  mux_name='oggmux')
         spectrogram_tmp = os.path.join(self.workbench.dir,
                                        self.name_builder.fill(
                                            '{basename}-spectrogram.jpg'))
         self.thumbnailer.spectrogram(
-            wav_tmp,
+            self.decode(),
             spectrogram_tmp,
             width=max_width,
             fft_size=fft_size)
@@ -162,6 +194,28 @@ class CommonAudioProcessor(MediaProcessor):
         file_metadata = {'max_width': max_width,
                          'fft_size': fft_size}
         self.entry.set_file_metadata('spectrogram', **file_metadata)
+        self.spectrogram_filename = spectrogram_tmp
+
+    def create_waveform(self, points=None):
+        """
+        Store the peaks of the audio for the player to draw its waveform
+        """
+        if not points:
+            points = self.audio_config['waveform_points']
+
+        if self._skip_processing('waveform', points=points):
+            return
+
+        waveform_tmp = os.path.join(self.workbench.dir,
+                                    self.name_builder.fill(
+                                        '{basename}-waveform.json'))
+        write_waveform(self.decode(), waveform_tmp, points)
+
+        _log.debug('Saving waveform...')
+        store_public(self.entry, 'waveform', waveform_tmp,
+                     self.name_builder.fill('{basename}.waveform.json'))
+
+        self.entry.set_file_metadata('waveform', **{'points': points})
 
     def generate_thumb(self, size=None):
         if not size:
@@ -180,9 +234,11 @@ class CommonAudioProcessor(MediaProcessor):
         if not spectrogram:
             _log.info('No spectrogram found, we will create one.')
             self.create_spectrogram()
-            spectrogram = self.entry.media_files['spectrogram']
 
-        spectrogram_filepath = mgg.public_store.get_local_path(spectrogram)
+        spectrogram_filepath = self.spectrogram_filename
+        if not spectrogram_filepath:
+            spectrogram_filepath = mgg.public_store.get_local_path(
+                self.entry.media_files['spectrogram'])
 
         self.thumbnailer.thumbnail_spectrogram(
             spectrogram_filepath,
@@ -240,22 +296,30 @@ class InitialProcessor(CommonAudioProcessor):
             type=int,
             help='The width of the spectogram')
 
+        parser.add_argument(
+            '--waveform_points',
+            type=int,
+            help='Number of peaks in the waveform')
+
         return parser
 
     @classmethod
     def args_to_request(cls, args):
         return request_from_args(
             args, ['quality', 'fft_size',
-                   'thumb_size', 'medium_width'])
+                   'thumb_size', 'medium_width', 'waveform_points'])
 
     def process(self, quality=None, fft_size=None, thumb_size=None,
-                medium_width=None):
+                medium_width=None, waveform_points=None):
         self.common_setup()
 
-        self.transcode(quality=quality)
+        # The spectrogram and waveform follow, so decode for them in the
+        # same pass
+        self.transcode(quality=quality, keep_decoded=True)
         self.copy_original()
 
         self.create_spectrogram(max_width=medium_width, fft_size=fft_size)
+        self.create_waveform(points=waveform_points)
         self.generate_thumb(size=thumb_size)
 
         self.delete_queue_file()
@@ -301,25 +365,33 @@ class Resizer(CommonAudioProcessor):
             type=int,
             help='The width of the spectogram')
 
+        parser.add_argument(
+            '--waveform_points',
+            type=int,
+            help='Number of peaks in the waveform')
+
         parser.add_argument(
             'file',
-            choices=['thumb', 'spectrogram'])
+            choices=['thumb', 'spectrogram', 'waveform'])
 
         return parser
 
     @classmethod
     def args_to_request(cls, args):
         return request_from_args(
-            args, ['thumb_size', 'file', 'fft_size', 'medium_width'])
+            args, ['thumb_size', 'file', 'fft_size', 'medium_width',
+                   'waveform_points'])
 
     def process(self, file, thumb_size=None, fft_size=None,
-                medium_width=None):
+                medium_width=None, waveform_points=None):
         self.common_setup()
 
         if file == 'thumb':
             self.generate_thumb(size=thumb_size)
         elif file == 'spectrogram':
             self.create_spectrogram(max_width=medium_width, fft_size=fft_size)
+        elif file == 'waveform':
+            self.create_waveform(points=waveform_points)
 
 
 class Transcoder(CommonAudioProcessor):
@@ -92,14 +92,21 @@ class AudioTranscoder:
         self._failed = None
 
     def transcode(self, src, dst, mux_name='webmmux',quality=0.3,
-                  progress_callback=None, **kw):
+                  progress_callback=None, pcm_dst=None, **kw):
+        """
+        Transcode src into dst, with vorbis in a mux_name container.
+
+        If pcm_dst is given, the decoded audio is also written there as a
+        16 bit WAV file, from the same decoding.  dst may then be None to only
+        decode.
+        """
         def _on_pad_added(element, pad, connect_to):
             caps = pad.query_caps(None)
             name = caps.to_string()
             _log.debug(f'on_pad_added: {name}')
             if name.startswith('audio') and not connect_to.is_linked():
                 pad.link(connect_to)
-        _log.info(f'Transcoding {src} into {dst}')
+        _log.info(f'Transcoding {src} into {dst or pcm_dst}')
         self.__on_progress = progress_callback
         # Set up pipeline
         tolerance = 80000000
@@ -119,16 +126,12 @@ class AudioTranscoder:
         caps.append_structure(caps_struct)
         capsfilter = Gst.ElementFactory.make('capsfilter', 'capsfilter')
         capsfilter.set_property('caps', caps)
-        enc = Gst.ElementFactory.make('vorbisenc', 'enc')
-        enc.set_property('quality', quality)
-        mux = Gst.ElementFactory.make(mux_name, 'mux')
+        tee = Gst.ElementFactory.make('tee', 'tee')
         progressreport = Gst.ElementFactory.make('progressreport', 'progress')
         progressreport.set_property('silent', True)
-        sink = Gst.ElementFactory.make('filesink', 'sink')
-        sink.set_property('location', dst)
         # add to pipeline
         for e in [filesrc, decodebin, queue, audiorate, audioconvert,
-                  capsfilter, enc, mux, progressreport, sink]:
+                  capsfilter, tee, progressreport]:
             self.pipeline.add(e)
         # link elements
         filesrc.link(decodebin)
@@ -136,10 +139,46 @@ class AudioTranscoder:
         queue.link(audiorate)
         audiorate.link(audioconvert)
         audioconvert.link(capsfilter)
-        capsfilter.link(enc)
-        enc.link(mux)
-        mux.link(progressreport)
-        progressreport.link(sink)
+        capsfilter.link(tee)
+        if dst:
+            enc_queue = Gst.ElementFactory.make('queue', 'enc_queue')
+            enc = Gst.ElementFactory.make('vorbisenc', 'enc')
+            enc.set_property('quality', quality)
+            mux = Gst.ElementFactory.make(mux_name, 'mux')
+            sink = Gst.ElementFactory.make('filesink', 'sink')
+            sink.set_property('location', dst)
+            for e in [enc_queue, enc, mux, sink]:
+                self.pipeline.add(e)
+            tee.link(enc_queue)
+            enc_queue.link(enc)
+            enc.link(mux)
+            mux.link(progressreport)
+            progressreport.link(sink)
+        if pcm_dst:
+            pcm_queue = Gst.ElementFactory.make('queue', 'pcm_queue')
+            pcm_convert = Gst.ElementFactory.make('audioconvert',
+                                                  'pcm_convert')
+            # 16 bit samples, so an hour of stereo is about 635 MB rather
+            # than twice that as floats, and hours more fit in a WAV file
+            pcm_caps = Gst.Caps.from_string('audio/x-raw,format=S16LE')
+            pcm_capsfilter = Gst.ElementFactory.make('capsfilter',
+                                                     'pcm_capsfilter')
+            pcm_capsfilter.set_property('caps', pcm_caps)
+            wavenc = Gst.ElementFactory.make('wavenc', 'wavenc')
+            pcm_sink = Gst.ElementFactory.make('filesink', 'pcm_sink')
+            pcm_sink.set_property('location', pcm_dst)
+            for e in [pcm_queue, pcm_convert, pcm_capsfilter, wavenc,
+                      pcm_sink]:
+                self.pipeline.add(e)
+            tee.link(pcm_queue)
+            pcm_queue.link(pcm_convert)
+            pcm_convert.link(pcm_capsfilter)
+            pcm_capsfilter.link(wavenc)
+            if dst:
+                wavenc.link(pcm_sink)
+            else:
+                wavenc.link(progressreport)
+                progressreport.link(pcm_sink)
         self.bus = self.pipeline.get_bus()
         self.bus.add_signal_watch()
         self.bus.connect('message', self.__on_bus_message)
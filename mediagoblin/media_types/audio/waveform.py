@@ -0,0 +1,65 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+import numpy
+import soundfile
+
+# Points of audio data read at a time
+BLOCK_POINTS = 256
+
+
+def waveform_peaks(audio_filename, num_points):
+    """
+    Get the minimum and maximum sample of each of about num_points equal
+    slices of the audio file, all channels mixed down.
+
+    Returns a dict in the JSON format of BBC's audiowaveform, which
+    waveform players such as peaks.js read: 'data' holds the minimum and
+    maximum of each slice in turn, as 8 bit values.
+    """
+    with soundfile.SoundFile(audio_filename, 'r') as audio:
+        samples_per_pixel = max(1, -(-audio.frames // num_points))
+        data = []
+        for block in audio.blocks(
+                blocksize=samples_per_pixel * BLOCK_POINTS, always_2d=True):
+            samples = block.mean(axis=1)
+            starts = numpy.arange(0, len(samples), samples_per_pixel)
+            peaks = numpy.empty((len(starts), 2))
+            peaks[:, 0] = numpy.minimum.reduceat(samples, starts)
+            peaks[:, 1] = numpy.maximum.reduceat(samples, starts)
+            data.extend(
+                numpy.round(peaks * 127).clip(-128, 127).astype(int).ravel()
+                .tolist())
+
+        return {
+            'version': 2,
+            'channels': 1,
+            'sample_rate': audio.samplerate,
+            'samples_per_pixel': samples_per_pixel,
+            'bits': 8,
+            'length': len(data) // 2,
+            'data': data}
+
+
+def write_waveform(audio_filename, waveform_filename, num_points):
+    """
+    Write the waveform_peaks of audio_filename to waveform_filename as JSON
+    """
+    with open(waveform_filename, 'w') as waveform_file:
+        json.dump(waveform_peaks(audio_filename, num_points), waveform_file,
+                  separators=(',', ':'))
@@ -37,6 +37,7 @@ from mediagoblin.tools.text import (
     cleaned_markdown_conversion)
 
 from mediagoblin.db.models import MediaEntry, LocalUser
+from mediagoblin.db.util import update_processing_counts
 
 from mediagoblin.notifications import add_comment_subscription
 
@@ -145,6 +146,7 @@ def blogpost_create(request):
 
         set_blogpost_state(request, blogpost)
         blogpost.save()
+        update_processing_counts(request.user.id)
 
         # connect this blogpost to its blog
         blog_post_data = request.db.BlogPostData()
@@ -196,6 +198,7 @@ def blogpost_edit(request):
         set_blogpost_state(request, blogpost)
         blogpost.generate_slug()
         blogpost.save()
+        update_processing_counts(request.user.id)
 
         messages.add_message(
             request,
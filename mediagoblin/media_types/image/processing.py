@@ -19,9 +19,19 @@ try:
     from PIL import Image
 except ImportError:
     import Image
+try:
+    # Adds AVIF to Pillow versions that don't have it built in
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+try:
+    import pyvips
+except ImportError:
+    pyvips = None
 import os
 import logging
 import argparse
+import math
 
 from mediagoblin import mg_globals as mgg
 from mediagoblin.db.models import Location
@@ -29,7 +39,7 @@ from mediagoblin.processing import (
     BadMediaFail, FilenameBuilder,
     MediaProcessor, ProcessingManager,
     request_from_args, get_process_filename,
-    store_public, copy_original)
+    store_public, copy_original, image_placeholder)
 from mediagoblin.tools.exif import exif_fix_image_orientation, \
     extract_exif, clean_exif, get_gps_data, get_useful, \
     exif_image_needs_rotation
@@ -45,14 +55,237 @@ PIL_FILTERS = {
 MEDIA_TYPE = 'mediagoblin.media_types.image'
 
 
+def format_supported(format):
+    """
+    Whether Pillow can save images in format, such as 'webp' or 'avif'
+    """
+    Image.init()
+    return format.upper() in Image.SAVE
+
+
+class PillowEngine:
+    """
+    Imaging engine doing everything with Pillow.
+
+    The image is decoded into memory as a whole, only JPEGs can be decoded
+    scaled down.
+    """
+    name = 'pillow'
+
+    def original_size(self, filename):
+        """
+        Get the size of the image in filename, as stored (before fixing its
+        orientation)
+        """
+        try:
+            return Image.open(filename).size
+        except OSError:
+            raise BadMediaFail()
+
+    def open(self, filename, size, exif_tags):
+        """
+        Decode the image in filename to resize to size or smaller, with its
+        EXIF orientation fixed.
+
+        JPEGs are decoded scaled down by a power of two (Pillow's draft()),
+        as long as they stay at least twice as large as size, as
+        Image.thumbnail() would do.
+
+        Returns the decoded image and the size of the original.
+        """
+        draft_size = 2 * max(size)
+        try:
+            im = Image.open(filename)
+        except OSError:
+            raise BadMediaFail()
+        orig_size = im.size
+        im.draft(None, (draft_size, draft_size))
+        im = exif_fix_image_orientation(im, exif_tags)
+        im.load()
+        return im, orig_size
+
+    def size(self, image):
+        return image.size
+
+    def resize(self, image, size, filter):
+        """
+        Get a copy of image scaled down to fit in size, keeping its aspect
+        ratio
+        """
+        resized = image.copy()
+        resized.thumbnail(size, PIL_FILTERS[filter.upper()])
+        return resized
+
+    def format_supported(self, format):
+        return format_supported(format)
+
+    def save(self, image, filename, quality, format=None):
+        """
+        Save image to filename, in format or else the one its extension is
+        for
+        """
+        if format is not None:
+            if image.mode not in ('RGB', 'RGBA'):
+                has_alpha = image.mode in ('LA', 'PA') \
+                    or 'transparency' in image.info
+                image = image.convert('RGBA' if has_alpha else 'RGB')
+            format = format.upper()
+        image.save(filename, format=format, quality=quality)
+
+
+class VipsImage:
+    """
+    An image opened by the VipsEngine, which is only read once it's resized
+    """
+    def __init__(self, filename, width, height):
+        self.filename = filename
+        self.width = width
+        self.height = height
+
+
+class VipsEngine:
+    """
+    Imaging engine using libvips, through pyvips.
+
+    The image isn't decoded into memory.  Each resize streams it from the
+    file a few tiles at a time, decoding JPEGs, WebPs and the like scaled
+    down as far as the resize allows (shrink-on-load), so images of
+    hundreds of megapixels take about as much memory as small ones.
+    Resizing always uses a lanczos3 kernel, whatever the resize_filter.
+    """
+    name = 'vips'
+
+    # Savers that take a quality
+    QUALITY_SUFFIXES = ('.jpg', '.jpeg', '.jpe', '.webp', '.avif', '.heic',
+                        '.heif', '.tif', '.tiff', '.jxl')
+
+    def __init__(self):
+        if pyvips is None:
+            raise ImportError('The vips imaging engine needs pyvips')
+
+    def _header(self, filename):
+        try:
+            return pyvips.Image.new_from_file(filename)
+        except pyvips.Error:
+            raise BadMediaFail()
+
+    def original_size(self, filename):
+        header = self._header(filename)
+        return header.width, header.height
+
+    def open(self, filename, size, exif_tags):
+        """
+        Get the image in filename, ready to be resized, along with the size
+        of the original.  Only its header is read.
+        """
+        header = self._header(filename)
+        orig_size = (header.width, header.height)
+        width, height = orig_size
+        # Orientations 5 to 8 turn the image on its side
+        if header.get_typeof('orientation') and \
+                header.get('orientation') in (5, 6, 7, 8):
+            width, height = height, width
+        return VipsImage(filename, width, height), orig_size
+
+    def size(self, image):
+        return image.width, image.height
+
+    def resize(self, image, size, filter):
+        """
+        Read image scaled down to fit in size, keeping its aspect ratio,
+        with its EXIF orientation fixed
+        """
+        try:
+            return pyvips.Image.thumbnail(
+                image.filename, size[0], height=size[1], size='down')
+        except pyvips.Error:
+            raise BadMediaFail()
+
+    def format_supported(self, format):
+        return '.' + format.lower() in pyvips.get_suffixes()
+
+    def save(self, image, filename, quality, format=None):
+        """
+        Save image to filename, in the format its extension is for
+        """
+        options = {}
+        if os.path.splitext(filename)[1].lower() in self.QUALITY_SUFFIXES:
+            options['Q'] = quality
+        image.write_to_file(filename, **options)
+
+
+IMAGING_ENGINES = {
+    'pillow': PillowEngine,
+    'vips': VipsEngine}
+
+
+def get_engine(name):
+    """
+    Get the imaging engine called name, or the Pillow one if it can't be
+    used
+    """
+    try:
+        return IMAGING_ENGINES[name]()
+    except KeyError:
+        _log.warning('No imaging engine called "{}", using Pillow.'.format(
+            name))
+    except ImportError as e:
+        _log.warning('{}, using Pillow.'.format(e))
+    return PillowEngine()
+
+
+def save_alternative_formats(entry, resized, keyname, target_name, workdir,
+                             quality, formats, engine=None):
+    """
+    Store resized in each of formats as well, under "<keyname>@<format>",
+    and delete the ones stored for formats no longer wanted.
+    """
+    if engine is None:
+        engine = PillowEngine()
+
+    for alt_keyname in list(entry.media_files):
+        if alt_keyname.startswith(keyname + '@') and \
+                alt_keyname.split('@', 1)[1] not in formats:
+            try:
+                mgg.public_store.delete_file(entry.media_files[alt_keyname])
+            except OSError:
+                pass
+            del entry.media_files[alt_keyname]
+
+    for format in formats:
+        if not engine.format_supported(format):
+            _log.warning('The {} imaging engine cannot save {} images, not '
+                         'making a {} of media {} in that format.'.format(
+                             engine.name, format, keyname, entry.id))
+            continue
+
+        alt_keyname = f'{keyname}@{format}'
+        alt_target_name = '{}.{}'.format(
+            os.path.splitext(target_name)[0], format)
+        tmp_alt_filename = os.path.join(workdir, alt_target_name)
+        engine.save(resized, tmp_alt_filename, quality, format)
+        store_public(entry, alt_keyname, tmp_alt_filename, alt_target_name)
+
+        width, height = engine.size(resized)
+        entry.set_file_metadata(
+            alt_keyname,
+            width=width,
+            height=height,
+            dimensions=[width, height],
+            quality=quality,
+            bytes=os.path.getsize(tmp_alt_filename))
+
+
 def resize_image(entry, resized, keyname, target_name, new_size,
-                 exif_tags, workdir, quality, filter):
+                 exif_tags, workdir, quality, filter, formats=(),
+                 engine=None):
     """
     Store a resized version of an image and return its pathname.
 
     Arguments:
     proc_state -- the processing state for the image to resize
-    resized -- an image from Image.open() of the original image being resized
+    resized -- the original image, as opened by engine; it's left alone and
+               a copy of it is resized
     keyname -- Under what key to save in the db.
     target_name -- public file path for the new resized image
     exif_tags -- EXIF data for the original image
@@ -60,44 +293,70 @@ def resize_image(entry, resized, keyname, target_name, new_size,
     new_size -- 2-tuple size for the resized image
     quality -- level of compression used when resizing images
     filter -- One of BICUBIC, BILINEAR, NEAREST, ANTIALIAS
+    formats -- other formats to store the resized image in too, such as
+               'webp' or 'avif'
+    engine -- the imaging engine to use, Pillow's if not given
     """
-    resized = exif_fix_image_orientation(resized, exif_tags)  # Fix orientation
+    if engine is None:
+        engine = PillowEngine()
 
-    try:
-        resize_filter = PIL_FILTERS[filter.upper()]
-    except KeyError:
+    if filter.upper() not in PIL_FILTERS:
         raise Exception('Filter "{}" not found, choose one of {}'.format(
             str(filter),
             ', '.join(PIL_FILTERS.keys())))
 
-    resized.thumbnail(new_size, resize_filter)
+    resized = engine.resize(resized, new_size, filter)
 
     # Copy the new file to the conversion subdir, then remotely.
     tmp_resized_filename = os.path.join(workdir, target_name)
-    resized.save(tmp_resized_filename, quality=quality)
+    engine.save(resized, tmp_resized_filename, quality)
     store_public(entry, keyname, tmp_resized_filename, target_name)
 
     # store the thumb/medium info
     image_info = {'width': new_size[0],
                   'height': new_size[1],
                   'quality': quality,
-                  'filter': filter}
+                  'filter': filter,
+                  'formats': list(formats),
+                  'dimensions': list(engine.size(resized)),
+                  'bytes': os.path.getsize(tmp_resized_filename)}
 
     entry.set_file_metadata(keyname, **image_info)
 
+    save_alternative_formats(entry, resized, keyname, target_name, workdir,
+                             quality, formats, engine)
 
-def resize_tool(entry,
-                force, keyname, orig_file, target_name,
-                conversions_subdir, exif_tags, quality, filter, new_size=None):
-    # Use the default size if new_size was not given
+
+def default_size(keyname, new_size=None):
+    """
+    Get new_size, or the configured size for keyname if it was not given
+    """
     if not new_size:
         max_width = mgg.global_config['media:' + keyname]['max_width']
         max_height = mgg.global_config['media:' + keyname]['max_height']
         new_size = (max_width, max_height)
+    return new_size
+
+
+def resize_tool(entry,
+                force, keyname, decode_image, target_name,
+                conversions_subdir, exif_tags, quality, filter, new_size=None,
+                formats=(), engine=None):
+    """
+    Store a resized version of an image under keyname, unless an up to date
+    one is already there.
+
+    decode_image is called with the size to get the decoded image to resize,
+    see CommonImageProcessor.decode_image, and resized with engine.
+    """
+    if engine is None:
+        engine = PillowEngine()
+
+    new_size = default_size(keyname, new_size)
 
     # If thumb or medium is already the same quality and size, then don't
     # reprocess
-    if _skip_resizing(entry, keyname, new_size, quality, filter):
+    if _skip_resizing(entry, keyname, new_size, quality, filter, formats):
         _log.info('{} of same size and quality already in use, skipping '
                   'resizing of media {}.'.format(keyname, entry.id))
         return
@@ -106,24 +365,25 @@ def resize_tool(entry,
     # file, a target_name file is created and later associated with the media
     # entry.
     # Also created if the file needs rotation, or if forced.
-    try:
-        im = Image.open(orig_file)
-    except OSError:
-        raise BadMediaFail()
+    # (The decoded image may be scaled down, but only while it's still
+    # larger than new_size.)
+    im = decode_image(new_size)
+    width, height = engine.size(im)
     if force \
-        or im.size[0] > new_size[0]\
-        or im.size[1] > new_size[1]\
+        or width > new_size[0]\
+        or height > new_size[1]\
         or exif_image_needs_rotation(exif_tags):
         resize_image(
             entry, im, str(keyname), target_name,
             tuple(new_size),
             exif_tags, conversions_subdir,
-            quality, filter)
+            quality, filter, formats, engine)
 
 
-def _skip_resizing(entry, keyname, size, quality, filter):
+def _skip_resizing(entry, keyname, size, quality, filter, formats=()):
     """
-    Determines wither the saved thumb or medium is of the same quality and size
+    Determines wither the saved thumb or medium is of the same quality and size,
+    and stored in the same formats
     """
     image_info = entry.get_file_metadata(keyname)
 
@@ -144,6 +404,13 @@ def _skip_resizing(entry, keyname, size, quality, filter):
     elif image_info.get('quality') != quality:
         skip = False
 
+    elif image_info.get('formats', []) != list(formats):
+        skip = False
+
+    # Made before the resized files had their dimensions stored
+    elif 'dimensions' not in image_info:
+        skip = False
+
     return skip
 
 
@@ -178,6 +445,7 @@ class CommonImageProcessor(MediaProcessor):
         """
         self.image_config = mgg.global_config['plugins'][
             'mediagoblin.media_types.image']
+        self.engine = get_engine(self.image_config['engine'])
 
         ## @@: Should this be two functions?
         # Conversions subdirectory to avoid collisions
@@ -193,6 +461,27 @@ class CommonImageProcessor(MediaProcessor):
         # Exif extraction
         self.exif_tags = extract_exif(self.process_filename)
 
+        # The decoded image, see decode_image()
+        self.image = None
+        self.image_draft_size = None
+        self.orig_size = None
+
+    def decode_image(self, size):
+        """
+        Get the image to process, opened by the imaging engine once for all
+        the sizes made of it, with its EXIF orientation fixed.
+
+        The engine may decode it scaled down, as long as it stays at least
+        twice as large as size (see PillowEngine.open).  If a later size
+        needs more than that, the image is opened again.
+        """
+        draft_size = 2 * max(size)
+        if self.image is None or draft_size > self.image_draft_size:
+            self.image, self.orig_size = self.engine.open(
+                self.process_filename, size, self.exif_tags)
+            self.image_draft_size = draft_size
+        return self.image
+
     def generate_medium_if_applicable(self, size=None, quality=None,
                                       filter=None):
         if not quality:
@@ -200,10 +489,11 @@ class CommonImageProcessor(MediaProcessor):
         if not filter:
             filter = self.image_config['resize_filter']
 
-        resize_tool(self.entry, False, 'medium', self.process_filename,
+        resize_tool(self.entry, False, 'medium', self.decode_image,
                     self.name_builder.fill('{basename}.medium{ext}'),
                     self.conversions_subdir, self.exif_tags, quality,
-                    filter, size)
+                    filter, size, self.image_config['alternative_formats'],
+                    self.engine)
 
     def generate_thumb(self, size=None, quality=None, filter=None):
         if not quality:
@@ -211,16 +501,81 @@ class CommonImageProcessor(MediaProcessor):
         if not filter:
             filter = self.image_config['resize_filter']
 
-        resize_tool(self.entry, True, 'thumb', self.process_filename,
-                    self.name_builder.fill('{basename}.thumbnail{ext}'),
+        thumb_name = self.name_builder.fill('{basename}.thumbnail{ext}')
+        resize_tool(self.entry, True, 'thumb', self.decode_image,
+                    thumb_name,
                     self.conversions_subdir, self.exif_tags, quality,
-                    filter, size)
+                    filter, size, self.image_config['alternative_formats'],
+                    self.engine)
+
+        # Unless the thumbnail was up to date already
+        tmp_thumb = os.path.join(self.conversions_subdir, thumb_name)
+        if os.path.exists(tmp_thumb):
+            self.entry.set_file_metadata(
+                'thumb', **image_placeholder(tmp_thumb))
+
+    def srcset_sizes(self, widths=None):
+        """
+        Get the size to resize to for each width of the srcset ladder,
+        leaving out the widths the image isn't wider than.
+        """
+        if widths is None:
+            widths = self.image_config['srcset_widths']
+
+        orig_width, orig_height = self.original_size()
+        if exif_image_needs_rotation(self.exif_tags) and \
+                self.exif_tags['Image Orientation'].values[0] in (6, 8):
+            orig_width, orig_height = orig_height, orig_width
+
+        return {width: (width, math.ceil(width * orig_height / orig_width))
+                for width in widths if width < orig_width}
+
+    def generate_srcset(self, widths=None, quality=None, filter=None):
+        """
+        Store the image at each width of the srcset ladder, as
+        "srcset_<width>", for browsers to pick from for the screen they're
+        on.  Widths already stored the same way are left alone and the ones
+        no longer in the ladder are deleted.
+        """
+        if not quality:
+            quality = self.image_config['quality']
+        if not filter:
+            filter = self.image_config['resize_filter']
+
+        sizes = self.srcset_sizes(widths)
+
+        for keyname in list(self.entry.media_files):
+            if keyname.startswith('srcset_') and \
+                    int(keyname.split('@', 1)[0][7:]) not in sizes:
+                try:
+                    mgg.public_store.delete_file(
+                        self.entry.media_files[keyname])
+                except OSError:
+                    pass
+                del self.entry.media_files[keyname]
+
+        for width, size in sorted(sizes.items()):
+            resize_tool(self.entry, True, f'srcset_{width}', self.decode_image,
+                        self.name_builder.fill(
+                            '{basename}.' + str(width) + 'w{ext}'),
+                        self.conversions_subdir, self.exif_tags, quality,
+                        filter, size, self.image_config['alternative_formats'],
+                        self.engine)
 
     def copy_original(self):
         copy_original(
             self.entry, self.process_filename,
             self.name_builder.fill('{basename}{ext}'))
 
+    def original_size(self):
+        """
+        Get the size of the image to process, as stored (before fixing its
+        orientation)
+        """
+        if self.orig_size is None:
+            self.orig_size = self.engine.original_size(self.process_filename)
+        return self.orig_size
+
     def extract_metadata(self, file):
         """ Extract all the metadata from the image and store """
         # Extract GPS data and store in Location
@@ -236,14 +591,10 @@ class CommonImageProcessor(MediaProcessor):
             self.entry.media_data_init(exif_all=exif_all)
 
         # Extract file metadata
-        try:
-            im = Image.open(self.process_filename)
-        except OSError:
-            raise BadMediaFail()
-
+        orig_size = self.original_size()
         metadata = {
-            "width": im.size[0],
-            "height": im.size[1],
+            "width": orig_size[0],
+            "height": orig_size[1],
         }
 
         self.entry.set_file_metadata(file, **metadata)
@@ -309,9 +660,15 @@ class InitialProcessor(CommonImageProcessor):
 
     def process(self, size=None, thumb_size=None, quality=None, filter=None):
         self.common_setup()
+        # Decode the image once, large enough for all the sizes made of it
+        sizes = [default_size('medium', size),
+                 default_size('thumb', thumb_size)]
+        sizes.extend(self.srcset_sizes().values())
+        self.decode_image(max(sizes, key=max))
         self.generate_medium_if_applicable(size=size, filter=filter,
                                            quality=quality)
         self.generate_thumb(size=thumb_size, filter=filter, quality=quality)
+        self.generate_srcset(filter=filter, quality=quality)
         self.copy_original()
         self.extract_metadata('original')
         self.delete_queue_file()
@@ -364,7 +721,7 @@ class Resizer(CommonImageProcessor):
 
         parser.add_argument(
             'file',
-            choices=['medium', 'thumb'])
+            choices=['medium', 'thumb', 'srcset'])
 
         return parser
 
@@ -380,8 +737,11 @@ class Resizer(CommonImageProcessor):
                                               quality=quality)
         elif file == 'thumb':
             self.generate_thumb(size=size, filter=filter, quality=quality)
+        elif file == 'srcset':
+            self.generate_srcset(filter=filter, quality=quality)
 
-        self.extract_metadata(file)
+        if file != 'srcset':
+            self.extract_metadata(file)
 
 class MetadataProcessing(CommonImageProcessor):
     """ Extraction and storage of media's metadata for processed images """
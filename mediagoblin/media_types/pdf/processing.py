@@ -24,7 +24,7 @@ from mediagoblin.processing import (
     FilenameBuilder, BadMediaFail,
     MediaProcessor, ProcessingManager,
     request_from_args, get_process_filename,
-    store_public, copy_original)
+    store_public, copy_original, image_placeholder)
 from mediagoblin.tools.translate import fake_ugettext_passthrough as _
 
 _log = logging.getLogger(__name__)
@@ -275,6 +275,9 @@ class CommonPdfProcessor(MediaProcessor):
         if keyname == 'thumb':
             if kwargs.get('thumb_size') != file_metadata.get('thumb_size'):
                 skip = False
+            # Made before thumbnails had their dimensions stored
+            elif 'dimensions' not in file_metadata:
+                skip = False
         elif keyname == 'medium':
             if kwargs.get('size') != file_metadata.get('size'):
                 skip = False
@@ -311,7 +314,9 @@ class CommonPdfProcessor(MediaProcessor):
         store_public(self.entry, 'thumb', thumb_filename + '.png',
                      self.name_builder.fill('{basename}.thumbnail.png'))
 
-        self.entry.set_file_metadata('thumb', thumb_size=thumb_size)
+        self.entry.set_file_metadata('thumb', thumb_size=thumb_size,
+                                     **image_placeholder(
+                                         thumb_filename + '.png'))
 
     def _generate_pdf(self):
         """
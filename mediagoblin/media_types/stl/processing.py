@@ -26,7 +26,7 @@ from mediagoblin.processing import (
     FilenameBuilder, MediaProcessor,
     ProcessingManager, request_from_args,
     get_process_filename, store_public,
-    copy_original)
+    copy_original, image_placeholder)
 
 from mediagoblin.media_types.stl import model_loader
 
@@ -141,6 +141,8 @@ class CommonStlProcessor(MediaProcessor):
         # copy it up!
         store_public(self.entry, keyname, workbench_path, filename)
 
+        return workbench_path
+
     def _skip_processing(self, keyname, **kwargs):
         file_metadata = self.entry.get_file_metadata(keyname)
 
@@ -151,6 +153,9 @@ class CommonStlProcessor(MediaProcessor):
         if keyname == 'thumb':
             if kwargs.get('thumb_size') != file_metadata.get('thumb_size'):
                 skip = False
+            # Made before thumbnails had their dimensions stored
+            elif 'dimensions' not in file_metadata:
+                skip = False
         else:
             if kwargs.get('size') != file_metadata.get('size'):
                 skip = False
@@ -165,14 +170,15 @@ class CommonStlProcessor(MediaProcessor):
         if self._skip_processing('thumb', thumb_size=thumb_size):
             return
 
-        self._snap(
+        thumb_path = self._snap(
             "thumb",
             "{basename}.thumb.jpg",
             [0, self.greatest*-1.5, self.greatest],
             thumb_size,
             project="PERSP")
 
-        self.entry.set_file_metadata('thumb', thumb_size=thumb_size)
+        self.entry.set_file_metadata('thumb', thumb_size=thumb_size,
+                                     **image_placeholder(thumb_path))
 
     def generate_perspective(self, size=None):
         if not size:
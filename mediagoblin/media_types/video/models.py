@@ -58,6 +58,25 @@ class VideoData(Base):
 
     orig_metadata = Column(JSONEncoded)
 
+    def orig_dimensions(self):
+        """
+        (width, height) of the original video, or None if unknown
+        """
+        video_streams = (self.orig_metadata or {}).get('video')
+        if not video_streams:
+            return None
+        return video_streams[0]['width'], video_streams[0]['height']
+
+    def orig_duration(self):
+        """
+        Duration of the original video in whole seconds, or None if unknown
+        """
+        duration = (self.orig_metadata or {}).get('common', {}).get(
+            'duration')
+        if not duration:
+            return None
+        return duration // 10**9
+
     def source_type(self):
         """
         Construct a useful type=... that is to say, used like:
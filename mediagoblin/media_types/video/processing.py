@@ -22,23 +22,29 @@ import celery
 
 from celery import group
 from mediagoblin import mg_globals as mgg
+from mediagoblin.db.util import update_processing_counts
 from mediagoblin.processing import (
     FilenameBuilder, BaseProcessingFail,
     ProgressCallback, MediaProcessor,
     ProcessingManager, request_from_args,
     get_process_filename, store_public,
-    copy_original, get_entry_and_processing_manager)
+    copy_original, get_entry_and_processing_manager, image_placeholder)
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 from mediagoblin.media_types import MissingComponents
 
 from . import transcoders
-from .util import skip_transcode, ACCEPTED_RESOLUTIONS
+from .util import skip_transcode, passthrough_resolution, \
+    ACCEPTED_RESOLUTIONS, hls_playlist_segments, hls_peak_bandwidth, \
+    write_hls_master_playlist, write_preview_vtt, StoredDiscovery
 
 _log = logging.getLogger(__name__)
 _log.setLevel(logging.DEBUG)
 
 MEDIA_TYPE = 'mediagoblin.media_types.video'
 
+# Width of the scrub preview sprite sheets, in frames
+PREVIEW_COLUMNS = 10
+
 
 class VideoTranscodingFail(BaseProcessingFail):
     '''
@@ -76,6 +82,9 @@ def sniffer(media_file):
                                   for d in details])
         raise MissingComponents(f'{missing} is missing')
 
+    # Stored on the entry by submit_media, see CommonVideoProcessor.discover
+    media_file.sniffed_media_data = {'orig_metadata': metadata_to_dict(data)}
+
     return MEDIA_TYPE
 
 
@@ -134,6 +143,17 @@ def store_metadata(media_entry, metadata):
     """
     Store metadata from this video for this media entry.
     """
+    stored_metadata = metadata_to_dict(metadata)
+    # Only save this field if there's something to save
+    if len(stored_metadata):
+        media_entry.media_data_init(orig_metadata=stored_metadata)
+
+
+def metadata_to_dict(metadata):
+    """
+    What's kept of the discovered metadata of a video, see
+    VideoData.orig_metadata
+    """
     stored_metadata = dict()
     audio_info_list = metadata.get_audio_streams()
     if audio_info_list:
@@ -158,6 +178,7 @@ def store_metadata(media_entry, metadata):
                     'width': video_info.get_width(),
                     'height': video_info.get_height(),
                     'bitrate': video_info.get_bitrate(),
+                    'max_bitrate': video_info.get_max_bitrate(),
                     'depth': video_info.get_depth(),
                     'videorate': [video_info.get_framerate_num(),
                                   video_info.get_framerate_denom()],
@@ -168,9 +189,7 @@ def store_metadata(media_entry, metadata):
         'duration': metadata.get_duration(),
         'tags': get_tags(metadata),
     }
-    # Only save this field if there's something to save
-    if len(stored_metadata):
-        media_entry.media_data_init(orig_metadata=stored_metadata)
+    return stored_metadata
 
 
 @celery.task()
@@ -192,6 +211,7 @@ def main_task(entry_id, resolution, medium_size, **process_info):
     # Make state of entry as processed
     entry.state = 'processed'
     entry.save()
+    update_processing_counts(entry.actor)
     _log.info('MediaEntry ID {} is processed (transcoded to default'
               ' resolution): {}'.format(entry.id, medium_size))
     _log.debug('MediaEntry processed')
@@ -214,16 +234,91 @@ def complementary_task(entry_id, resolution, medium_size, **process_info):
 
 
 @celery.task()
-def processing_cleanup(entry_id):
+def multi_resolution_task(entry_id, resolutions, **process_info):
+    """
+    Celery task to transcode the video to all resolutions at once (see the
+    single_decode option) and store original video metadata.
+    """
+    entry, manager = get_entry_and_processing_manager(entry_id)
+    with CommonVideoProcessor(manager, entry) as processor:
+        processor.common_setup()
+        processor.transcode_all(resolutions,
+                                vp8_quality=process_info['vp8_quality'],
+                                vp8_threads=process_info['vp8_threads'],
+                                vorbis_quality=process_info['vorbis_quality'])
+        processor.generate_thumb(thumb_size=process_info['thumb_size'])
+        processor.store_orig_metadata()
+    entry.state = 'processed'
+    entry.save()
+    update_processing_counts(entry.actor)
+    _log.info('MediaEntry ID {} is transcoded to {}'.format(
+        entry.id, ', '.join(resolutions)))
+
+
+@celery.task()
+def hls_task(entry_id, **process_info):
+    """
+    Celery task to write HLS streaming playlists of the video
+
+    The playlists are extras, the WebM files do without them, so failing to
+    write them doesn't fail the processing of the video.
+    """
+    entry, manager = get_entry_and_processing_manager(entry_id)
+    with CommonVideoProcessor(manager, entry) as processor:
+        processor.common_setup()
+        try:
+            processor.generate_hls()
+        except Exception:
+            _log.exception(
+                f'Could not write HLS playlists of MediaEntry ID {entry.id}')
+            return
+    _log.info(f'MediaEntry ID {entry.id} has HLS playlists')
+
+
+@celery.task()
+def chunk_task(entry_id, resolution, medium_size, chunk, num_chunks,
+               **process_info):
+    """
+    Celery task to transcode one of num_chunks parts of the video to a
+    resolution, see the chunk_duration option
+    """
+    entry, manager = get_entry_and_processing_manager(entry_id)
+    with CommonVideoProcessor(manager, entry) as processor:
+        processor.common_setup(resolution)
+        processor.transcode_chunk(chunk, num_chunks,
+                                  medium_size=tuple(medium_size),
+                                  vp8_quality=process_info['vp8_quality'],
+                                  vp8_threads=process_info['vp8_threads'],
+                                  vorbis_quality=process_info[
+                                      'vorbis_quality'])
+    _log.info('MediaEntry ID {} part {} of {} is transcoded to {}'.format(
+        entry.id, chunk + 1, num_chunks, medium_size))
+
+
+@celery.task()
+def processing_cleanup(entry_id, num_chunks=None, **process_info):
     _log.debug('Entered processing_cleanup')
     entry, manager = get_entry_and_processing_manager(entry_id)
     with CommonVideoProcessor(manager, entry) as processor:
         # no need to specify a resolution here
         processor.common_setup()
+        if num_chunks:
+            processor.stitch_chunks(
+                num_chunks,
+                vp8_quality=process_info['vp8_quality'],
+                vp8_threads=process_info['vp8_threads'],
+                vorbis_quality=process_info['vorbis_quality'])
+            processor.generate_thumb(thumb_size=process_info['thumb_size'])
+            processor.store_orig_metadata()
         processor.copy_original()
         processor.keep_best()
         processor.delete_queue_file()
     _log.debug('Deleted queue_file')
+    if num_chunks:
+        entry.state = 'processed'
+        entry.save()
+        update_processing_counts(entry.actor)
+        _log.info(f'MediaEntry ID {entry.id} is processed')
 
 
 class CommonVideoProcessor(MediaProcessor):
@@ -244,7 +339,9 @@ class CommonVideoProcessor(MediaProcessor):
 
         self.transcoder = transcoders.VideoTranscoder()
         self.did_transcode = False
+        self.metadata = None
 
+        self.resolution = resolution
         if resolution:
             self.curr_file = 'webm_' + str(resolution)
             self.part_filename = (self.name_builder.fill('{basename}.' +
@@ -254,6 +351,21 @@ class CommonVideoProcessor(MediaProcessor):
             self.part_filename = self.name_builder.fill('{basename}.medium.webm')
 
 
+    def discover(self):
+        """
+        Discover the video being processed.  When that's the upload, what
+        was found out about it while sniffing it is used instead.
+        """
+        if self.metadata is None:
+            media_data = self.entry.media_data
+            if self.entry.queued_media_file and media_data and \
+                    StoredDiscovery.can_use(media_data.orig_metadata):
+                self.metadata = StoredDiscovery(
+                    media_data.orig_metadata, self.process_filename)
+            else:
+                self.metadata = transcoders.discover(self.process_filename)
+        return self.metadata
+
     def copy_original(self):
         # If we didn't transcode, then we need to keep the original
         self.did_transcode = False
@@ -307,6 +419,14 @@ class CommonVideoProcessor(MediaProcessor):
         elif keyname == 'thumb':
             if kwargs.get('thumb_size') != file_metadata.get('thumb_size'):
                 skip = False
+            # The scrub previews are made along with the thumbnail, thumbnails
+            # made before them have none
+            elif kwargs.get('preview_frames') != \
+                    file_metadata.get('preview_frames', 0):
+                skip = False
+            # Made before thumbnails had their dimensions stored
+            elif 'dimensions' not in file_metadata:
+                skip = False
 
         return skip
 
@@ -335,7 +455,7 @@ class CommonVideoProcessor(MediaProcessor):
         if self._skip_processing(self.curr_file, **file_metadata):
             return
 
-        metadata = transcoders.discover(self.process_filename)
+        metadata = self.discover()
         orig_dst_dimensions = (metadata.get_video_streams()[0].get_width(),
                                metadata.get_video_streams()[0].get_height())
 
@@ -344,10 +464,15 @@ class CommonVideoProcessor(MediaProcessor):
         if skip_transcode(metadata, medium_size):
             _log.debug('Skipping transcoding')
 
+            if self.resolution and self.resolution == passthrough_resolution(
+                    metadata, self.video_config['available_resolutions']):
+                self.publish_without_transcoding(
+                    self.curr_file, self.part_filename, file_metadata)
+
             # If there is an original and transcoded, delete the transcoded
             # since it must be of lower quality then the original
-            if self.entry.media_files.get('original') and \
-               self.entry.media_files.get(self.curr_file):
+            elif self.entry.media_files.get('original') and \
+                    self.entry.media_files.get(self.curr_file):
                 self.entry.media_files[self.curr_file].delete()
 
         else:
@@ -362,7 +487,8 @@ class CommonVideoProcessor(MediaProcessor):
                                       vp8_threads=vp8_threads,
                                       vorbis_quality=vorbis_quality,
                                       progress_callback=progress_callback,
-                                      dimensions=tuple(medium_size))
+                                      dimensions=tuple(medium_size),
+                                      metadata=metadata)
             if self.transcoder.dst_data:
                 # Push transcoded video to public storage
                 _log.debug('Saving medium...')
@@ -373,6 +499,303 @@ class CommonVideoProcessor(MediaProcessor):
 
                 self.did_transcode = True
 
+    def publish_without_transcoding(self, keyname, target_name,
+                                    file_metadata):
+        """
+        Publish the uploaded video as it is for keyname, when it already is
+        what transcoding it would make (see passthrough_resolution)
+        """
+        _log.debug(f'Publishing the uploaded video as {keyname}')
+        store_public(self.entry, keyname, self.process_filename, target_name)
+        self.entry.set_file_metadata(keyname, passthrough=True,
+                                     **file_metadata)
+        self.did_transcode = True
+
+    def transcode_all(self, resolutions, vp8_quality=None, vp8_threads=None,
+                      vorbis_quality=None):
+        """
+        Like transcode(), but for all of the resolutions at once, decoding
+        the video only once
+        """
+        progress_callback = ProgressCallback(self.entry)
+
+        if not vp8_quality:
+            vp8_quality = self.video_config['vp8_quality']
+        if not vp8_threads:
+            vp8_threads = self.video_config['vp8_threads']
+        if not vorbis_quality:
+            vorbis_quality = self.video_config['vorbis_quality']
+
+        metadata = self.discover()
+        passthrough = passthrough_resolution(
+            metadata, self.video_config['available_resolutions'])
+
+        destinations = {}
+        files_metadata = {}
+        for resolution in resolutions:
+            keyname = 'webm_' + resolution
+            medium_size = ACCEPTED_RESOLUTIONS[resolution]
+            file_metadata = {'medium_size': medium_size,
+                             'vp8_threads': vp8_threads,
+                             'vp8_quality': vp8_quality,
+                             'vorbis_quality': vorbis_quality}
+
+            if self._skip_processing(keyname, **file_metadata):
+                continue
+
+            if skip_transcode(metadata, medium_size):
+                _log.debug(f'Skipping transcoding to {resolution}')
+                # See transcode()
+                if resolution == passthrough:
+                    self.publish_without_transcoding(
+                        keyname,
+                        self.name_builder.fill(
+                            '{basename}.' + resolution + '.webm'),
+                        file_metadata)
+                elif self.entry.media_files.get('original') and \
+                        self.entry.media_files.get(keyname):
+                    self.entry.media_files[keyname].delete()
+                continue
+
+            destinations[resolution] = os.path.join(
+                self.workbench.dir,
+                self.name_builder.fill('{basename}.' + resolution + '.webm'))
+            files_metadata[keyname] = file_metadata
+
+        if not destinations:
+            return
+
+        transcoder = transcoders.MultiVideoTranscoder()
+        transcoder.transcode(self.process_filename, destinations,
+                             self.video_config['default_resolution'],
+                             len(self.video_config['available_resolutions']),
+                             vp8_threads=vp8_threads,
+                             vorbis_quality=vorbis_quality,
+                             progress_callback=progress_callback,
+                             metadata=metadata)
+        if not transcoder.dst_data:
+            raise VideoTranscodingFail()
+
+        _log.debug('Saving transcoded videos...')
+        for resolution, tmp_dst in destinations.items():
+            store_public(self.entry, 'webm_' + resolution, tmp_dst,
+                         os.path.basename(tmp_dst))
+        self.entry.set_files_metadata(files_metadata)
+        self.did_transcode = True
+
+    def chunk_filepath(self, resolution, chunk):
+        """
+        Where in the queue store the workers leave the parts of a chunked
+        transcode for processing_cleanup
+        """
+        return self.entry.queued_media_file[:-1] + [
+            'chunks', f'{resolution}.{chunk:04}.webm']
+
+    def transcode_chunk(self, chunk, num_chunks, medium_size,
+                        vp8_quality=None, vp8_threads=None,
+                        vorbis_quality=None):
+        """
+        Transcode the video of one of num_chunks equal parts of the video,
+        to be put together with the audio by stitch_chunks()
+        """
+        if not vp8_quality:
+            vp8_quality = self.video_config['vp8_quality']
+        if not vp8_threads:
+            vp8_threads = self.video_config['vp8_threads']
+        if not vorbis_quality:
+            vorbis_quality = self.video_config['vorbis_quality']
+
+        # Skipped the same way in stitch_chunks()
+        if self._skip_processing(self.curr_file, medium_size=medium_size,
+                                 vp8_threads=vp8_threads,
+                                 vp8_quality=vp8_quality,
+                                 vorbis_quality=vorbis_quality):
+            return
+        metadata = self.discover()
+        if skip_transcode(metadata, medium_size):
+            return
+
+        duration = metadata.get_duration()
+        tmp_dst = os.path.join(
+            self.workbench.dir, f'{self.resolution}.{chunk}.webm')
+        transcoder = transcoders.VideoChunkTranscoder()
+        transcoder.transcode(
+            self.process_filename, tmp_dst,
+            duration * chunk // num_chunks,
+            duration * (chunk + 1) // num_chunks,
+            medium_size,
+            len(self.video_config['available_resolutions']) * num_chunks,
+            vp8_quality=vp8_quality,
+            vp8_threads=vp8_threads,
+            progress_callback=ProgressCallback(self.entry),
+            metadata=metadata)
+        if not transcoder.dst_data:
+            raise VideoTranscodingFail()
+
+        mgg.queue_store.copy_local_to_storage(
+            tmp_dst, self.chunk_filepath(self.resolution, chunk))
+
+    def stitch_chunks(self, num_chunks, vp8_quality=None, vp8_threads=None,
+                      vorbis_quality=None):
+        """
+        Put the parts made by transcode_chunk() together, with the audio,
+        for all of the resolutions
+        """
+        if not vp8_quality:
+            vp8_quality = self.video_config['vp8_quality']
+        if not vp8_threads:
+            vp8_threads = self.video_config['vp8_threads']
+        if not vorbis_quality:
+            vorbis_quality = self.video_config['vorbis_quality']
+
+        metadata = self.discover()
+        passthrough = passthrough_resolution(
+            metadata, self.video_config['available_resolutions'])
+
+        for resolution in self.video_config['available_resolutions']:
+            keyname = 'webm_' + resolution
+            medium_size = ACCEPTED_RESOLUTIONS[resolution]
+            target_name = self.name_builder.fill(
+                '{basename}.' + resolution + '.webm')
+            file_metadata = {'medium_size': medium_size,
+                             'vp8_threads': vp8_threads,
+                             'vp8_quality': vp8_quality,
+                             'vorbis_quality': vorbis_quality}
+
+            if self._skip_processing(keyname, **file_metadata):
+                continue
+
+            # See transcode_all()
+            if skip_transcode(metadata, medium_size):
+                if resolution == passthrough:
+                    self.publish_without_transcoding(
+                        keyname, target_name, file_metadata)
+                elif self.entry.media_files.get('original') and \
+                        self.entry.media_files.get(keyname):
+                    self.entry.media_files[keyname].delete()
+                continue
+
+            chunks = [
+                self.workbench.localized_file(
+                    mgg.queue_store, self.chunk_filepath(resolution, chunk))
+                for chunk in range(num_chunks)]
+            tmp_dst = os.path.join(self.workbench.dir, target_name)
+            stitcher = transcoders.ChunkStitcher()
+            stitcher.stitch(chunks, self.process_filename, tmp_dst,
+                            vorbis_quality=vorbis_quality,
+                            metadata=metadata)
+            if not stitcher.dst_data:
+                raise VideoTranscodingFail()
+
+            store_public(self.entry, keyname, tmp_dst, target_name)
+            self.entry.set_file_metadata(keyname, **file_metadata)
+            self.did_transcode = True
+
+        mgg.queue_store.delete_dir(
+            self.entry.queued_media_file[:-1] + ['chunks'], recursive=True)
+
+    def generate_hls(self, segment_duration=None):
+        """
+        Write HLS media playlists of the available resolutions plus a master
+        playlist listing them, stored under hls/ in the entry's public
+        directory.  The segments are listed in the 'segments' file metadata
+        of their playlist, so they get deleted along with the entry.
+        """
+        if not segment_duration:
+            segment_duration = self.video_config['hls_segment_duration']
+
+        metadata = self.discover()
+        missing = transcoders.hls_missing_elements(
+            bool(metadata.get_audio_streams()))
+        if missing:
+            _log.warning('Not writing HLS playlists of media {}, GStreamer '
+                         'is missing {}'.format(
+                             self.entry.id, ', '.join(missing)))
+            return
+
+        self.delete_hls()
+
+        destinations = {}
+        for resolution in self.video_config['available_resolutions']:
+            destinations[resolution] = os.path.join(
+                self.workbench.dir, 'hls', resolution)
+            os.makedirs(destinations[resolution])
+
+        # All of the resolutions are made from one decode of the video
+        transcoder = transcoders.HLSTranscoder()
+        transcoder.transcode(self.process_filename, destinations,
+                             target_duration=segment_duration,
+                             metadata=metadata)
+        if not transcoder.playlist_paths:
+            _log.warning('Could not write the HLS playlists of media {}'.format(
+                self.entry.id))
+            return
+
+        public_dir = ['media_entries', str(self.entry.id), 'hls']
+        variants = []
+        for resolution, tmp_dir in destinations.items():
+            playlist_path = transcoder.playlist_paths[resolution]
+            if not os.path.exists(playlist_path):
+                _log.warning(f'Could not write the {resolution} HLS playlist')
+                continue
+
+            segments = hls_playlist_segments(playlist_path)
+            if not segments:
+                continue
+            video_info = transcoders.discover(
+                os.path.join(tmp_dir, segments[0][1])).get_video_streams()[0]
+            size = (video_info.get_width(), video_info.get_height())
+
+            segment_paths = []
+            for duration, filename in segments:
+                segment_path = public_dir + [resolution, filename]
+                mgg.public_store.copy_local_to_storage(
+                    os.path.join(tmp_dir, filename), segment_path)
+                segment_paths.append(segment_path)
+
+            playlist_name = os.path.basename(playlist_path)
+            public_playlist_path = public_dir + [resolution, playlist_name]
+            mgg.public_store.copy_local_to_storage(
+                playlist_path, public_playlist_path)
+
+            keyname = 'hls_' + resolution
+            self.entry.media_files[keyname] = public_playlist_path
+            self.entry.set_file_metadata(
+                keyname, medium_size=size, segments=segment_paths,
+                segment_duration=segment_duration)
+
+            variants.append((
+                f'{resolution}/{playlist_name}',
+                hls_peak_bandwidth(playlist_path), size))
+
+        if not variants:
+            return
+
+        tmp_master = os.path.join(self.workbench.dir, 'hls', 'master.m3u8')
+        write_hls_master_playlist(tmp_master, variants)
+        master_path = public_dir + ['master.m3u8']
+        mgg.public_store.copy_local_to_storage(tmp_master, master_path)
+        self.entry.media_files['hls_master'] = master_path
+        self.entry.save()
+
+    def delete_hls(self):
+        """
+        Delete the files written by generate_hls()
+        """
+        for keyname in list(self.entry.media_files):
+            if not keyname.startswith('hls_'):
+                continue
+
+            filepaths = [self.entry.media_files[keyname]]
+            filepaths.extend(
+                self.entry.get_file_metadata(keyname, 'segments') or [])
+            for filepath in filepaths:
+                try:
+                    mgg.public_store.delete_file(filepath)
+                except OSError:
+                    pass
+            del self.entry.media_files[keyname]
+
     def generate_thumb(self, thumb_size=None):
         _log.debug("Enter generate_thumb()")
         # Temporary file for the video thumbnail (cleaned up with workbench)
@@ -383,14 +806,23 @@ class CommonVideoProcessor(MediaProcessor):
         if not thumb_size:
             thumb_size = (mgg.global_config['media:thumb']['max_width'],)
 
-        if self._skip_processing('thumb', thumb_size=thumb_size):
+        preview_frames = self.video_config['preview_frames']
+
+        if self._skip_processing('thumb', thumb_size=thumb_size,
+                                 preview_frames=preview_frames):
             return
 
-        # We will only use the width so that the correct scale is kept
-        transcoders.capture_thumb(
-            self.process_filename,
-            tmp_thumb,
-            thumb_size[0])
+        if preview_frames:
+            # The scrub previews come out of the same pipeline run
+            self.generate_previews(
+                tmp_thumb, preview_frames, thumb_size[0])
+        else:
+            self.delete_previews()
+            # We will only use the width so that the correct scale is kept
+            transcoders.capture_thumb(
+                self.process_filename,
+                tmp_thumb,
+                thumb_size[0])
 
         # Checking if the thumbnail was correctly created.  If it was not,
         # then just give up.
@@ -402,11 +834,60 @@ class CommonVideoProcessor(MediaProcessor):
         store_public(self.entry, 'thumb', tmp_thumb,
                      self.name_builder.fill('{basename}.thumbnail.jpg'))
 
-        self.entry.set_file_metadata('thumb', thumb_size=thumb_size)
+        self.entry.set_file_metadata('thumb', thumb_size=thumb_size,
+                                     preview_frames=preview_frames,
+                                     **image_placeholder(tmp_thumb))
+
+    def generate_previews(self, tmp_thumb, count, thumb_width):
+        """
+        Capture the thumbnail to tmp_thumb, and store a sprite sheet of
+        count frames plus a WebVTT file mapping the times of the video to
+        them, for previews when hovering over the progress bar
+        """
+        tmp_sprite = os.path.join(
+            self.workbench.dir,
+            self.name_builder.fill('{basename}.previews.jpg'))
+        tmp_vtt = os.path.join(
+            self.workbench.dir,
+            self.name_builder.fill('{basename}.previews.vtt'))
+
+        captured = transcoders.capture_previews(
+            self.process_filename, tmp_thumb, tmp_sprite, count,
+            thumb_width, self.video_config['preview_width'],
+            PREVIEW_COLUMNS)
+        if not captured:
+            return
+        duration, tile_size = captured
+
+        _log.debug('Saving previews...')
+        store_public(self.entry, 'preview_sprite', tmp_sprite,
+                     self.name_builder.fill('{basename}.previews.jpg'))
+        # The cues point to the sprite sheet next to the WebVTT file
+        write_preview_vtt(
+            tmp_vtt, self.entry.media_files['preview_sprite'][-1],
+            duration, count, PREVIEW_COLUMNS, tile_size)
+        store_public(self.entry, 'preview_vtt', tmp_vtt,
+                     self.name_builder.fill('{basename}.previews.vtt'))
+
+    def delete_previews(self):
+        """
+        Delete the files written by generate_previews()
+        """
+        for keyname in ('preview_sprite', 'preview_vtt'):
+            if keyname in self.entry.media_files:
+                try:
+                    mgg.public_store.delete_file(
+                        self.entry.media_files[keyname])
+                except OSError:
+                    pass
+                del self.entry.media_files[keyname]
 
     def store_orig_metadata(self):
         # Extract metadata and keep a record of it
-        metadata = transcoders.discover(self.process_filename)
+        metadata = self.discover()
+        if isinstance(metadata, StoredDiscovery):
+            # Already kept when the video was uploaded
+            return
 
         # metadata's stream info here is a DiscovererContainerInfo instance,
         # it gets split into DiscovererAudioInfo and DiscovererVideoInfo;
@@ -581,14 +1062,77 @@ class Transcoder(CommonVideoProcessor):
                        vp8_quality=vp8_quality, vorbis_quality=vorbis_quality)
 
 
+class HLSProcessor(CommonVideoProcessor):
+    """
+    Writing HLS streaming playlists for processed video
+    """
+    name = 'hls'
+    description = 'Write HLS streaming playlists'
+
+    @classmethod
+    def media_is_eligible(cls, entry=None, state=None):
+        if not state:
+            state = entry.state
+        return state in 'processed'
+
+    @classmethod
+    def generate_parser(cls):
+        parser = argparse.ArgumentParser(
+            description=cls.description,
+            prog=cls.name)
+
+        parser.add_argument(
+            '--segment_duration',
+            type=int,
+            help='Length of the segments in seconds')
+
+        return parser
+
+    @classmethod
+    def args_to_request(cls, args):
+        return request_from_args(
+            args, ['segment_duration'])
+
+    def process(self, segment_duration=None):
+        self.common_setup()
+        self.generate_hls(segment_duration=segment_duration)
+
+
 class VideoProcessingManager(ProcessingManager):
     def __init__(self):
         super().__init__()
         self.add_processor(InitialProcessor)
         self.add_processor(Resizer)
         self.add_processor(Transcoder)
+        self.add_processor(HLSProcessor)
+
+    @staticmethod
+    def count_chunks(entry, video_config):
+        """
+        How many parts to transcode a freshly uploaded video in, see the
+        chunk_duration option.  The duration was stored when the video was
+        sniffed, failing that the queued file has to be in local storage.
+        """
+        chunk_duration = video_config['chunk_duration']
+        if not chunk_duration or video_config['single_decode'] or \
+                not entry.queued_media_file:
+            return 1
+
+        media_data = entry.media_data
+        if media_data and StoredDiscovery.can_use(media_data.orig_metadata):
+            duration = media_data.orig_metadata['common']['duration']
+        elif mgg.queue_store.local_storage:
+            duration = transcoders.discover(mgg.queue_store.get_local_path(
+                entry.queued_media_file)).get_duration()
+        else:
+            return 1
+        return max(1, round(duration / (chunk_duration * 10**9)))
 
     def workflow(self, entry, feed_url, reprocess_action, reprocess_info=None):
+        # Adding HLS playlists to a processed video is a single task,
+        # leave it to ProcessMedia
+        if reprocess_action == HLSProcessor.name:
+            return None
 
         video_config = mgg.global_config['plugins'][MEDIA_TYPE]
         def_res = video_config['default_resolution']
@@ -596,6 +1140,7 @@ class VideoProcessingManager(ProcessingManager):
 
         entry.state = 'processing'
         entry.save()
+        update_processing_counts(entry.actor)
 
         reprocess_info = reprocess_info or {}
         if 'vp8_quality' not in reprocess_info:
@@ -607,23 +1152,59 @@ class VideoProcessingManager(ProcessingManager):
         if 'thumb_size' not in reprocess_info:
             reprocess_info['thumb_size'] = None
 
-        tasks_list = [main_task.signature(args=(entry.id, def_res,
-                                          ACCEPTED_RESOLUTIONS[def_res]),
-                                          kwargs=reprocess_info, queue='default',
-                                          priority=priority_num, immutable=True)]
+        cleanup_task = processing_cleanup.signature(args=(entry.id,),
+                                                    queue='default', immutable=True)
 
-        for comp_res in video_config['available_resolutions']:
-            if comp_res != def_res:
+        num_chunks = self.count_chunks(entry, video_config)
+        if num_chunks > 1:
+            # Each part of each resolution is a task of its own, the default
+            # resolution first
+            resolutions = [def_res] + [
+                res for res in video_config['available_resolutions']
+                if res != def_res]
+            tasks_list = []
+            for res in resolutions:
+                for chunk in range(num_chunks):
+                    tasks_list.append(chunk_task.signature(
+                        args=(entry.id, res, ACCEPTED_RESOLUTIONS[res],
+                              chunk, num_chunks),
+                        kwargs=reprocess_info, queue='default',
+                        priority=priority_num, immutable=True))
                 priority_num += -1
-                tasks_list.append(
-                    complementary_task.signature(args=(entry.id, comp_res,
-                                                 ACCEPTED_RESOLUTIONS[comp_res]),
-                                                 kwargs=reprocess_info, queue='default',
-                                                 priority=priority_num, immutable=True)
-                )
+            cleanup_task = processing_cleanup.signature(
+                args=(entry.id,),
+                kwargs=dict(reprocess_info, num_chunks=num_chunks),
+                queue='default', immutable=True)
+        elif video_config['single_decode']:
+            resolutions = [def_res] + [
+                res for res in video_config['available_resolutions']
+                if res != def_res]
+            tasks_list = [multi_resolution_task.signature(
+                args=(entry.id, resolutions), kwargs=reprocess_info,
+                queue='default', immutable=True)]
+        else:
+            tasks_list = [main_task.signature(args=(entry.id, def_res,
+                                              ACCEPTED_RESOLUTIONS[def_res]),
+                                              kwargs=reprocess_info, queue='default',
+                                              priority=priority_num, immutable=True)]
+
+            for comp_res in video_config['available_resolutions']:
+                if comp_res != def_res:
+                    priority_num += -1
+                    tasks_list.append(
+                        complementary_task.signature(args=(entry.id, comp_res,
+                                                     ACCEPTED_RESOLUTIONS[comp_res]),
+                                                     kwargs=reprocess_info, queue='default',
+                                                     priority=priority_num, immutable=True)
+                    )
+
+        # The streaming playlists come last, the WebM files will do until
+        # they are there
+        if video_config['hls']:
+            tasks_list.append(hls_task.signature(
+                args=(entry.id,), queue='default', priority=0,
+                immutable=True))
 
         transcoding_tasks = group(tasks_list)
-        cleanup_task = processing_cleanup.signature(args=(entry.id,),
-                                                    queue='default', immutable=True)
 
         return (transcoding_tasks, cleanup_task)
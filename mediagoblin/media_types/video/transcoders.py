@@ -18,6 +18,7 @@
 import os
 import sys
 import logging
+import threading
 import multiprocessing
 
 from mediagoblin.media_types.tools import discover
@@ -55,7 +56,12 @@ except NotImplementedError:
 os.putenv('GST_DEBUG_DUMP_DOT_DIR', '/tmp')
 
 
-def capture_thumb(video_path, dest_path, width=None, height=None, percent=0.5):
+def frame_pipeline(video_path, width=None, height=None):
+    '''
+    Build a paused pipeline decoding the video at video_path to RGB frames of
+    the given width and/or height, to be seeked and pulled from the returned
+    appsink.  Returns (pipeline, appsink), or None if it couldn't be paused.
+    '''
     def pad_added(element, pad, connect_to):
         '''This is a callback to dynamically add element to pipeline'''
         caps = pad.query_caps(None)
@@ -97,52 +103,186 @@ def capture_thumb(video_path, dest_path, width=None, height=None, percent=0.5):
     videoscale.link(appsink)
 
     # pipeline constructed, starting playing, but first some preparations
-    # seek to 50% of the file is required
     pipeline.set_state(Gst.State.PAUSED)
     # timeout of 3 seconds below was set experimentally
     state = pipeline.get_state(Gst.SECOND * 3)
     if state[0] != Gst.StateChangeReturn.SUCCESS:
         _log.warning(f'state change failed, {state}')
-        return
+        pipeline.set_state(Gst.State.NULL)
+        return None
+    return pipeline, appsink
 
-    # get duration
-    (success, duration) = pipeline.query_duration(Gst.Format.TIME)
-    if not success:
-        _log.warning('query_duration failed')
-        return
-
-    seek_to = int(duration * int(percent * 100) / 100)
-    _log.debug('Seeking to {} of {}'.format(
-            float(seek_to) / Gst.SECOND, float(duration) / Gst.SECOND))
-    seek = pipeline.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH, seek_to)
-    if not seek:
-        _log.warning('seek failed')
-        return
 
+def pull_frame(appsink):
+    '''
+    Get the frame the pipeline of appsink is paused at, as
+    (timestamp, PIL Image), or None
+    '''
     # get sample, retrieve it's format and save
     sample = appsink.emit("pull-preroll")
     if not sample:
         _log.warning('could not get sample')
-        return
+        return None
     caps = sample.get_caps()
     if not caps:
         _log.warning('could not get snapshot format')
-        return
+        return None
     structure = caps.get_structure(0)
     (success, width) = structure.get_int('width')
     (success, height) = structure.get_int('height')
     buffer = sample.get_buffer()
 
-    # get the image from the buffer and save it to disk
+    # get the image from the buffer
     im = Image.frombytes('RGB', (width, height),
                          buffer.extract_dup(0, buffer.get_size()))
-    im.save(dest_path)
-    _log.info(f'thumbnail saved to {dest_path}')
+    return buffer.pts, im
+
+
+def capture_thumb(video_path, dest_path, width=None, height=None, percent=0.5):
+    pipeline_and_sink = frame_pipeline(video_path, width, height)
+    if not pipeline_and_sink:
+        return
+    pipeline, appsink = pipeline_and_sink
+
+    # get duration
+    (success, duration) = pipeline.query_duration(Gst.Format.TIME)
+    if not success:
+        _log.warning('query_duration failed')
+        pipeline.set_state(Gst.State.NULL)
+        return
+
+    # seek to 50% of the file is required
+    seek_to = int(duration * int(percent * 100) / 100)
+    _log.debug('Seeking to {} of {}'.format(
+            float(seek_to) / Gst.SECOND, float(duration) / Gst.SECOND))
+    seek = pipeline.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH, seek_to)
+    if not seek:
+        _log.warning('seek failed')
+        pipeline.set_state(Gst.State.NULL)
+        return
+
+    frame = pull_frame(appsink)
+    if frame:
+        frame[1].save(dest_path)
+        _log.info(f'thumbnail saved to {dest_path}')
 
     # cleanup
     pipeline.set_state(Gst.State.NULL)
 
 
+def capture_previews(video_path, thumb_path, sprite_path, count,
+                     thumb_width, tile_width, columns):
+    '''
+    Capture the thumbnail plus count frames spread evenly over the video,
+    tiled columns wide in a sprite sheet for scrub previews, in one pipeline
+    run.
+
+    Only keyframes are seeked to, so none of the frames in between have to
+    be decoded.  Returns (duration, (tile width, tile height)), or None if
+    the frames couldn't be captured.
+    '''
+    pipeline_and_sink = frame_pipeline(
+        video_path, width=max(thumb_width, tile_width))
+    if not pipeline_and_sink:
+        return None
+    pipeline, appsink = pipeline_and_sink
+
+    try:
+        (success, duration) = pipeline.query_duration(Gst.Format.TIME)
+        if not success:
+            _log.warning('query_duration failed')
+            return None
+
+        # The thumbnail comes from the middle, the previews from the middle
+        # of each of their cues
+        positions = [0.5] + [(i + 0.5) / count for i in range(count)]
+        frames = []
+        for position in positions:
+            if not pipeline.seek_simple(
+                    Gst.Format.TIME,
+                    Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT |
+                    Gst.SeekFlags.SNAP_NEAREST,
+                    int(duration * position)):
+                _log.warning('seek failed')
+                return None
+            frame = pull_frame(appsink)
+            if not frame:
+                return None
+            frames.append(frame[1])
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+    thumb = frames.pop(0)
+    if thumb.width > thumb_width:
+        thumb = thumb.resize(
+            (thumb_width, round(thumb.height * thumb_width / thumb.width)),
+            Image.BILINEAR)
+    thumb.save(thumb_path)
+
+    tile_size = (
+        tile_width, round(frames[0].height * tile_width / frames[0].width))
+    rows = -(-count // columns)
+    sprite = Image.new('RGB', (tile_size[0] * min(count, columns),
+                               tile_size[1] * rows))
+    for i, frame in enumerate(frames):
+        sprite.paste(frame.resize(tile_size, Image.BILINEAR),
+                     ((i % columns) * tile_size[0],
+                      (i // columns) * tile_size[1]))
+    sprite.save(sprite_path)
+    _log.info(f'thumbnail and {count} previews saved')
+
+    return duration, tile_size
+
+
+def add_element(pipeline, factory, name=None):
+    '''
+    Make a GStreamer element and add it to pipeline
+    '''
+    element = Gst.ElementFactory.make(factory, name)
+    if element is None:
+        raise Exception(f'GStreamer element {factory} is missing')
+    pipeline.add(element)
+    return element
+
+
+def link_elements(*elements):
+    '''
+    Link elements one after another
+    '''
+    for upstream, downstream in zip(elements, elements[1:]):
+        upstream.link(downstream)
+
+
+def link_fakesink(pipeline, pad):
+    '''
+    Throw away what comes out of pad, which appeared while pipeline is
+    already running
+    '''
+    fakesink = add_element(pipeline, 'fakesink')
+    fakesink.set_property('sync', False)
+    fakesink.set_property('async', False)
+    fakesink.sync_state_with_parent()
+    pad.link(fakesink.get_static_pad('sink'))
+
+
+def videoscale_caps(video_info, dimensions):
+    '''
+    Caps to scale the video described by video_info to fit dimensions
+    '''
+    caps_struct = Gst.Structure.new_empty('video/x-raw')
+    caps_struct.set_value('pixel-aspect-ratio', Gst.Fraction(1, 1))
+    caps_struct.set_value('framerate', Gst.Fraction(30, 1))
+    if video_info.get_height() > video_info.get_width():
+        # portrait
+        caps_struct.set_value('height', dimensions[1])
+    else:
+        # landscape
+        caps_struct.set_value('width', dimensions[0])
+    caps = Gst.Caps.new_empty()
+    caps.append_structure(caps_struct)
+    return caps
+
+
 class VideoTranscoder:
     '''
     Video transcoder
@@ -192,7 +332,8 @@ class VideoTranscoder:
             raise Exception('dimensions must be tuple: (width, height)')
 
         self._setup_pipeline()
-        self.data = discover(self.source_path)
+        # The processor may have discovered the source already
+        self.data = kwargs.get('metadata') or discover(self.source_path)
         self._link_elements()
         self.__setup_videoscale_capsfilter()
         self.pipeline.set_state(Gst.State.PLAYING)
@@ -332,19 +473,8 @@ class VideoTranscoder:
         '''
         Sets up the output format (width, height) for the video
         '''
-        caps_struct = Gst.Structure.new_empty('video/x-raw')
-        caps_struct.set_value('pixel-aspect-ratio', Gst.Fraction(1, 1))
-        caps_struct.set_value('framerate', Gst.Fraction(30, 1))
-        video_info = self.data.get_video_streams()[0]
-        if video_info.get_height() > video_info.get_width():
-            # portrait
-            caps_struct.set_value('height', self.destination_dimensions[1])
-        else:
-            # landscape
-            caps_struct.set_value('width', self.destination_dimensions[0])
-        caps = Gst.Caps.new_empty()
-        caps.append_structure(caps_struct)
-        self.capsfilter.set_property('caps', caps)
+        self.capsfilter.set_property('caps', videoscale_caps(
+            self.data.get_video_streams()[0], self.destination_dimensions))
 
     def _on_message(self, bus, message):
         _log.debug((bus, message, message.type))
@@ -397,6 +527,617 @@ class VideoTranscoder:
         self.loop.quit()
 
 
+class MultiVideoTranscoder:
+    '''
+    Video transcoder for several resolutions at once
+
+    Transcodes the SRC video file to a VP8 WebM video file per resolution,
+    decoding it only once: the decoded video is tee'd into a
+    videoscale ! vp8enc ! webmmux branch per resolution, and the audio is
+    encoded once and tee'd to all of the muxers.
+
+    This takes less CPU time in total than a VideoTranscoder per resolution,
+    but more of it at the same time.
+    '''
+    def __init__(self):
+        _log.info('Initializing MultiVideoTranscoder...')
+        self.progress_percentage = {}
+        self.loop = GLib.MainLoop()
+
+    def transcode(self, src, destinations, default_res, num_res, **kwargs):
+        '''
+        Transcode a video file into several sizes
+
+        destinations maps the names of the resolutions (see
+        ACCEPTED_RESOLUTIONS) to the paths to write them to.  Afterwards
+        self.dst_data maps them to the discovered transcoded files, or is
+        None if transcoding failed.
+        '''
+        self.source_path = src
+        self.destinations = destinations
+
+        # See VideoTranscoder.transcode
+        self.vp8_threads = kwargs.get('vp8_threads', CPU_COUNT - 1)
+        if self.vp8_threads == 0:
+            self.vp8_threads = CPU_COUNT
+        self.vorbis_quality = kwargs.get('vorbis_quality', 0.3)
+
+        self._progress_callback = kwargs.get('progress_callback') or None
+
+        self.num_of_resolutions = num_res
+        self.default_resolution = default_res
+        self.progress_percentage = {res: 0 for res in destinations}
+
+        # See VideoTranscoder.transcode
+        self.data = kwargs.get('metadata') or discover(self.source_path)
+        self._setup_pipeline()
+        self.pipeline.set_state(Gst.State.PLAYING)
+        _log.info('Transcoding to {}...'.format(', '.join(destinations)))
+        self.loop.run()
+
+    def _setup_pipeline(self):
+        _log.debug('Setting up multi resolution transcoding pipeline')
+        pipeline = self.pipeline = Gst.Pipeline.new(
+            'MultiVideoTranscoderPipeline')
+
+        filesrc = add_element(pipeline, 'filesrc', 'filesrc')
+        filesrc.set_property('location', self.source_path)
+        decoder = add_element(pipeline, 'decodebin', 'decoder')
+        decoder.connect('pad-added', self._on_dynamic_pad)
+        filesrc.link(decoder)
+
+        # The video is decoded once, then split to be scaled and encoded
+        # for each resolution
+        self.videoqueue = add_element(pipeline, 'queue', 'videoqueue')
+        videotee = add_element(pipeline, 'tee', 'videotee')
+        link_elements(
+            self.videoqueue,
+            add_element(pipeline, 'videorate', 'videorate'),
+            add_element(pipeline, 'videoconvert', 'videoconvert'),
+            videotee)
+
+        # The audio is the same for all resolutions, so it's only encoded
+        # once
+        has_audio = bool(self.data.get_audio_streams())
+        self.audioqueue = add_element(pipeline, 'queue', 'audioqueue')
+        if has_audio:
+            audiorate = add_element(pipeline, 'audiorate', 'audiorate')
+            audiorate.set_property('tolerance', 80000000)
+            audiocapsfilter = add_element(
+                pipeline, 'capsfilter', 'audiocapsfilter')
+            audiocaps = Gst.Caps.new_empty()
+            audiocaps.append_structure(Gst.Structure.new_empty('audio/x-raw'))
+            audiocapsfilter.set_property('caps', audiocaps)
+            vorbisenc = add_element(pipeline, 'vorbisenc', 'vorbisenc')
+            vorbisenc.set_property('quality', self.vorbis_quality)
+            audiotee = add_element(pipeline, 'tee', 'audiotee')
+            link_elements(
+                self.audioqueue, audiorate,
+                add_element(pipeline, 'audioconvert', 'audioconvert'),
+                audiocapsfilter, vorbisenc, audiotee)
+
+        video_info = self.data.get_video_streams()[0]
+        for res, destination_path in self.destinations.items():
+            capsfilter = add_element(
+                pipeline, 'capsfilter', 'capsfilter_' + res)
+            capsfilter.set_property('caps', videoscale_caps(
+                video_info, ACCEPTED_RESOLUTIONS[res]))
+            vp8enc = add_element(pipeline, 'vp8enc', 'vp8enc_' + res)
+            vp8enc.set_property('threads', self.vp8_threads)
+            webmmux = add_element(pipeline, 'webmmux', 'webmmux_' + res)
+            link_elements(
+                videotee,
+                add_element(pipeline, 'queue', 'videoqueue_' + res),
+                add_element(pipeline, 'videoscale', 'videoscale_' + res),
+                capsfilter, vp8enc, webmmux)
+
+            if has_audio:
+                link_elements(
+                    audiotee,
+                    add_element(pipeline, 'queue', 'audioqueue_' + res),
+                    webmmux)
+
+            progressreport = add_element(
+                pipeline, 'progressreport', 'progressreport_' + res)
+            progressreport.set_property('update-freq', 1)
+            progressreport.set_property('silent', True)
+            filesink = add_element(
+                pipeline, 'filesink', 'filesink_' + res)
+            filesink.set_property('location', destination_path)
+            link_elements(webmmux, progressreport, filesink)
+
+        self.bus = self.pipeline.get_bus()
+        self.bus.add_signal_watch()
+        self.bus.connect('message', self._on_message)
+
+    def _on_dynamic_pad(self, dbin, pad):
+        '''
+        Callback called when ``decodebin`` has a pad that we can connect to
+        '''
+        if pad.query_caps(None).to_string().startswith('video'):
+            _log.debug('linking video to the pad dynamically')
+            pad.link(self.videoqueue.get_static_pad('sink'))
+        else:
+            _log.debug('linking audio to the pad dynamically')
+            pad.link(self.audioqueue.get_static_pad('sink'))
+
+    def _on_message(self, bus, message):
+        _log.debug((bus, message, message.type))
+        if message.type == Gst.MessageType.EOS:
+            self.dst_data = {
+                res: discover(path)
+                for res, path in self.destinations.items()}
+            self._stop()
+            _log.info('Done')
+        elif message.type == Gst.MessageType.ELEMENT:
+            # Which resolution's branch the progressreport is in
+            res = message.src.get_name().replace('progressreport_', '', 1)
+            if message.has_name('progress') and \
+                    res in self.progress_percentage:
+                self._on_progress(res, message.get_structure())
+        elif message.type == Gst.MessageType.ERROR:
+            _log.error(f'Got error: {message.parse_error()}')
+            self.dst_data = None
+            self._stop()
+
+    def _on_progress(self, res, structure):
+        (success, percent) = structure.get_int('percent')
+        previous = self.progress_percentage[res]
+        if not success or percent == previous:
+            return
+
+        # See VideoTranscoder._on_message
+        if previous > percent and percent == 0:
+            percent = 100
+        self.progress_percentage[res] = percent
+
+        if self._progress_callback:
+            increment = (percent - previous) / self.num_of_resolutions
+            if res == self.default_resolution:
+                self._progress_callback(increment, percent)
+            else:
+                self._progress_callback(increment)
+        _log.info(f'{percent}% of {res} resolution done...')
+
+    def _stop(self):
+        if hasattr(self, 'pipeline'):
+            self.pipeline.set_state(Gst.State.NULL)
+
+        GLib.idle_add(self.loop.quit)
+
+
+class VideoChunkTranscoder:
+    '''
+    Transcoder for a part of a video
+
+    Transcodes the time range START..STOP (in nanoseconds) of the SRC video
+    file to a VP8 WebM video file without audio at DST.  The parts of a
+    video made with the same dimensions can be put together again with a
+    ChunkStitcher.
+    '''
+    def __init__(self):
+        _log.info('Initializing VideoChunkTranscoder...')
+        self.progress_percentage = 0
+        self.loop = GLib.MainLoop()
+
+    def transcode(self, src, dst, start, stop, dimensions, num_parts,
+                  **kwargs):
+        '''
+        Transcode a part of a video file
+
+        The progress of this part is reported as 1/num_parts of the whole.
+        Afterwards self.dst_data is the discovered part, or None if
+        transcoding failed.
+        '''
+        self.source_path = src
+        self.destination_path = dst
+        self.start = start
+        self.stop = stop
+        self.num_parts = num_parts
+        self.dst_data = None
+
+        # See VideoTranscoder.transcode
+        self.vp8_quality = kwargs.get('vp8_quality', 8)
+        self.vp8_threads = kwargs.get('vp8_threads', CPU_COUNT - 1)
+        if self.vp8_threads == 0:
+            self.vp8_threads = CPU_COUNT
+        self._progress_callback = kwargs.get('progress_callback') or None
+
+        self.data = kwargs.get('metadata') or discover(self.source_path)
+        self._decoded_pads = []
+        self._blocking_probes = []
+        self._no_more_pads = threading.Event()
+        self._setup_pipeline(dimensions)
+
+        # Nothing gets through the decoder's pads until it has seeked to
+        # the start of the part, see _on_dynamic_pad
+        self.pipeline.set_state(Gst.State.PLAYING)
+        if not self._no_more_pads.wait(30) or not self._seek():
+            _log.error('Could not seek to the part to transcode')
+            self._stop()
+            return
+        _log.info('Transcoding {:.1f}s..{:.1f}s...'.format(
+            start / Gst.SECOND, stop / Gst.SECOND))
+        self.loop.run()
+
+    def _setup_pipeline(self, dimensions):
+        _log.debug('Setting up chunk transcoding pipeline')
+        pipeline = self.pipeline = Gst.Pipeline.new(
+            'VideoChunkTranscoderPipeline')
+
+        filesrc = add_element(pipeline, 'filesrc')
+        filesrc.set_property('location', self.source_path)
+        decoder = add_element(pipeline, 'decodebin')
+        decoder.connect('pad-added', self._on_dynamic_pad)
+        decoder.connect('no-more-pads', self._on_no_more_pads)
+        filesrc.link(decoder)
+
+        self.videoqueue = add_element(pipeline, 'queue')
+        capsfilter = add_element(pipeline, 'capsfilter')
+        capsfilter.set_property('caps', videoscale_caps(
+            self.data.get_video_streams()[0], dimensions))
+        # The progress is measured on the decoded video, in stream time
+        self.progressreport = add_element(pipeline, 'progressreport')
+        self.progressreport.set_property('update-freq', 1)
+        self.progressreport.set_property('silent', True)
+        vp8enc = add_element(pipeline, 'vp8enc')
+        vp8enc.set_property('threads', self.vp8_threads)
+        filesink = add_element(pipeline, 'filesink')
+        filesink.set_property('location', self.destination_path)
+        link_elements(
+            self.videoqueue,
+            add_element(pipeline, 'videorate'),
+            add_element(pipeline, 'videoconvert'),
+            add_element(pipeline, 'videoscale'),
+            capsfilter, self.progressreport, vp8enc,
+            add_element(pipeline, 'webmmux'),
+            filesink)
+
+        self.bus = pipeline.get_bus()
+        self.bus.add_signal_watch()
+        self.bus.connect('message', self._on_message)
+
+    def _on_dynamic_pad(self, dbin, pad):
+        '''
+        Callback called when ``decodebin`` has a pad that we can connect to
+
+        The pad is blocked until _seek() is done, so that none of the
+        beginning of the video gets into the part.
+        '''
+        self._decoded_pads.append(pad)
+        self._blocking_probes.append((pad, pad.add_probe(
+            Gst.PadProbeType.BLOCK | Gst.PadProbeType.BUFFER,
+            lambda pad, info: Gst.PadProbeReturn.OK)))
+        if pad.query_caps(None).to_string().startswith('video') and \
+                not self.videoqueue.get_static_pad('sink').is_linked():
+            pad.link(self.videoqueue.get_static_pad('sink'))
+        else:
+            # The audio is encoded by the ChunkStitcher
+            link_fakesink(self.pipeline, pad)
+
+    def _on_no_more_pads(self, dbin):
+        self._no_more_pads.set()
+
+    def _seek(self):
+        '''
+        Seek the decoder to the part to transcode, then let the data through
+        '''
+        seeked = self._decoded_pads[0].send_event(Gst.Event.new_seek(
+            1.0, Gst.Format.TIME,
+            Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
+            Gst.SeekType.SET, self.start, Gst.SeekType.SET, self.stop))
+        for pad, probe in self._blocking_probes:
+            pad.remove_probe(probe)
+        return seeked
+
+    def _on_message(self, bus, message):
+        _log.debug((bus, message, message.type))
+        if message.type == Gst.MessageType.EOS:
+            self.dst_data = discover(self.destination_path)
+            self._stop()
+            _log.info('Done')
+        elif message.type == Gst.MessageType.ELEMENT:
+            if message.has_name('progress') and \
+                    message.src == self.progressreport:
+                self._on_progress(message.get_structure())
+        elif message.type == Gst.MessageType.ERROR:
+            _log.error(f'Got error: {message.parse_error()}')
+            self.dst_data = None
+            self._stop()
+
+    def _on_progress(self, structure):
+        # progressreport counts from the start of the video, in seconds
+        (success, current) = structure.get_int64('current')
+        if not success:
+            return
+        percent = int(100 * (current * Gst.SECOND - self.start)
+                      / (self.stop - self.start))
+        percent = max(self.progress_percentage, min(percent, 100))
+        if percent == self.progress_percentage:
+            return
+
+        increment = percent - self.progress_percentage
+        self.progress_percentage = percent
+        if self._progress_callback:
+            self._progress_callback(increment / self.num_parts)
+        _log.info(f'{percent}% of the part done...')
+
+    def _stop(self):
+        self.pipeline.set_state(Gst.State.NULL)
+        GLib.idle_add(self.loop.quit)
+
+
+# decodebin's GstAutoplugSelectResult, which isn't introspectable
+AUTOPLUG_SELECT_TRY = 0
+AUTOPLUG_SELECT_EXPOSE = 1
+
+
+class ChunkStitcher:
+    '''
+    Puts the parts of a video made by VideoChunkTranscoder together again
+
+    The VP8 video of the parts is remuxed one after the other, and the audio
+    of the SRC video file is encoded in one go, to a WebM video file at DST.
+    '''
+    def __init__(self):
+        _log.info('Initializing ChunkStitcher...')
+        self.loop = GLib.MainLoop()
+
+    def stitch(self, chunks, src, dst, **kwargs):
+        '''
+        Stitch the chunks, a list of paths in order, together
+
+        Afterwards self.dst_data is the discovered video, or None if
+        stitching failed.
+        '''
+        self.destination_path = dst
+        self.dst_data = None
+        self.vorbis_quality = kwargs.get('vorbis_quality', 0.3)
+
+        # See VideoTranscoder.transcode
+        self.data = kwargs.get('metadata') or discover(src)
+        self._setup_pipeline(chunks, src)
+        self.pipeline.set_state(Gst.State.PLAYING)
+        _log.info(f'Stitching {len(chunks)} parts together...')
+        self.loop.run()
+
+    def _setup_pipeline(self, chunks, src):
+        _log.debug('Setting up stitching pipeline')
+        pipeline = self.pipeline = Gst.Pipeline.new('ChunkStitcherPipeline')
+
+        webmmux = add_element(pipeline, 'webmmux')
+        filesink = add_element(pipeline, 'filesink')
+        filesink.set_property('location', self.destination_path)
+        webmmux.link(filesink)
+
+        # concat plays its sink pads one after the other, in the order they
+        # were requested in
+        concat = add_element(pipeline, 'concat')
+        for chunk in chunks:
+            filesrc = add_element(pipeline, 'filesrc')
+            filesrc.set_property('location', chunk)
+            demuxer = add_element(pipeline, 'matroskademux')
+            filesrc.link(demuxer)
+            demuxer.connect('pad-added', self._on_demuxed_pad,
+                            concat.get_request_pad('sink_%u'))
+        link_elements(concat, add_element(pipeline, 'queue'), webmmux)
+
+        if self.data.get_audio_streams():
+            filesrc = add_element(pipeline, 'filesrc')
+            filesrc.set_property('location', src)
+            decoder = add_element(pipeline, 'decodebin')
+            decoder.connect('autoplug-select', self._on_autoplug_select)
+            decoder.connect('pad-added', self._on_decoded_pad)
+            filesrc.link(decoder)
+
+            self.audioqueue = add_element(pipeline, 'queue')
+            audiorate = add_element(pipeline, 'audiorate')
+            audiorate.set_property('tolerance', 80000000)
+            audiocapsfilter = add_element(pipeline, 'capsfilter')
+            audiocaps = Gst.Caps.new_empty()
+            audiocaps.append_structure(Gst.Structure.new_empty('audio/x-raw'))
+            audiocapsfilter.set_property('caps', audiocaps)
+            vorbisenc = add_element(pipeline, 'vorbisenc')
+            vorbisenc.set_property('quality', self.vorbis_quality)
+            link_elements(
+                self.audioqueue, audiorate,
+                add_element(pipeline, 'audioconvert'),
+                audiocapsfilter, vorbisenc, webmmux)
+
+        self.bus = pipeline.get_bus()
+        self.bus.add_signal_watch()
+        self.bus.connect('message', self._on_message)
+
+    def _on_demuxed_pad(self, demuxer, pad, concat_pad):
+        pad.link(concat_pad)
+
+    def _on_autoplug_select(self, dbin, pad, caps, factory):
+        '''
+        Don't decode the video of the source again, only its audio is used
+        '''
+        if factory.list_is_type(Gst.ELEMENT_FACTORY_TYPE_DECODER |
+                                Gst.ELEMENT_FACTORY_TYPE_MEDIA_VIDEO):
+            return AUTOPLUG_SELECT_EXPOSE
+        return AUTOPLUG_SELECT_TRY
+
+    def _on_decoded_pad(self, dbin, pad):
+        if pad.query_caps(None).to_string().startswith('audio') and \
+                not self.audioqueue.get_static_pad('sink').is_linked():
+            pad.link(self.audioqueue.get_static_pad('sink'))
+        else:
+            link_fakesink(self.pipeline, pad)
+
+    def _on_message(self, bus, message):
+        _log.debug((bus, message, message.type))
+        if message.type == Gst.MessageType.EOS:
+            self.dst_data = discover(self.destination_path)
+            self._stop()
+            _log.info('Done')
+        elif message.type == Gst.MessageType.ERROR:
+            _log.error(f'Got error: {message.parse_error()}')
+            self.dst_data = None
+            self._stop()
+
+    def _stop(self):
+        self.pipeline.set_state(Gst.State.NULL)
+        GLib.idle_add(self.loop.quit)
+
+
+# AAC encoders for HLS, best first
+AAC_ENCODERS = ['fdkaacenc', 'avenc_aac', 'voaacenc']
+
+# The other GStreamer elements HLSTranscoder needs
+HLS_ELEMENTS = ['x264enc', 'h264parse', 'hlssink2']
+
+
+def hls_missing_elements(audio=True):
+    '''
+    List the GStreamer elements HLSTranscoder needs that aren't installed,
+    an AAC encoder among them if audio is True
+    '''
+    missing = [factory for factory in HLS_ELEMENTS
+               if not Gst.ElementFactory.find(factory)]
+    if audio and not any(Gst.ElementFactory.find(factory)
+                         for factory in AAC_ENCODERS):
+        missing.append('an AAC encoder ({})'.format(
+            ', '.join(AAC_ENCODERS)))
+    return missing
+
+
+class HLSTranscoder:
+    '''
+    HLS transcoder
+
+    Transcodes the SRC video file to an HLS media playlist of H.264/AAC
+    MPEG-TS segments per resolution, decoding it only once: as in
+    MultiVideoTranscoder the decoded video is tee'd into a branch per
+    resolution and the audio is encoded once for all of them.
+    '''
+    def __init__(self):
+        _log.info('Initializing HLSTranscoder...')
+        self.loop = GLib.MainLoop()
+
+    def transcode(self, src, destinations, target_duration=6,
+                  playlist_name='playlist.m3u8', **kwargs):
+        '''
+        Transcode a video file to segments of about target_duration seconds
+
+        destinations maps the names of the resolutions (see
+        ACCEPTED_RESOLUTIONS) to the directories to write them to.
+        Afterwards self.playlist_paths maps them to the paths to their media
+        playlists, or is None if transcoding failed.
+        '''
+        self.source_path = src
+        self.destinations = destinations
+        self.playlist_paths = {
+            res: os.path.join(dst_dir, playlist_name)
+            for res, dst_dir in destinations.items()}
+
+        # See VideoTranscoder.transcode
+        self.data = kwargs.get('metadata') or discover(self.source_path)
+        self._setup_pipeline(target_duration)
+        self.pipeline.set_state(Gst.State.PLAYING)
+        _log.info('Transcoding to HLS...')
+        self.loop.run()
+
+    def _setup_pipeline(self, target_duration):
+        _log.debug('Setting up HLS transcoding pipeline')
+        pipeline = self.pipeline = Gst.Pipeline.new('HLSTranscoderPipeline')
+
+        filesrc = add_element(pipeline, 'filesrc')
+        filesrc.set_property('location', self.source_path)
+        decoder = add_element(pipeline, 'decodebin')
+        decoder.connect('pad-added', self._on_dynamic_pad)
+        filesrc.link(decoder)
+
+        self.videoqueue = add_element(pipeline, 'queue')
+        videotee = add_element(pipeline, 'tee')
+        link_elements(
+            self.videoqueue,
+            add_element(pipeline, 'videorate'),
+            add_element(pipeline, 'videoconvert'),
+            videotee)
+
+        has_audio = bool(self.data.get_audio_streams())
+        self.audioqueue = add_element(pipeline, 'queue')
+        if has_audio:
+            aacenc = None
+            for factory in AAC_ENCODERS:
+                if Gst.ElementFactory.find(factory):
+                    aacenc = add_element(pipeline, factory)
+                    break
+            if aacenc is None:
+                raise Exception('No AAC encoder found, tried {}'.format(
+                    ', '.join(AAC_ENCODERS)))
+            audiotee = add_element(pipeline, 'tee')
+            link_elements(
+                self.audioqueue,
+                add_element(pipeline, 'audioconvert'),
+                add_element(pipeline, 'audioresample'),
+                aacenc, add_element(pipeline, 'aacparse'), audiotee)
+
+        video_info = self.data.get_video_streams()[0]
+        for res, dst_dir in self.destinations.items():
+            hlssink = add_element(pipeline, 'hlssink2')
+            hlssink.set_property(
+                'location', os.path.join(dst_dir, 'segment%05d.ts'))
+            hlssink.set_property('playlist-location', self.playlist_paths[res])
+            hlssink.set_property('target-duration', target_duration)
+            # Keep all of the segments, and all of them in the playlist
+            hlssink.set_property('max-files', 0)
+            hlssink.set_property('playlist-length', 0)
+
+            capsfilter = add_element(pipeline, 'capsfilter')
+            capsfilter.set_property('caps', videoscale_caps(
+                video_info, ACCEPTED_RESOLUTIONS[res]))
+            x264enc = add_element(pipeline, 'x264enc')
+            Gst.util_set_object_arg(x264enc, 'pass', 'qual')
+            # Segments have to start on a keyframe, videoscale_caps sets the
+            # framerate to 30
+            x264enc.set_property('key-int-max', 30 * target_duration)
+            h264parse = add_element(pipeline, 'h264parse')
+            link_elements(
+                videotee,
+                add_element(pipeline, 'queue'),
+                add_element(pipeline, 'videoscale'),
+                capsfilter, x264enc, h264parse)
+            h264parse.get_static_pad('src').link(
+                hlssink.get_request_pad('video'))
+
+            if has_audio:
+                audioqueue = add_element(pipeline, 'queue')
+                audiotee.link(audioqueue)
+                audioqueue.get_static_pad('src').link(
+                    hlssink.get_request_pad('audio'))
+
+        self.bus = pipeline.get_bus()
+        self.bus.add_signal_watch()
+        self.bus.connect('message', self._on_message)
+
+    def _on_dynamic_pad(self, dbin, pad):
+        '''
+        Callback called when ``decodebin`` has a pad that we can connect to
+        '''
+        if pad.query_caps(None).to_string().startswith('video'):
+            pad.link(self.videoqueue.get_static_pad('sink'))
+        elif self.data.get_audio_streams():
+            pad.link(self.audioqueue.get_static_pad('sink'))
+
+    def _on_message(self, bus, message):
+        _log.debug((bus, message, message.type))
+        if message.type == Gst.MessageType.EOS:
+            self._stop()
+            _log.info('Done')
+        elif message.type == Gst.MessageType.ERROR:
+            _log.error(f'Got error: {message.parse_error()}')
+            self.playlist_paths = None
+            self._stop()
+
+    def _stop(self):
+        self.pipeline.set_state(Gst.State.NULL)
+        GLib.idle_add(self.loop.quit)
+
+
 if __name__ == '__main__':
     os.nice(19)
     from optparse import OptionParser
@@ -15,6 +15,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import os
+from urllib.parse import quote, unquote, urlparse
 
 from mediagoblin import mg_globals as mgg
 
@@ -31,6 +33,87 @@ ACCEPTED_RESOLUTIONS = {
 _log = logging.getLogger(__name__)
 
 
+class StoredTags:
+    '''
+    Stands in for a Gst.TagList, from the tags kept in orig_metadata
+    '''
+    def __init__(self, tags):
+        self.tags = tags
+
+    def get_string(self, tag):
+        return (tag in self.tags, self.tags.get(tag))
+
+
+class StoredStreamInfo:
+    '''
+    Stands in for a GstPbutils.DiscovererStreamInfo, from a stream kept in
+    orig_metadata
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+
+    def get_tags(self):
+        if self.stream.get('tags'):
+            return StoredTags(self.stream['tags'])
+        return None
+
+    def get_width(self):
+        return self.stream['width']
+
+    def get_height(self):
+        return self.stream['height']
+
+    def get_bitrate(self):
+        return self.stream.get('bitrate') or 0
+
+    def get_max_bitrate(self):
+        return self.stream.get('max_bitrate') or 0
+
+    def get_framerate_num(self):
+        return self.stream['videorate'][0]
+
+    def get_framerate_denom(self):
+        return self.stream['videorate'][1]
+
+
+class StoredDiscovery:
+    '''
+    Stands in for the GstPbutils.DiscovererInfo of the video at path, made
+    from its orig_metadata (see VideoData), so that it doesn't have to be
+    discovered again.  Only what processing uses of it is there.
+    '''
+    def __init__(self, orig_metadata, path):
+        self.orig_metadata = orig_metadata
+        self.path = path
+
+    @staticmethod
+    def can_use(orig_metadata):
+        '''
+        Whether orig_metadata is complete enough to stand in for discovery
+        '''
+        return bool(orig_metadata and orig_metadata.get('video') and
+                    orig_metadata.get('common', {}).get('duration'))
+
+    def get_video_streams(self):
+        return [StoredStreamInfo(stream)
+                for stream in self.orig_metadata.get('video', [])]
+
+    def get_audio_streams(self):
+        return [StoredStreamInfo(stream)
+                for stream in self.orig_metadata.get('audio', [])]
+
+    def get_duration(self):
+        return self.orig_metadata['common']['duration']
+
+    def get_tags(self):
+        if self.orig_metadata['common'].get('tags'):
+            return StoredTags(self.orig_metadata['common']['tags'])
+        return None
+
+    def get_uri(self):
+        return 'file://' + quote(os.path.abspath(self.path))
+
+
 def skip_transcode(metadata, size):
     '''
     Checks video metadata against configuration values for skip_transcode.
@@ -84,4 +167,130 @@ def skip_transcode(metadata, size):
             if not video_info.get_width() <= size[0]:
                 return False
 
+    if config['max_bitrate']:
+        if not 0 < video_bitrate(metadata) <= config['max_bitrate']:
+            return False
+
     return True
+
+
+def video_bitrate(metadata):
+    '''
+    Bitrate of the discovered video in bits per second, or 0 if unknown.
+
+    Most WebM files don't state a bitrate, so this falls back to the size of
+    the file over its duration.
+    '''
+    bitrate = 0
+    for video_info in metadata.get_video_streams():
+        bitrate = max(bitrate, video_info.get_bitrate(),
+                      video_info.get_max_bitrate())
+    if bitrate:
+        return bitrate
+
+    duration = metadata.get_duration()  # in nanoseconds
+    uri = urlparse(metadata.get_uri())
+    if uri.scheme != 'file' or not duration:
+        return 0
+    size = os.path.getsize(unquote(uri.path))
+    return int(size * 8 * 10**9 / duration)
+
+
+def passthrough_resolution(metadata, resolutions):
+    '''
+    Pick the resolution out of resolutions that the video can be published
+    as without transcoding, or None.
+
+    That is the smallest one that it passes skip_transcode for and fits in,
+    since it would otherwise be scaled down for that one.  Failing that
+    (with dimensions_match off), the largest one it passes skip_transcode
+    for.
+    '''
+    candidates = sorted(
+        (res for res in resolutions
+         if skip_transcode(metadata, ACCEPTED_RESOLUTIONS[res])),
+        key=lambda res: ACCEPTED_RESOLUTIONS[res])
+    if not candidates:
+        return None
+
+    video_info = metadata.get_video_streams()[0]
+    for res in candidates:
+        width, height = ACCEPTED_RESOLUTIONS[res]
+        if video_info.get_width() <= width and \
+           video_info.get_height() <= height:
+            return res
+    return candidates[-1]
+
+
+def hls_playlist_segments(playlist_path):
+    '''
+    Read the (duration, uri) of each segment in an HLS media playlist
+    '''
+    segments = []
+    duration = None
+    with open(playlist_path) as playlist:
+        for line in playlist:
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line and not line.startswith('#'):
+                segments.append((duration, line))
+                duration = None
+    return segments
+
+
+def hls_peak_bandwidth(playlist_path):
+    '''
+    Work out the BANDWIDTH of an HLS media playlist for the master playlist:
+    the highest bitrate of any of its segments, in bits per second
+    '''
+    directory = os.path.dirname(playlist_path)
+    peak = 0
+    for duration, uri in hls_playlist_segments(playlist_path):
+        if duration:
+            size = os.path.getsize(os.path.join(directory, uri))
+            peak = max(peak, int(size * 8 / duration))
+    return peak
+
+
+def write_hls_master_playlist(master_path, variants):
+    '''
+    Write an HLS master playlist listing variants, a list of
+    (uri, bandwidth, (width, height)) of the media playlists
+    '''
+    with open(master_path, 'w') as master:
+        master.write('#EXTM3U\n#EXT-X-VERSION:3\n')
+        for uri, bandwidth, (width, height) in variants:
+            master.write(
+                '#EXT-X-STREAM-INF:BANDWIDTH={},RESOLUTION={}x{}\n'
+                '{}\n'.format(bandwidth, width, height, uri))
+
+
+def vtt_timestamp(nanoseconds):
+    '''
+    Format a time in nanoseconds as a WebVTT timestamp
+    '''
+    milliseconds = nanoseconds // 10**6
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours:02}:{minutes:02}:{seconds:02}.{milliseconds:03}'
+
+
+def write_preview_vtt(vtt_path, sprite_uri, duration, count, columns,
+                      tile_size):
+    '''
+    Write a WebVTT file with a cue per tile of the scrub preview sprite sheet
+    at sprite_uri, made by capture_previews(), pointing at its tile with a
+    media fragment
+    '''
+    width, height = tile_size
+    with open(vtt_path, 'w') as vtt:
+        vtt.write('WEBVTT\n')
+        for i in range(count):
+            vtt.write('\n{} --> {}\n{}#xywh={},{},{},{}\n'.format(
+                vtt_timestamp(duration * i // count),
+                vtt_timestamp(duration * (i + 1) // count),
+                sprite_uri,
+                (i % columns) * width, (i // columns) * height,
+                width, height))
@@ -17,6 +17,7 @@
 from mediagoblin import mg_globals
 from mediagoblin.db.models import User, Privilege, UserBan, LocalUser
 from mediagoblin.db.base import Session
+from sqlalchemy.orm.util import identity_key
 from mediagoblin.tools.mail import send_email
 from mediagoblin.tools.response import redirect
 from datetime import datetime
@@ -125,6 +126,7 @@ def take_away_privileges(user,*privileges):
         ).first()
         if privilege in user.all_privileges:
             user.all_privileges.remove(privilege)
+            user.clear_permission_cache()
             return True
         return False
 
@@ -158,6 +160,7 @@ def give_privileges(user,*privileges):
         ).first()
         if privilege not in user.all_privileges:
             user.all_privileges.append(privilege)
+            user.clear_permission_cache()
             return True
         return False
 
@@ -182,6 +185,7 @@ def ban_user(user_id, expiration_date=None, reason=None):
         user_id=user_id,
         expiration_date=expiration_date,
         reason=reason)
+    _clear_permission_cache(user_id)
     return new_user_ban
 
 def unban_user(user_id):
@@ -198,8 +202,18 @@ def unban_user(user_id):
     if user_ban.count() == 0:
         return False
     user_ban.first().delete()
+    _clear_permission_cache(user_id)
     return True
 
+def _clear_permission_cache(user_id):
+    """
+    Make the user with user_id (if it is loaded) look up its ban status
+    and privileges again.
+    """
+    user = Session.identity_map.get(identity_key(User, user_id))
+    if user is not None:
+        user.clear_permission_cache()
+
 def parse_report_panel_settings(form):
     """
     This function parses the url arguments to which are used to filter reports
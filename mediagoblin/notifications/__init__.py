@@ -16,8 +16,10 @@
 
 import logging
 
+from sqlalchemy import event
+
 from mediagoblin.db.models import Notification, CommentSubscription, User, \
-                                  Comment, GenericModelReference
+                                  LocalUser, Comment, GenericModelReference
 from mediagoblin.notifications.task import email_notification_task
 from mediagoblin.notifications.tools import generate_comment_message
 
@@ -50,6 +52,7 @@ def trigger_notification(comment, media_entry, request):
             user_id=subscription.user_id,
         )
         cn.obj = comment
+        _add_unseen_notifications(subscription.user, 1)
         cn.save()
 
         if subscription.send_email:
@@ -65,10 +68,37 @@ def trigger_notification(comment, media_entry, request):
 
 def mark_notification_seen(notification):
     if notification:
-        notification.seen = True
+        # Only the request which actually marks it seen takes it off the
+        # counter, even if several mark it at once
+        marked = Notification.query.filter_by(
+            id=notification.id, seen=False).update(
+                {'seen': True}, synchronize_session='evaluate')
+        if marked == 1:
+            _add_unseen_notifications(notification.user, -1)
         notification.save()
 
 
+def _add_unseen_notifications(user, count):
+    '''
+    Adjust the unseen notification counter of a user (without saving).
+
+    The counter is updated in SQL, so concurrent requests don't lose counts.
+    '''
+    if isinstance(user, LocalUser):
+        user.unseen_notifications = LocalUser.unseen_notifications + count
+
+
+def recount_unseen_notifications(user_ids):
+    '''
+    Recount the unseen notification counter of users from scratch, for when
+    notifications are removed in bulk.
+    '''
+    for user in LocalUser.query.filter(LocalUser.id.in_(user_ids)):
+        user.unseen_notifications = Notification.query.filter_by(
+            user_id=user.id, seen=False).count()
+        user.save(commit=False)
+
+
 def mark_comment_notification_seen(comment_id, user):
     comment = Comment.query.get(comment_id)
 
@@ -147,35 +177,46 @@ NOTIFICATION_FETCH_LIMIT = 100
 
 
 def get_notifications(user_id, only_unseen=True):
-    query = Notification.query.filter_by(user_id=user_id)
-    wants_notifications = User.query.filter_by(id=user_id).first()\
-        .wants_notifications
+    user = User.query.get(user_id)
 
     # If the user does not want notifications, don't return any
-    if not wants_notifications:
+    if not user.wants_notifications:
         return None
 
-    if only_unseen:
-        query = query.filter_by(seen=False)
-
-    notifications = query.limit(
-        NOTIFICATION_FETCH_LIMIT).all()
+    if not only_unseen:
+        return Notification.query.filter_by(user_id=user_id).limit(
+            NOTIFICATION_FETCH_LIMIT).all()
+
+    # The header asks for these on every page, remember them until the
+    # user is expired (e.g. the next commit)
+    notifications = user.__dict__.get('_unseen_notifications_cache')
+    if notifications is None:
+        if user.unseen_notifications:
+            notifications = Notification.query.filter_by(
+                user_id=user_id, seen=False).limit(
+                    NOTIFICATION_FETCH_LIMIT).all()
+        else:
+            notifications = []
+        user._unseen_notifications_cache = notifications
 
     return notifications
 
 
 def get_notification_count(user_id, only_unseen=True):
-    query = Notification.query.filter_by(user_id=user_id)
-    wants_notifications = User.query.filter_by(id=user_id).first()\
-        .wants_notifications
+    user = User.query.get(user_id)
+
+    # If the user doesn't want notifications, don't show any
+    if not user.wants_notifications:
+        return None
 
     if only_unseen:
-        query = query.filter_by(seen=False)
+        return user.unseen_notifications
+
+    return Notification.query.filter_by(user_id=user_id).count()
 
-    # If the user doesn't want notifications, don't show any
-    if not wants_notifications:
-        count = None
-    else:
-        count = query.count()
 
-    return count
+@event.listens_for(User, 'expire', propagate=True)
+def _forget_unseen_notifications(user, attrs):
+    # user is None if it has been garbage collected in the meantime
+    if user is not None:
+        user.__dict__.pop('_unseen_notifications_cache', None)
@@ -19,7 +19,6 @@ import logging
 import os
 
 from mediagoblin.tools.pluginapi import get_config
-from mediagoblin.db.models import MediaEntry
 from mediagoblin.tools import pluginapi
 
 _log = logging.getLogger(__name__)
@@ -36,12 +35,9 @@ def make_stats(context):
     request = context['request']
     user = request.user
     if user:
-        num_queued = MediaEntry.query.filter_by(
-                actor=user.id, state='processing').count()
-        context['num_queued'] = num_queued
-        num_failed = MediaEntry.query.filter_by(
-                actor=user.id, state='failed').count()
-        context['num_failed'] = num_failed
+        # Kept up to date by mediagoblin.db.util.update_processing_counts
+        context['num_queued'] = user.num_processing
+        context['num_failed'] = user.num_failed
     return context
 
 
@@ -21,11 +21,15 @@ try:
 except:
     OrderedDict = None
 
+import base64
+import io
 import logging
 import os
 
+from PIL import Image
+
 from mediagoblin import mg_globals as mgg
-from mediagoblin.db.util import atomic_update
+from mediagoblin.db.util import atomic_update, update_processing_counts
 from mediagoblin.db.models import MediaEntry
 from mediagoblin.tools.pluginapi import hook_handle
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
@@ -343,6 +347,10 @@ def mark_entry_failed(entry_id, exc):
                  str(exc)),
              'fail_metadata': {}})
 
+    entry = MediaEntry.query.filter_by(id=entry_id).first()
+    if entry is not None:
+        update_processing_counts(entry.actor)
+
 
 def get_process_filename(entry, workbench, acceptable_files):
     """
@@ -402,6 +410,40 @@ def copy_original(entry, orig_filename, target_name, keyname="original"):
     store_public(entry, keyname, orig_filename, target_name)
 
 
+# Largest side of the placeholder images, in pixels
+PLACEHOLDER_SIZE = 8
+
+
+def image_placeholder(filename):
+    """
+    Get the dimensions of the image in filename, and a tiny version of it as
+    a data: URI, which pages can blow up as a blurry placeholder while the
+    image loads.  Images with transparency get no placeholder, it would
+    show through.
+
+    Returns them as a dict to store in the file_metadata of the image.
+    """
+    try:
+        image = Image.open(filename)
+    except OSError:
+        _log.warning('Cannot read {} to make a placeholder of'.format(
+            filename))
+        return {}
+
+    info = {'dimensions': list(image.size)}
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        return info
+
+    image.draft('RGB', (PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    image = image.convert('RGB')
+    image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.BOX)
+    buf = io.BytesIO()
+    image.save(buf, 'PNG', optimize=True)
+    info['placeholder'] = 'data:image/png;base64,' + \
+        base64.b64encode(buf.getvalue()).decode('ascii')
+    return info
+
+
 class BaseProcessingFail(Exception):
     """
     Base exception that all other processing failure messages should
@@ -22,6 +22,7 @@ import celery
 from celery.registry import tasks
 
 from mediagoblin import mg_globals as mgg
+from mediagoblin.db.util import update_processing_counts
 from . import mark_entry_failed, BaseProcessingFail
 from mediagoblin.tools.processing import json_processing_callback
 from mediagoblin.processing import get_entry_and_processing_manager
@@ -97,6 +98,7 @@ class ProcessMedia(celery.Task):
                 # the entry.state gets recorded on processor_class init
                 entry.state = 'processing'
                 entry.save()
+                update_processing_counts(entry.actor)
 
                 _log.debug(f'Processing {entry}')
 
@@ -117,6 +119,7 @@ class ProcessMedia(celery.Task):
             # no need to save at the end of the processing stage, probably ;)
             entry.state = 'processed'
             entry.save()
+            update_processing_counts(entry.actor)
 
             # Notify the PuSH servers as async task
             if mgg.app_config["push_urls"] and feed_url:
@@ -201,6 +201,47 @@ var audioPlayer = new Object();
 
     audioPlayer.formatTime = formatTime;
 
+    audioPlayer.drawWaveform = function (canvasElement) {
+        /**
+         * Draw the waveform peaks from the canvas' data-peaks URL, one
+         * line from the lowest to the highest sample for each pixel
+         *
+         * If they can't be loaded, e.g. because the media is served from
+         * another origin without CORS headers, the spectrogram image from
+         * data-spectrogram is shown instead.
+         */
+        $.getJSON($(canvasElement).data('peaks'), function (waveform) {
+            var data = waveform.data;
+            var ratio = window.devicePixelRatio || 1;
+            var width = canvasElement.width = canvasElement.clientWidth * ratio;
+            var height = canvasElement.height = canvasElement.clientHeight * ratio;
+            var scale = height / 2 / (1 << (waveform.bits - 1));
+            var context = canvasElement.getContext('2d');
+
+            context.fillStyle = 'rgb(134, 212, 177)';
+            for (var x = 0; x < width; x++) {
+                var start = Math.floor(x * waveform.length / width);
+                var stop = Math.max(
+                    start + 1, Math.floor((x + 1) * waveform.length / width));
+                var min = 0, max = 0;
+                for (var i = start; i < stop && i < waveform.length; i++) {
+                    min = Math.min(min, data[2 * i]);
+                    max = Math.max(max, data[2 * i + 1]);
+                }
+                context.fillRect(x, height / 2 - max * scale,
+                                 1, Math.max(1, (max - min) * scale));
+            }
+        }).fail(function () {
+            var spectrogram = $(canvasElement).data('spectrogram');
+            if (!spectrogram) {
+                return;
+            }
+            var image = $('<img alt="Spectrogram" />').attr('src', spectrogram);
+            $(canvasElement).replaceWith(image);
+            audioPlayer.attachToImage(image[0]);
+        });
+    };
+
     audioPlayer.attachToImage = function (imageElement) {
         /**
          * Attach the player to an image element
@@ -221,5 +262,11 @@ $(document).ready(function () {
 
     audioElements = $('.audio-media .audio-player');
     audioPlayer.init(audioElements[0]);
-    audioPlayer.attachToImage($('.audio-spectrogram img')[0]);
+    var waveform = $('.audio-spectrogram canvas.audio-waveform')[0];
+    if (waveform) {
+        audioPlayer.drawWaveform(waveform);
+        audioPlayer.attachToImage(waveform);
+    } else {
+        audioPlayer.attachToImage($('.audio-spectrogram img')[0]);
+    }
 });
@@ -2,19 +2,35 @@ var glplayer;
 
 $(document).ready(function()
 {
+  var plugins = {
+    videoJsResolutionSwitcher: {
+      ui: true,
+      default: 'low', // Default resolution [{Number}, 'low', 'high'],
+      dynamicLabel: true // Display dynamic labels or gear symbol
+    }
+  };
+
+  // Browsers that can stream the HLS playlist switch resolutions on their
+  // own, the others get the WebM files and the resolution switcher
+  var manifest = $('#video_1 source[type="application/vnd.apple.mpegurl"]');
+  if (manifest.length &&
+      document.getElementById('video_1').canPlayType(manifest.attr('type'))) {
+    $('#video_1 source').not(manifest).remove();
+    plugins = {};
+  } else {
+    manifest.remove();
+  }
+
+  var previews = $('#video_1 track[kind="metadata"][label="previews"]');
+  var previewsUrl = previews.length ? previews.prop('src') : null;
+
   // fire up the plugin
   glplayer = videojs('video_1', {
     controls: true,
     muted: false,
     height: 400,
     width: 700,
-    plugins: {
-      videoJsResolutionSwitcher: {
-        ui: true,
-        default: 'low', // Default resolution [{Number}, 'low', 'high'],
-        dynamicLabel: true // Display dynamic labels or gear symbol
-      }
-    }
+    plugins: plugins
   }, function(){
     var player = this;
     window.player = player
@@ -22,6 +38,59 @@ $(document).ready(function()
       console.info('Source changed to %s', player.src());
       console.log(player.currentTime());
     })
+    if (previewsUrl) {
+      showPreviews(player, previewsUrl);
+    }
   })
 
 });
+
+// Show the frame of the time under the pointer when hovering over the
+// progress bar.  The cues of the previews track point to the frames in a
+// sprite sheet as "sprite.jpg#xywh=x,y,width,height".
+function showPreviews(player, previewsUrl) {
+  var track;
+  var tracks = player.textTracks();
+  for (var i = 0; i < tracks.length; i++) {
+    if (tracks[i].kind == 'metadata' && tracks[i].label == 'previews') {
+      track = tracks[i];
+    }
+  }
+  if (!track) {
+    return;
+  }
+  // Metadata tracks only load their cues when they aren't disabled
+  track.mode = 'hidden';
+
+  var progress = $(player.el()).find('.vjs-progress-control');
+  var frame = $('<div class="vjs-preview-frame"></div>').appendTo(progress);
+
+  progress.on('mousemove', function(event) {
+    var offset = event.pageX - progress.offset().left;
+    var time = offset / progress.width() * player.duration();
+    var cues = track.cues || [];
+    for (var i = 0; i < cues.length; i++) {
+      if (cues[i].startTime <= time && time < cues[i].endTime) {
+        var match = /^(.*)#xywh=(\d+),(\d+),(\d+),(\d+)$/.exec(
+          cues[i].text);
+        if (!match) {
+          break;
+        }
+        var width = parseInt(match[4], 10);
+        frame.css({
+          'background-image': 'url("' + new URL(match[1], previewsUrl) + '")',
+          'background-position': '-' + match[2] + 'px -' + match[3] + 'px',
+          'width': width + 'px',
+          'height': match[5] + 'px',
+          'left': Math.max(0, Math.min(offset - width / 2,
+                                       progress.width() - width)) + 'px'
+        }).show();
+        return;
+      }
+    }
+    frame.hide();
+  });
+  progress.on('mouseleave', function() {
+    frame.hide();
+  });
+}
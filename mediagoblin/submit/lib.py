@@ -134,11 +134,16 @@ def submit_media(mg_app, user, submitted_file, filename,
 
     # Sniff the submitted media to determine which
     # media plugin should handle processing
-    media_type, media_manager = sniff_media(submitted_file, filename)
+    sniffed_media_data = {}
+    media_type, media_manager = sniff_media(
+        submitted_file, filename, media_data=sniffed_media_data)
 
     # create entry and save in database
     entry = new_upload_entry(user)
     entry.media_type = media_type
+    # Keep what sniffing found out, so processing doesn't have to again
+    if sniffed_media_data:
+        entry.media_data_init(**sniffed_media_data)
     entry.title = (title or str(splitext(filename)[0]))
 
     entry.description = description or ""
@@ -712,6 +712,10 @@ class TestAPI:
 
         comment = self._activity_to_feed(test_app, activity)[1]
 
+        media_url = data["object"]["links"]["self"]["href"]
+        with self.mock_oauth():
+            etag = test_app.get(media_url).headers["ETag"]
+
         # Now create an update activity to change the content
         activity = {
             "verb": "update",
@@ -730,3 +734,10 @@ class TestAPI:
             .first()
 
         assert model.content == activity["object"]["content"]
+
+        # The media it replies to changed along with it
+        with self.mock_oauth():
+            response = test_app.get(
+                media_url, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
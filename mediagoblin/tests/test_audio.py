@@ -21,6 +21,11 @@ import pytest
 from contextlib import contextmanager
 import logging
 import imghdr
+import time
+
+import numpy
+import soundfile
+from PIL import Image
 
 #os.environ['GST_DEBUG'] = '4,python:4'
 
@@ -30,10 +35,14 @@ gi.require_version('Gst', '1.0')
 from gi.repository import Gst
 Gst.init(None)
 
+from mediagoblin.media_types.audio import audiotospectrogram
+from mediagoblin.media_types.audio.waveform import waveform_peaks
 from mediagoblin.media_types.audio.transcoders import (AudioTranscoder,
         AudioThumbnailer)
 from mediagoblin.media_types.tools import discover
 
+_log = logging.getLogger(__name__)
+
 
 @contextmanager
 def create_audio():
@@ -83,6 +92,29 @@ def test_transcoder():
         assert len(info.get_audio_streams()) == 1
 
 
+def test_transcoder_decoded_audio():
+    '''
+    Tests that AudioTranscoder writes the decoded audio from the same pass
+    as the transcode, and on its own
+    '''
+    transcoder = AudioTranscoder()
+    with create_data_for_test() as (audio_name, result_name):
+        decoded = tempfile.NamedTemporaryFile(suffix='.wav')
+        transcoder.transcode(audio_name, result_name, quality=0.3,
+                             pcm_dst=decoded.name)
+        assert len(discover(result_name).get_audio_streams()) == 1
+        with soundfile.SoundFile(decoded.name) as pcm:
+            assert pcm.channels == 2
+            assert pcm.subtype == 'PCM_16'
+            assert pcm.frames > 0
+            frames = pcm.frames
+
+        only_decoded = tempfile.NamedTemporaryFile(suffix='.wav')
+        transcoder.transcode(audio_name, None, pcm_dst=only_decoded.name)
+        with soundfile.SoundFile(only_decoded.name) as pcm:
+            assert pcm.frames == frames
+
+
 def test_thumbnails():
     '''Test thumbnails generation.
 
@@ -102,3 +134,139 @@ def test_thumbnails():
         thumbnailer.spectrogram(new_name, thumbnail.name, width=100,
                                 fft_size=4096)
         assert imghdr.what(thumbnail.name) == 'jpeg'
+
+
+def test_waveform_peaks(tmpdir):
+    """
+    The waveform has the lowest and highest sample of each slice of the
+    audio, mixed down to mono.
+    """
+    audio_name = str(tmpdir.join('audio.wav'))
+    left = numpy.tile([0.5, -0.5, 0.0, 0.0], 2500)
+    right = numpy.tile([0.5, 0.5, 0.0, -1.0], 2500)
+    soundfile.write(audio_name, numpy.stack([left, right], axis=1), 8000,
+                    subtype='FLOAT')
+
+    waveform = waveform_peaks(audio_name, 1000)
+    assert waveform['samples_per_pixel'] == 10
+    assert waveform['length'] == 1000
+    assert len(waveform['data']) == 2000
+    # Each slice holds 0.5, 0.0, 0.0, -0.5, ... mixed down
+    assert waveform['data'][:4] == [-64, 64, -64, 64]
+
+    waveform = waveform_peaks(audio_name, 3000)
+    assert waveform['samples_per_pixel'] == 4
+    assert waveform['length'] == 2500
+
+
+@pytest.mark.parametrize('frames,overlap', [
+    (0, 0), (1000, 0), (1024, 0), (1025, 0), (44100, 0), (44100, 256),
+    (44100, 1000)])
+def test_spectrogram_total_blocks(tmpdir, frames, overlap):
+    """
+    The spectrogram columns are laid out before reading the audio, from the
+    number of blocks it's going to be read in.
+    """
+    audio_name = str(tmpdir.join('audio.wav'))
+    soundfile.write(audio_name, numpy.zeros((frames, 2)), 44100)
+    fft_blocks = audiotospectrogram.AudioBlocksFFT(
+        audio_name, 1024, overlap, minFreq=20, maxFreq=8000)
+    assert fft_blocks.totalBlocks() == len(list(
+        fft_blocks.audioData.blocks(blocksize=1024, overlap=overlap)))
+
+
+def reference_spectrogram(audio_name, image_name, fft_size):
+    """
+    The spectrogram drawn block by block and pixel by pixel, the way
+    audiotospectrogram did before it worked on whole arrays
+    """
+    height = audiotospectrogram.SPECTROGRAM_HEIGHT
+    spec_range = audiotospectrogram.SPECTROGRAM_DB_RANGE
+    audio = soundfile.SoundFile(audio_name, 'r')
+    window = numpy.hanning(fft_size)
+    sound_length = audio.frames / audio.samplerate
+    slice_width = (audio.samplerate // 2) / (fft_size // 2 + 1)
+    start = int(audiotospectrogram.SPECTROGRAM_MIN_FREQUENCY / slice_width)
+    end = int(audiotospectrogram.SPECTROGRAM_MAX_FREQUENCY / slice_width)
+
+    blocks = []
+    peak = 0
+    for file_block in audio.blocks(blocksize=fft_size):
+        block = file_block[:, 0]
+        for channel in range(1, audio.channels):
+            block = numpy.add(block, file_block[:, channel])
+        block = numpy.pad(block, (0, fft_size - len(block)), 'constant')
+        amplitude = numpy.abs(numpy.fft.rfft(block * window))
+        amplitude = numpy.pad(amplitude, (0, max(0, end + 1 - len(amplitude))),
+                              'constant')[:end + 1][start:]
+        peak = max(peak, amplitude.max())
+        if len(amplitude) < height:
+            amplitude = numpy.array([
+                amplitude[(idx * len(amplitude)) // height]
+                for idx in range(height)])
+        else:
+            amplitude = numpy.array([
+                part.max() for part in numpy.array_split(amplitude, height)])
+        blocks.append(amplitude)
+
+    for i in range(len(blocks)):
+        blocks[i] = ((20 * numpy.log10(blocks[i] / peak + 1e-60)).clip(
+            -spec_range, 0.0) + spec_range) / spec_range
+
+    width_per_second = audiotospectrogram.SPECTROGRAM_WIDTH_PERSECOND[-1][0]
+    for pixels, (low, high) in audiotospectrogram.SPECTROGRAM_WIDTH_PERSECOND:
+        if low < sound_length <= high:
+            width_per_second = pixels
+            break
+    width = int(width_per_second * sound_length)
+
+    columns = []
+    column = numpy.zeros(height)
+    x = 0
+    for idx in range(len(blocks)):
+        new_x = (idx * width) // len(blocks)
+        if new_x != x:
+            columns.append(column)
+            x = new_x
+            column = numpy.zeros(height)
+        column = numpy.maximum(column, blocks[idx])
+    columns.append(column)
+
+    colors = audiotospectrogram.SpectrogramColorMap(columns).colors
+    pixels = []
+    for y in range(height):
+        for x in range(len(columns)):
+            color_idx = int(len(colors) * columns[x][height - y - 1])
+            pixels.append(colors[min(max(color_idx, 0), len(colors) - 1)])
+    image = Image.new('RGB', (len(columns), height))
+    image.putdata(pixels)
+    image.save(image_name)
+
+
+@pytest.mark.parametrize('fft_size', [1024, 4096])
+def test_spectrogram_matches_reference(tmpdir, fft_size):
+    """
+    The vectorized spectrogram is the same image as the one drawn pixel by
+    pixel, only faster.
+    """
+    audio_name = str(tmpdir.join('audio.wav'))
+    rate = 44100
+    t = numpy.arange(25 * rate) / rate
+    left = 0.5 * numpy.sin(2 * numpy.pi * (200 + 500 * t) * t)
+    right = 0.3 * numpy.sin(2 * numpy.pi * 3000 * t)
+    soundfile.write(audio_name, numpy.stack([left, right], axis=1), rate)
+
+    timings = []
+    for draw, image_name in [
+            (reference_spectrogram, str(tmpdir.join('reference.png'))),
+            (audiotospectrogram.drawSpectrogram,
+             str(tmpdir.join('spectrogram.png')))]:
+        start = time.time()
+        draw(audio_name, image_name, fft_size)
+        timings.append(time.time() - start)
+    _log.info('Spectrogram took {:.2f}s, {:.2f}s pixel by pixel'.format(
+        timings[1], timings[0]))
+
+    with open(str(tmpdir.join('reference.png')), 'rb') as reference, \
+            open(str(tmpdir.join('spectrogram.png')), 'rb') as spectrogram:
+        assert spectrogram.read() == reference.read()
@@ -0,0 +1,144 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+from PIL import Image
+
+from mediagoblin.media_types.image.processing import (
+    IMAGING_ENGINES, PillowEngine, get_engine)
+
+_log = logging.getLogger(__name__)
+
+# Opens an image with an imaging engine and makes a medium and thumbnail of
+# it, printing how long that took
+BENCHMARK_SCRIPT = '''
+import sys, time
+from mediagoblin.media_types.image.processing import IMAGING_ENGINES
+
+engine = IMAGING_ENGINES[sys.argv[1]]()
+start = time.perf_counter()
+image, orig_size = engine.open(sys.argv[2], (640, 640), {})
+for size, name in (((640, 640), 'medium'), ((180, 180), 'thumb')):
+    engine.save(engine.resize(image, size, 'ANTIALIAS'),
+                sys.argv[2] + '.' + name + '.jpg', 90)
+print(time.perf_counter() - start)
+'''
+
+
+def available_engines():
+    engines = []
+    for name in sorted(IMAGING_ENGINES):
+        try:
+            IMAGING_ENGINES[name]()
+        except ImportError:
+            continue
+        engines.append(name)
+    return engines
+
+
+def make_large_image(filename, side):
+    """
+    Write a side x side pixel gradient image to filename
+    """
+    gradient = Image.linear_gradient('L').resize((side, side))
+    Image.merge('RGB', (
+        gradient,
+        gradient.transpose(Image.ROTATE_90),
+        gradient.transpose(Image.FLIP_TOP_BOTTOM))).save(filename)
+
+
+def run_benchmark(engine_name, filename):
+    """
+    Resize filename with the engine in a process of its own
+
+    Returns the wall time it took and the peak RSS of the process, in KiB.
+    """
+    process = subprocess.Popen(
+        [sys.executable, '-c', BENCHMARK_SCRIPT, engine_name, filename],
+        stdout=subprocess.PIPE)
+    output = process.stdout.read()
+    process.stdout.close()
+    pid, status, rusage = os.wait4(process.pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    return float(output), rusage.ru_maxrss
+
+
+@pytest.mark.parametrize('engine_name', available_engines())
+@pytest.mark.parametrize('extension', ['jpg', 'png'])
+def test_engine_resize(tmpdir, engine_name, extension):
+    filename = str(tmpdir.join('image.' + extension))
+    Image.new('RGB', (400, 200), (0, 128, 255)).save(filename)
+
+    engine = IMAGING_ENGINES[engine_name]()
+    assert engine.original_size(filename) == (400, 200)
+
+    image, orig_size = engine.open(filename, (100, 100), {})
+    assert orig_size == (400, 200)
+    assert engine.size(image) == (400, 200)
+
+    resized = engine.resize(image, (100, 100), 'ANTIALIAS')
+    assert engine.size(resized) == (100, 50)
+    # The opened image can be resized again
+    assert engine.size(engine.resize(image, (200, 200), 'ANTIALIAS')) == \
+        (200, 100)
+
+    resized_filename = str(tmpdir.join('resized.' + extension))
+    engine.save(resized, resized_filename, 90)
+    assert Image.open(resized_filename).size == (100, 50)
+
+    if engine.format_supported('webp'):
+        webp_filename = str(tmpdir.join('resized.webp'))
+        engine.save(resized, webp_filename, 90, 'webp')
+        assert Image.open(webp_filename).format == 'WEBP'
+
+
+def test_get_engine():
+    assert isinstance(get_engine('pillow'), PillowEngine)
+    # Unknown engines fall back to Pillow
+    assert isinstance(get_engine('imagemagick'), PillowEngine)
+    if 'vips' not in available_engines():
+        assert isinstance(get_engine('vips'), PillowEngine)
+
+
+@pytest.mark.parametrize('extension', ['jpg', 'png'])
+def test_engine_benchmark(tmpdir, extension):
+    """
+    Compare the peak memory use and wall time of the imaging engines making
+    a medium and thumbnail of a 100 megapixel image.
+    """
+    engines = available_engines()
+    if len(engines) < 2:
+        pytest.skip('Only the {} imaging engine is available'.format(
+            ', '.join(engines)))
+
+    filename = str(tmpdir.join('large.' + extension))
+    make_large_image(filename, 10000)
+
+    results = {}
+    for engine_name in engines:
+        results[engine_name] = run_benchmark(engine_name, filename)
+        _log.warning('{} engine, {}: {:.2f}s, peak RSS {} MiB'.format(
+            engine_name, extension, results[engine_name][0],
+            results[engine_name][1] // 1024))
+
+    # Pillow has the whole PNG in memory, 300 MB of it
+    if extension == 'png':
+        assert results['vips'][1] < results['pillow'][1]
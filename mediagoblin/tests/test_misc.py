@@ -17,15 +17,21 @@
 import pytz
 import datetime
 
+from sqlalchemy import event
 from werkzeug.datastructures import FileStorage
 
 from .resources import GOOD_JPG
 from mediagoblin.db.base import Session
+from mediagoblin.db.util import media_data_load_options
 from mediagoblin.media_types import sniff_media
 from mediagoblin.submit.lib import new_upload_entry
 from mediagoblin.submit.task import collect_garbage
-from mediagoblin.db.models import User, MediaEntry, TextComment, Comment
-from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
+from mediagoblin.db.models import User, MediaEntry, TextComment, Comment, \
+    Collection
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry, \
+    fixture_add_collection
+from mediagoblin.tools.feeds import FEED_CACHE_SIZE
+from mediagoblin.user_pages.lib import add_media_to_collection
 
 
 def test_404_for_non_existent(test_app):
@@ -169,3 +175,178 @@ def test_comments_removed_when_graveyarded(test_app):
     # Verify this also deleted the Comment link, ergo there is no comment left.
     assert Comment.query.filter_by(target_id=link.target_id).first() is None
  
+
+
+def _count_queries(test_app, url):
+    """ Counts the SQL statements issued while fetching url """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = Session.get_bind()
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        test_app.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    return len(statements)
+
+
+def test_gallery_query_count_independent_of_size(test_app):
+    """ Galleries and feeds shouldn't run extra queries per entry """
+    owner = fixture_add_user('gallery_owner', privileges=['active'])
+    owner_id = owner.id
+    collection = fixture_add_collection(user=owner)
+    collection_id = collection.id
+
+    urls = [
+        '/',
+        '/u/gallery_owner/',
+        '/u/gallery_owner/gallery/',
+        '/u/gallery_owner/collection/%s/' % collection.slug,
+        '/tag/shared/',
+        '/atom/',
+        '/tag/shared/atom/',
+        '/u/gallery_owner/atom/',
+        '/u/gallery_owner/collection/%s/atom/' % collection.slug,
+    ]
+
+    def add_entries(start, stop):
+        collection = Collection.query.get(collection_id)
+        for i in range(start, stop):
+            for uploader_id in (owner_id, fixture_add_user('uploader%s' % i).id):
+                entry = fixture_media_entry(
+                    title='entry %s' % i, uploader=uploader_id,
+                    state='processed', expunge=False)
+                entry.tags = [{'name': 'shared', 'slug': 'shared'},
+                              {'name': 'tag%s' % i, 'slug': 'tag%s' % i}]
+                entry.save()
+                add_media_to_collection(collection, entry)
+
+    add_entries(0, 2)
+    small = [_count_queries(test_app, url) for url in urls]
+
+    add_entries(2, 6)
+    large = [_count_queries(test_app, url) for url in urls]
+
+    assert dict(zip(urls, large)) == dict(zip(urls, small))
+
+
+def test_media_data_load_options(test_app):
+    """ The media_data of entries loaded with media_data_load_options()
+    takes no query per entry """
+    owner_id = fixture_add_user('panel_owner', privileges=['active']).id
+    for state in ('processing', 'failed', 'processed'):
+        entry = fixture_media_entry(
+            uploader=owner_id, state=state, expunge=False)
+        entry.media_data_init(width=100, height=100)
+        entry.save()
+    Session.expunge_all()
+
+    entries = MediaEntry.query.filter_by(actor=owner_id).options(
+        *media_data_load_options()).all()
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = Session.get_bind()
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        assert [entry.media_data.width for entry in entries] == [100] * 3
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    assert statements == []
+
+
+def test_feed_conditional_get(test_app):
+    """ Feeds answer 304 Not Modified while nothing has changed """
+    user = fixture_add_user('feed_owner', privileges=['active'])
+    fixture_media_entry(uploader=user.id, state='processed')
+
+    for url in ('/atom/', '/u/feed_owner/atom/'):
+        response = test_app.get(url)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+
+        response = test_app.get(url, headers={'If-None-Match': etag})
+        assert response.status_int == 304
+        assert not response.body
+
+        response = test_app.get(
+            url, headers={'If-Modified-Since': last_modified})
+        assert response.status_int == 304
+
+        response = test_app.get(url, headers={'If-None-Match': '"other"'})
+        assert response.status_int == 200
+
+    # A new entry changes the feed
+    response = test_app.get('/atom/')
+    etag = response.headers['ETag']
+    fixture_media_entry(uploader=user.id, state='processed')
+    response = test_app.get('/atom/', headers={'If-None-Match': etag})
+    assert response.status_int == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_collection_feed_sees_entry_edits(test_app):
+    """ Editing a collected entry changes the collection feed """
+    user = fixture_add_user('collection_feed_owner', privileges=['active'])
+    entry = fixture_media_entry(
+        title='old title', uploader=user.id, state='processed',
+        expunge=False)
+    entry_id = entry.id
+    collection = fixture_add_collection(user=user)
+    add_media_to_collection(collection, entry)
+    url = '/u/collection_feed_owner/collection/%s/atom/' % collection.slug
+
+    response = test_app.get(url)
+    etag = response.headers['ETag']
+    assert b'old title' in response.body
+
+    # As the edit view does it
+    entry = MediaEntry.query.get(entry_id)
+    entry.title = 'new title'
+    entry.updated = datetime.datetime.utcnow()
+    entry.save()
+
+    response = test_app.get(url, headers={'If-None-Match': etag})
+    assert response.status_int == 200
+    assert response.headers['ETag'] != etag
+    assert b'new title' in response.body
+
+
+def test_feed_cache(test_app):
+    """ Feeds are rendered once per change """
+    user = fixture_add_user('cached_feed_owner', privileges=['active'])
+    entry = fixture_media_entry(
+        title='first title', uploader=user.id, state='processed',
+        expunge=False)
+    entry_id = entry.id
+    collection = fixture_add_collection(user=user)
+    add_media_to_collection(collection, entry)
+    urls = ['/atom/', '/u/cached_feed_owner/atom/',
+            '/u/cached_feed_owner/collection/%s/atom/' % collection.slug]
+
+    uncached = [_count_queries(test_app, url) for url in urls]
+    cached = [_count_queries(test_app, url) for url in urls]
+    for url, before, after in zip(urls, uncached, cached):
+        assert after < before, url
+
+    # An edit changes the validators, so it's never served from the cache
+    entry = MediaEntry.query.get(entry_id)
+    entry.title = 'second title'
+    entry.updated = datetime.datetime.utcnow()
+    entry.save()
+    for url in urls:
+        assert b'second title' in test_app.get(url).body
+
+    # Query strings aren't cached, so they can't push the feeds out
+    for i in range(FEED_CACHE_SIZE):
+        test_app.get('/atom/?page=%d' % i)
+    for url, before, after in zip(
+            urls, uncached, [_count_queries(test_app, url) for url in urls]):
+        assert after < before, url
@@ -18,13 +18,19 @@
 # methods, and so it makes sense to test them here.
 
 
+from sqlalchemy import event
+
 from mediagoblin.db.base import Session
 from mediagoblin.db.models import MediaEntry, User, LocalUser, Privilege, \
                                   Activity, Generator
+from mediagoblin.gmg_commands.rendermarkdown import render_markdown_fields
 
+from mediagoblin.moderation.tools import give_privileges, \
+    take_away_privileges, ban_user, unban_user
 from mediagoblin.tests import MGClientTestCase
 from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry, \
                                     fixture_add_activity
+from mediagoblin.tools.text import MARKDOWN_RENDERER_VERSION
 
 try:
     from unittest import mock
@@ -197,6 +203,36 @@ class TestUserHasPrivilege:
         # Test that we can look this out ignoring that she's an admin
         assert not self.natalie_user.has_privilege('commenter', allow_admin=False)
 
+    def test_privileges_cached(self, test_app):
+        self._setup()
+
+        assert self.aeva_user.has_privilege('moderator')
+        assert not self.aeva_user.is_banned()
+
+        # Repeated checks don't go back to the database
+        queries = []
+        engine = Session.get_bind()
+        listener = lambda conn, cursor, statement, *args: queries.append(statement)
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            assert self.aeva_user.has_privilege('active')
+            assert not self.aeva_user.has_privilege('admin')
+            assert not self.aeva_user.is_banned()
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+        assert queries == []
+
+        # ... but do notice changes
+        take_away_privileges('aeva', 'moderator')
+        assert not self.aeva_user.has_privilege('moderator')
+        give_privileges('aeva', 'admin')
+        assert self.aeva_user.has_privilege('commenter')
+
+        ban_user(self.aeva_user.id, reason='Testing').save()
+        assert self.aeva_user.is_banned()
+        unban_user(self.aeva_user.id)
+        assert not self.aeva_user.is_banned()
+
 def test_media_data_init(test_app):
     Session.rollback()
     Session.remove()
@@ -212,6 +248,108 @@ def test_media_data_init(test_app):
     assert obj_in_session == 0
 
 
+def test_file_metadata(test_app):
+    media = fixture_media_entry(expunge=False)
+
+    media.set_files_metadata({
+        'thumb': {'width': 180, 'height': 120},
+        'medium': {'width': 640, 'height': 480}})
+    media.set_file_metadata('thumb', quality=90)
+
+    # Re-read from the database
+    Session.expire_all()
+    assert media.get_file_metadata('thumb') == {
+        'width': 180, 'height': 120, 'quality': 90}
+    assert media.get_file_metadata('medium', 'height') == 480
+    assert media.get_file_metadata('original') is None
+    assert media.get_file_metadata('nonexistent', 'width') is None
+
+    # Further lookups come from the loaded media files
+    queries = []
+    engine = Session.get_bind()
+    listener = lambda conn, cursor, statement, *args: queries.append(statement)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        assert media.get_file_metadata('medium', 'width') == 640
+        assert media.get_file_metadata('thumb', 'quality') == 90
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    assert queries == []
+
+
+def test_alternative_media(test_app):
+    media = fixture_media_entry(expunge=False)
+    media.media_files['thumb@webp'] = ['a', 'b', 'c.webp']
+    media.media_files['thumb@avif'] = ['a', 'b', 'c.avif']
+    media.media_files['medium@webp'] = ['d', 'e', 'f.webp']
+    media.save()
+    media.set_files_metadata({
+        'thumb': {'bytes': 9000},
+        'thumb@webp': {'bytes': 6000},
+        'thumb@avif': {'bytes': 4000},
+        'medium': {'bytes': 50000},
+        'medium@webp': {'bytes': 60000}})
+
+    # Smallest first, and only the ones smaller than the file itself
+    assert media.alternative_media('thumb') == [
+        ('image/avif', '/mgoblin_media/a/b/c.avif'),
+        ('image/webp', '/mgoblin_media/a/b/c.webp')]
+    assert media.alternative_media('medium') == []
+    assert media.alternative_media('original') == []
+
+
+def test_image_srcset(test_app):
+    media = fixture_media_entry(expunge=False)
+    assert media.image_srcset('medium') is None
+
+    media.media_files['srcset_320'] = ['d', 'e', 'f.320w.png']
+    media.media_files['srcset_1280'] = ['d', 'e', 'f.1280w.png']
+    media.media_files['srcset_320@webp'] = ['d', 'e', 'f.320w.webp']
+    media.media_files['medium@webp'] = ['d', 'e', 'f.webp']
+    media.save()
+    media.set_files_metadata({
+        'medium': {'dimensions': [640, 480]},
+        'medium@webp': {'dimensions': [640, 480]}})
+
+    assert media.image_srcset('medium') == (
+        '/mgoblin_media/d/e/f.320w.png 320w, '
+        '/mgoblin_media/d/e/f.png 640w, '
+        '/mgoblin_media/d/e/f.1280w.png 1280w')
+    assert media.image_srcset('medium', 'image/webp') == (
+        '/mgoblin_media/d/e/f.320w.webp 320w, '
+        '/mgoblin_media/d/e/f.webp 640w')
+    assert media.image_srcset('medium', 'image/avif') is None
+    # Without its dimensions there's no telling where the file goes
+    assert media.image_srcset('thumb') is None
+
+
+def test_rendered_markdown(test_app):
+    media = fixture_media_entry(expunge=False)
+    media.description = 'Some *emphasis*'
+    media.save()
+
+    # The HTML is made when the description is set
+    Session.expire_all()
+    assert media.rendered_description == '<p>Some <em>emphasis</em></p>'
+    assert media.markdown_version == MARKDOWN_RENDERER_VERSION
+    with mock.patch('mediagoblin.tools.text.cleaned_markdown_conversion') \
+            as conversion:
+        assert media.description_html == '<p>Some <em>emphasis</em></p>'
+    assert not conversion.called
+
+    # HTML from another renderer is ignored until it's rendered again
+    media.rendered_description = '<p>Outdated</p>'
+    media.markdown_version = MARKDOWN_RENDERER_VERSION - 1
+    media.save()
+    assert media.description_html == '<p>Some <em>emphasis</em></p>'
+
+    assert render_markdown_fields(MediaEntry, 'description') == 1
+    Session.expire_all()
+    assert media.rendered_description == '<p>Some <em>emphasis</em></p>'
+    assert media.markdown_version == MARKDOWN_RENDERER_VERSION
+    assert render_markdown_fields(MediaEntry, 'description') == 0
+
+
 class TestUserUrlForSelf(MGClientTestCase):
 
     usernames = [('lindsay', dict(privileges=['active']))]
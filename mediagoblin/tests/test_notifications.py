@@ -18,12 +18,17 @@ import pytest
 
 import urllib.parse as urlparse
 
+from sqlalchemy.orm.attributes import set_committed_value
+
 from mediagoblin.tools import template, mail
 
-from mediagoblin.db.models import Notification, CommentSubscription
+from mediagoblin.db.models import Notification, CommentSubscription, \
+    LocalUser, TextComment, Comment
 from mediagoblin.db.base import Session
 
-from mediagoblin.notifications import mark_comment_notification_seen
+from mediagoblin.notifications import mark_comment_notification_seen, \
+    mark_notification_seen, trigger_notification, get_notifications, \
+    get_notification_count
 
 from mediagoblin.tests.tools import fixture_add_comment, \
     fixture_media_entry, fixture_add_user, \
@@ -109,6 +114,7 @@ class TestNotifications:
         notification = notifications[0]
 
         assert notification.seen == False
+        assert LocalUser.query.get(user_id).unseen_notifications == 1
         assert notification.user_id == user.id
         assert notification.obj().comment().get_actor.id == self.test_user.id
         assert notification.obj().comment().content == 'Test comment #42'
@@ -152,6 +158,7 @@ otherperson@example.com\n\nSGkgb3RoZXJwZXJzb24sCmNocmlzIGNvbW1lbnRlZCBvbiB5b3VyI
         notification = Notification.query.filter_by(id=notification_id).first()
 
         assert notification.seen == True
+        assert LocalUser.query.get(user_id).unseen_notifications == 0
 
         self.test_app.get(media_uri_slug + 'notifications/silence/')
 
@@ -219,3 +226,48 @@ otherperson@example.com\n\nSGkgb3RoZXJwZXJzb24sCmNocmlzIGNvbW1lbnRlZCBvbiB5b3VyI
         # both notifications should be marked seen
         assert notifications[0].seen == True
         assert notifications[1].seen == True
+
+
+def test_unseen_notification_counter(test_app):
+    user = fixture_add_user('otherperson', privileges=['active'])
+    user_id = user.id
+    commenter = fixture_add_user(privileges=['active', 'commenter'])
+
+    media_entry = fixture_media_entry(uploader=user_id, state='processed',
+                                      expunge=False)
+    fixture_comment_subscription(media_entry, send_email=False)
+
+    comments = []
+    for i in range(3):
+        text_comment = TextComment(actor=commenter.id,
+                                   content='Test comment #%s' % i)
+        text_comment.save()
+        comment = Comment()
+        comment.target = media_entry
+        comment.comment = text_comment
+        comment.save()
+        trigger_notification(comment, media_entry, None)
+        comments.append(comment)
+
+    assert get_notification_count(user_id) == 3
+    assert len(get_notifications(user_id)) == 3
+
+    mark_notification_seen(get_notifications(user_id)[0])
+    assert get_notification_count(user_id) == 2
+    assert len(get_notifications(user_id)) == 2
+
+    # Seeing it twice doesn't count twice
+    notification = Notification.query.filter_by(seen=True).first()
+    mark_notification_seen(notification)
+    assert get_notification_count(user_id) == 2
+
+    # Not even when it was loaded before another request marked it seen
+    set_committed_value(notification, 'seen', False)
+    mark_notification_seen(notification)
+    assert get_notification_count(user_id) == 2
+    assert LocalUser.query.get(user_id).unseen_notifications == 2
+
+    # Removing a comment removes its notification
+    comments[-1].delete()
+    assert get_notification_count(user_id) == 1
+    assert get_notification_count(user_id, only_unseen=False) == 2
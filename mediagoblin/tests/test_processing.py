@@ -1,4 +1,12 @@
+import base64
+import io
+
+from PIL import Image
+
 from mediagoblin import processing
+from mediagoblin.db.models import LocalUser
+from mediagoblin.db.util import update_processing_counts
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
 
 class TestProcessing:
     def run_fill(self, input, format, output=None):
@@ -14,3 +22,45 @@ class TestProcessing:
     def test_long_filename_fill(self):
         self.run_fill('{}.png'.format('A' * 300), 'image-{basename}{ext}',
                       'image-{}.png'.format('A' * 245))
+
+
+def test_processing_counts(test_app):
+    user_id = fixture_add_user('processing_counts').id
+    entry = fixture_media_entry(uploader=user_id, state='processing',
+                                expunge=False)
+    failed = fixture_media_entry(uploader=user_id, state='failed',
+                                 expunge=False)
+    update_processing_counts(user_id)
+
+    user = LocalUser.query.get(user_id)
+    assert (user.num_processing, user.num_failed) == (1, 1)
+
+    processing.mark_entry_failed(
+        entry.id, processing.BaseProcessingFail())
+    user = LocalUser.query.get(user_id)
+    assert (user.num_processing, user.num_failed) == (0, 2)
+
+    failed.delete()
+    user = LocalUser.query.get(user_id)
+    assert (user.num_processing, user.num_failed) == (0, 1)
+
+
+def test_image_placeholder(tmpdir):
+    filename = str(tmpdir.join('thumb.jpg'))
+    Image.linear_gradient('L').convert('RGB').resize((180, 120)).save(
+        filename)
+    info = processing.image_placeholder(filename)
+    assert info['dimensions'] == [180, 120]
+
+    prefix = 'data:image/png;base64,'
+    assert info['placeholder'].startswith(prefix)
+    placeholder = Image.open(io.BytesIO(
+        base64.b64decode(info['placeholder'][len(prefix):])))
+    assert placeholder.size == (8, 5)
+
+    # Transparent images only get their dimensions
+    filename = str(tmpdir.join('thumb.png'))
+    Image.new('RGBA', (100, 50)).save(filename)
+    assert processing.image_placeholder(filename) == {'dimensions': [100, 50]}
+
+    assert processing.image_placeholder(str(tmpdir.join('missing.png'))) == {}
@@ -53,7 +53,8 @@ from mediagoblin.media_types.image import ImageMediaManager
 from mediagoblin.media_types.pdf.processing import check_prerequisites as pdf_check_prerequisites
 from mediagoblin.media_types.video.processing import (
     VideoProcessingManager, main_task, complementary_task, group,
-    processing_cleanup, CommonVideoProcessor)
+    processing_cleanup, CommonVideoProcessor, multi_resolution_task,
+    chunk_task)
 from mediagoblin.media_types.video.util import ACCEPTED_RESOLUTIONS
 from mediagoblin.submit.lib import new_upload_entry, run_process_media
 
@@ -463,6 +464,68 @@ class TestSubmissionBasics(BaseTestSubmission):
             assert last_size > size
             last_size = size
 
+    def test_alternative_formats(self):
+        image_config = mg_globals.global_config['plugins'][
+            'mediagoblin.media_types.image']
+        image_config['alternative_formats'] = ['webp']
+        try:
+            data = {'title': 'Big Blue'}
+            response, request = self.do_post(
+                data, *REQUEST_CONTEXT, do_follow=True,
+                **self.upload_data(BIG_BLUE))
+        finally:
+            image_config['alternative_formats'] = []
+        media = self.check_media(request, data, 1)
+
+        for keyname in ('medium', 'thumb'):
+            assert media.media_files[keyname + '@webp'][-1].endswith('.webp')
+            assert media.get_file_metadata(keyname, 'formats') == ['webp']
+            assert media.get_file_metadata(keyname + '@webp', 'bytes') > 0
+
+        # The media page offers the medium in both formats
+        response = self.test_app.get(media.url_for_self(request.urlgen))
+        assert b'<source type="image/webp"' in response.body
+
+    def test_srcset(self):
+        image_config = mg_globals.global_config['plugins'][
+            'mediagoblin.media_types.image']
+        image_config['srcset_widths'] = [200, 400, 1600]
+        try:
+            data = {'title': 'Big Blue'}
+            response, request = self.do_post(
+                data, *REQUEST_CONTEXT, do_follow=True,
+                **self.upload_data(BIG_BLUE))
+        finally:
+            image_config['srcset_widths'] = []
+        media = self.check_media(request, data, 1)
+
+        # bigblue.png is 800px wide, so it's not made any wider
+        assert 'srcset_1600' not in media.media_files
+        assert media.get_file_metadata('srcset_200', 'dimensions') == [200, 200]
+        assert media.get_file_metadata('srcset_400', 'dimensions') == [400, 400]
+
+        response = self.test_app.get(media.url_for_self(request.urlgen))
+        assert b'400w' in response.body
+
+    def test_thumbnail_placeholder(self):
+        data = {'title': 'Placeholder'}
+        response, request = self.do_post(
+            data, *REQUEST_CONTEXT, do_follow=True,
+            **self.upload_data(GOOD_JPG))
+        media = self.check_media(request, data, 1)
+
+        thumb_info = media.get_file_metadata('thumb')
+        assert thumb_info['placeholder'].startswith('data:image/png;base64,')
+        width, height = thumb_info['dimensions']
+        assert max(width, height) <= 180
+
+        # The gallery lays the thumbnail out at its size right away
+        response = self.test_app.get(
+            '/u/{}/gallery/'.format(self.our_user().username))
+        assert 'width="{}" height="{}"'.format(width, height).encode() \
+            in response.body
+        assert thumb_info['placeholder'].encode() in response.body
+
     def test_collection_selection(self):
         """Test the ability to choose a collection when submitting media
         """
@@ -677,6 +740,72 @@ class TestSubmissionVideo(BaseTestSubmission):
         assert wf[1] == cleanup_task
         entry.delete()
 
+    def test_single_decode_workflow(self):
+        entry = get_sample_entry(self.our_user(), self.media_type)
+        manager = VideoProcessingManager()
+        video_config = mg_globals.global_config['plugins'][entry.media_type]
+        with mock.patch.dict(video_config, single_decode=True):
+            wf = manager.workflow(entry, feed_url=None,
+                                  reprocess_action='initial')
+
+        def_res = video_config['default_resolution']
+        resolutions = [def_res] + [
+            res for res in video_config['available_resolutions']
+            if res != def_res]
+        reprocess_info = {
+            'vorbis_quality': None,
+            'vp8_threads': None,
+            'thumb_size': None,
+            'vp8_quality': None
+        }
+        transcoding_tasks = group([multi_resolution_task.signature(
+            args=(entry.id, resolutions), kwargs=reprocess_info,
+            queue='default', immutable=True)])
+        cleanup_task = processing_cleanup.signature(args=(entry.id,),
+                                                    queue='default', immutable=True)
+        assert wf[0] == transcoding_tasks
+        assert wf[1] == cleanup_task
+        entry.delete()
+
+    def test_chunked_workflow(self):
+        entry = get_sample_entry(self.our_user(), self.media_type)
+        manager = VideoProcessingManager()
+        video_config = mg_globals.global_config['plugins'][entry.media_type]
+        # Not uploaded, so there's nothing to split
+        with mock.patch.dict(video_config, chunk_duration=300):
+            assert manager.count_chunks(entry, video_config) == 1
+
+        with mock.patch.object(VideoProcessingManager, 'count_chunks',
+                               return_value=2):
+            wf = manager.workflow(entry, feed_url=None,
+                                  reprocess_action='initial')
+
+        def_res = video_config['default_resolution']
+        resolutions = [def_res] + [
+            res for res in video_config['available_resolutions']
+            if res != def_res]
+        reprocess_info = {
+            'vorbis_quality': None,
+            'vp8_threads': None,
+            'thumb_size': None,
+            'vp8_quality': None
+        }
+        priority_num = len(resolutions) + 1
+        tasks_list = []
+        for res in resolutions:
+            for chunk in range(2):
+                tasks_list.append(chunk_task.signature(
+                    args=(entry.id, res, ACCEPTED_RESOLUTIONS[res], chunk, 2),
+                    kwargs=reprocess_info, queue='default',
+                    priority=priority_num, immutable=True))
+            priority_num -= 1
+        cleanup_task = processing_cleanup.signature(
+            args=(entry.id,), kwargs=dict(reprocess_info, num_chunks=2),
+            queue='default', immutable=True)
+        assert wf[0] == group(tasks_list)
+        assert wf[1] == cleanup_task
+        entry.delete()
+
     @mock.patch('mediagoblin.submit.lib.ProcessMedia.apply_async')
     @mock.patch('mediagoblin.submit.lib.chord')
     def test_celery_chord(self, mock_chord, mock_process_media):
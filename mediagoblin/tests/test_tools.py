@@ -20,11 +20,19 @@ try:
 except ImportError:
     import unittest.mock as mock
 
+import datetime
+
+import pytest
 from werkzeug.wrappers import Request
 from werkzeug.test import EnvironBuilder
 
+from mediagoblin.db.models import MediaEntry, Comment
+from mediagoblin.tests.tools import (
+    fixture_add_user, fixture_media_entry, fixture_add_comment)
 from mediagoblin.tools.request import decode_request
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.pagination import (
+    Pagination, KeysetPagination, PaginationMarker,
+    encode_pagination_marker, decode_pagination_marker)
 
 class TestDecodeRequest:
     """Test the decode_request function."""
@@ -115,3 +123,89 @@ class TestPagination:
         paginator = self._create_paginator(num_items=31, page=1, per_page=30)
         assert paginator.total_count == 31
         assert paginator.pages == 2
+
+    @pytest.mark.parametrize('ascending', [True, False])
+    def test_jump_to_id(self, test_app, ascending):
+        """Check that counting finds the same page as walking the cursor."""
+        user = fixture_add_user()
+        media = fixture_media_entry(uploader=user.id, state='processed')
+        for i in range(7):
+            fixture_add_comment(author=user.id, media_entry=media)
+
+        comments = media.get_comments(ascending)
+        order_by = (Comment.added, Comment.id)
+        for position, comment in enumerate(comments):
+            counted = Pagination(1, comments, 3, comment.id,
+                                 order_by=order_by, descending=not ascending)
+            scanned = Pagination(1, comments, 3, comment.id)
+            assert counted.page == scanned.page == position // 3 + 1
+            assert counted.active_id == comment.id
+
+        missing = Pagination(2, comments, 3, 12345, order_by=order_by)
+        assert missing.page == 2
+        assert missing.active_id is None
+
+
+class TestKeysetPagination:
+    def test_marker_roundtrip(self):
+        """Check that markers survive encoding and decoding."""
+        values = [datetime.datetime(2020, 2, 29, 13, 37, 0, 42), 1234]
+        marker = encode_pagination_marker(values)
+        assert '=' not in marker
+        assert decode_pagination_marker(marker) == values
+
+    def test_invalid_markers(self):
+        """Check that malformed markers raise ValueError."""
+        for marker in ['not base64!', 'W10', encode_pagination_marker(
+                [{'dt': 'yesterday'}]), 'e30', '\xe9',
+                encode_pagination_marker([2 ** 64, 1])]:
+            with pytest.raises(ValueError):
+                decode_pagination_marker(marker)
+
+    def test_paginates_with_markers(self, test_app):
+        """Check that walking a gallery by markers visits every entry once."""
+        user = fixture_add_user()
+        created = datetime.datetime(2020, 1, 1)
+        for i in range(5):
+            entry = fixture_media_entry(
+                title='entry %d' % i, uploader=user.id, expunge=False)
+            # Two entries per timestamp to check the tie break on id
+            entry.created = created + datetime.timedelta(days=i // 2)
+            entry.save()
+
+        cursor = MediaEntry.query.filter_by(actor=user.id)
+        order_by = (MediaEntry.created, MediaEntry.id)
+        expected = [entry.id for entry in cursor.order_by(
+            MediaEntry.created.desc(), MediaEntry.id.desc())]
+
+        pages = []
+        marker = None
+        while True:
+            pagination = KeysetPagination(
+                1, cursor, order_by, per_page=2, marker=marker)
+            pages.append([entry.id for entry in pagination()])
+            assert pagination.has_prev == (marker is not None)
+            if not pagination.has_next:
+                break
+            marker = PaginationMarker('after', decode_pagination_marker(
+                encode_pagination_marker(
+                    pagination._row_key(pagination()[-1]))))
+
+        assert pages == [expected[0:2], expected[2:4], expected[4:5]]
+
+        # And back again from the last page
+        url = pagination.get_marker_url_explicit('/u/', {}, 'before')
+        marker = PaginationMarker('before', decode_pagination_marker(
+            url.split('before=')[1]))
+        pagination = KeysetPagination(
+            1, cursor, order_by, per_page=2, marker=marker)
+        assert [entry.id for entry in pagination()] == expected[2:4]
+        assert pagination.has_prev
+        assert pagination.has_next
+        assert pagination.total_count == 5
+
+        # Old style page links still work for the first hop
+        pagination = KeysetPagination(3, cursor, order_by, per_page=2)
+        assert [entry.id for entry in pagination()] == expected[4:5]
+        assert pagination.has_prev
+        assert not pagination.has_next
@@ -18,6 +18,9 @@ import tempfile
 import os
 from contextlib import contextmanager
 import imghdr
+import pkg_resources
+
+from PIL import Image
 
 #os.environ['GST_DEBUG'] = '4,python:4'
 import pytest
@@ -29,8 +32,13 @@ from gi.repository import Gst
 Gst.init(None)
 
 from mediagoblin.media_types.video.transcoders import (capture_thumb,
-        VideoTranscoder)
-from mediagoblin.media_types.video.util import ACCEPTED_RESOLUTIONS
+        capture_previews, VideoTranscoder, MultiVideoTranscoder, HLSTranscoder,
+        VideoChunkTranscoder, ChunkStitcher)
+from mediagoblin.media_types.video.util import ACCEPTED_RESOLUTIONS, \
+    hls_playlist_segments, hls_peak_bandwidth, write_hls_master_playlist, \
+    passthrough_resolution, video_bitrate, write_preview_vtt, \
+    skip_transcode, StoredDiscovery
+from mediagoblin.media_types.video.processing import metadata_to_dict
 from mediagoblin.media_types.tools import discover
 from mediagoblin.tests.tools import get_app
 
@@ -110,6 +118,28 @@ def test_thumbnails():
         assert imghdr.what(thumbnail_name) == format
 
 
+def test_previews(tmpdir):
+    thumb = str(tmpdir.join('thumb.png'))
+    sprite = str(tmpdir.join('sprite.png'))
+    with create_data() as (video_name, result_name):
+        duration, tile_size = capture_previews(
+            video_name, thumb, sprite, 3, 100, 40, 2)
+    assert tile_size == (40, 30)  # videotestsrc is 320x240
+    assert Image.open(thumb).size == (100, 75)
+    # Two rows of two columns, the last tile is left black
+    assert Image.open(sprite).size == (80, 60)
+
+    vtt = str(tmpdir.join('previews.vtt'))
+    write_preview_vtt(vtt, 'sprite.png', 3 * 10**9 + 3 * 10**6, 3, 2,
+                      tile_size)
+    with open(vtt) as f:
+        assert f.read() == (
+            'WEBVTT\n'
+            '\n00:00:00.000 --> 00:00:01.001\nsprite.png#xywh=0,0,40,30\n'
+            '\n00:00:01.001 --> 00:00:02.002\nsprite.png#xywh=40,0,40,30\n'
+            '\n00:00:02.002 --> 00:00:03.003\nsprite.png#xywh=0,30,40,30\n')
+
+
 def test_transcoder():
     # test without audio
     with create_data() as (video_name, result_name):
@@ -135,6 +165,149 @@ def test_transcoder():
         assert len(discover(result_name).get_video_streams()) == 1
         assert len(discover(result_name).get_audio_streams()) == 1
 
+def test_multi_transcoder():
+    progress = []
+    with create_data(make_audio=True) as (video_name, result_name), \
+            tempfile.NamedTemporaryFile() as other_result:
+        destinations = {'240p': result_name, '144p': other_result.name}
+        transcoder = MultiVideoTranscoder()
+        transcoder.transcode(
+                video_name, destinations,
+                '240p', 2,
+                vp8_threads=0,  # autodetect
+                vorbis_quality=0.3,
+                progress_callback=lambda *args: progress.append(args))
+        assert set(transcoder.dst_data) == {'240p', '144p'}
+        for path in destinations.values():
+            assert len(discover(path).get_video_streams()) == 1
+            assert len(discover(path).get_audio_streams()) == 1
+        # Both resolutions are reported, the default one with its percentage
+        assert sum(args[0] for args in progress) == 100
+        assert any(len(args) == 2 for args in progress)
+
+
+def test_chunk_transcoder(tmpdir):
+    progress = []
+    with create_data(make_audio=True) as (video_name, result_name):
+        duration = discover(video_name).get_duration()
+        chunks = [str(tmpdir.join('0.webm')), str(tmpdir.join('1.webm'))]
+        for i, chunk in enumerate(chunks):
+            transcoder = VideoChunkTranscoder()
+            transcoder.transcode(
+                    video_name, chunk,
+                    duration * i // 2, duration * (i + 1) // 2,
+                    (640, 640), 2,
+                    vp8_threads=0,  # autodetect
+                    progress_callback=progress.append)
+            assert len(transcoder.dst_data.get_video_streams()) == 1
+            # The audio is left to the stitcher
+            assert not transcoder.dst_data.get_audio_streams()
+        assert sum(progress) == 100
+
+        stitcher = ChunkStitcher()
+        stitcher.stitch(chunks, video_name, result_name, vorbis_quality=0.3)
+        assert len(stitcher.dst_data.get_video_streams()) == 1
+        assert len(stitcher.dst_data.get_audio_streams()) == 1
+        assert stitcher.dst_data.get_duration() > duration * 0.9
+
+
+def test_hls_playlists(tmpdir):
+    playlist = tmpdir.join('playlist.m3u8')
+    playlist.write('#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:6\n'
+                   '#EXTINF:6.000,\nsegment00000.ts\n'
+                   '#EXTINF:2.000,\nsegment00001.ts\n#EXT-X-ENDLIST\n')
+    tmpdir.join('segment00000.ts').write(b'x' * 6000, 'wb')
+    tmpdir.join('segment00001.ts').write(b'x' * 3000, 'wb')
+
+    assert hls_playlist_segments(str(playlist)) == [
+        (6.0, 'segment00000.ts'), (2.0, 'segment00001.ts')]
+    # The short segment has the highest bitrate
+    assert hls_peak_bandwidth(str(playlist)) == 12000
+
+    master = tmpdir.join('master.m3u8')
+    write_hls_master_playlist(str(master), [
+        ('480p/playlist.m3u8', 12000, (640, 480)),
+        ('144p/playlist.m3u8', 3000, (192, 144))])
+    assert master.read() == (
+        '#EXTM3U\n#EXT-X-VERSION:3\n'
+        '#EXT-X-STREAM-INF:BANDWIDTH=12000,RESOLUTION=640x480\n'
+        '480p/playlist.m3u8\n'
+        '#EXT-X-STREAM-INF:BANDWIDTH=3000,RESOLUTION=192x144\n'
+        '144p/playlist.m3u8\n')
+
+
+def test_hls_transcoder(tmpdir):
+    with create_data(make_audio=True) as (video_name, result_name):
+        destinations = {res: str(tmpdir.mkdir(res))
+                        for res in ('144p', '360p')}
+        transcoder = HLSTranscoder()
+        transcoder.transcode(video_name, destinations, target_duration=1)
+        for res, dst_dir in destinations.items():
+            segments = hls_playlist_segments(transcoder.playlist_paths[res])
+            assert segments
+            for duration, filename in segments:
+                assert tmpdir.join(res, filename).check()
+
+
+def test_passthrough_resolution(request):
+    get_app(request, mgoblin_config=pkg_resources.resource_filename(
+        'mediagoblin.tests', 'test_mgoblin_app_video.ini'))
+    with create_data(make_audio=True) as (video_name, result_name):
+        # Theora isn't published as it is
+        assert passthrough_resolution(
+            discover(video_name), ['240p', '360p']) is None
+
+        transcoder = VideoTranscoder()
+        transcoder.transcode(
+                video_name, result_name,
+                '480p', 1,
+                vp8_quality=8,
+                vp8_threads=0,  # autodetect
+                vorbis_quality=0.3,
+                dimensions=(640, 640))
+        metadata = discover(result_name)
+        assert video_bitrate(metadata) > 0
+        # The 320x240 WebM is the 240p rendition, it's too big for 144p
+        assert passthrough_resolution(
+            metadata, ['144p', '240p', '360p']) == '240p'
+        assert passthrough_resolution(metadata, ['720p', '360p']) == '360p'
+        assert passthrough_resolution(metadata, ['144p']) is None
+
+
+def test_stored_discovery(request):
+    get_app(request, mgoblin_config=pkg_resources.resource_filename(
+        'mediagoblin.tests', 'test_mgoblin_app_video.ini'))
+    with create_data(make_audio=True) as (video_name, result_name):
+        transcoder = VideoTranscoder()
+        transcoder.transcode(
+                video_name, result_name,
+                '480p', 1,
+                vp8_quality=8,
+                vp8_threads=0,  # autodetect
+                vorbis_quality=0.3,
+                dimensions=(640, 640))
+        for path in video_name, result_name:
+            discovered = discover(path)
+            orig_metadata = metadata_to_dict(discovered)
+            assert StoredDiscovery.can_use(orig_metadata)
+            stored = StoredDiscovery(orig_metadata, path)
+
+            assert stored.get_duration() == discovered.get_duration()
+            assert len(stored.get_audio_streams()) == 1
+            video_info = stored.get_video_streams()[0]
+            assert (video_info.get_width(), video_info.get_height()) == \
+                (320, 240)
+            assert video_bitrate(stored) == video_bitrate(discovered)
+            for size in (256, 144), (480, 360):
+                assert skip_transcode(stored, size) == \
+                    skip_transcode(discovered, size)
+        # The transcoded video can be published as it is
+        assert skip_transcode(stored, (480, 360))
+
+    assert not StoredDiscovery.can_use(None)
+    assert not StoredDiscovery.can_use({'common': {'duration': 1}})
+
+
 def test_accepted_resolutions():
     accepted_resolutions = {
         '144p': (256, 144),
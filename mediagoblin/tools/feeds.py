@@ -36,3 +36,46 @@ class AtomFeedWithLinks(feedgenerator.Atom1Feed):
         super().add_root_elements(handler)
         for link in self.links:
             handler.addQuickElement('link', '', link)
+
+
+# How many rendered feeds get_cached_feed() keeps around
+FEED_CACHE_SIZE = 200
+
+# (url, etag) -> rendered feed, oldest first
+_feed_cache = {}
+
+
+def _feed_cache_key(request, etag):
+    # The feeds don't take any arguments, and query strings would let
+    # anyone push every other feed out of the cache
+    if request.query_string:
+        return None
+    return (request.base_url, etag)
+
+
+def get_cached_feed(request, etag):
+    """
+    Get the rendered feed stored by cache_feed(), or None
+
+    The cache is kept in each process.  The etag (see
+    mediagoblin.tools.response.make_etag) is part of the key, so a feed
+    whose entries changed is never served from it, wherever the change
+    was made.
+    """
+    key = _feed_cache_key(request, etag)
+    if key is None:
+        return None
+    return _feed_cache.get(key)
+
+
+def cache_feed(request, etag, data):
+    """
+    Store the rendered feed data for get_cached_feed()
+    """
+    key = _feed_cache_key(request, etag)
+    if key is None:
+        return
+
+    while len(_feed_cache) >= FEED_CACHE_SIZE:
+        del _feed_cache[next(iter(_feed_cache))]
+    _feed_cache[key] = data
@@ -32,6 +32,15 @@ def delete_media_files(media):
         except OSError:
             no_such_files.append("/".join(listpath))
 
+    # Files belonging to a media file, like the segments of a streaming
+    # playlist
+    for media_file in media.media_files_helper.values():
+        for listpath in (media_file.file_metadata or {}).get('segments', []):
+            try:
+                mg_globals.public_store.delete_file(listpath)
+            except OSError:
+                no_such_files.append("/".join(listpath))
+
     for attachment in media.attachment_files:
         try:
             mg_globals.public_store.delete_file(
@@ -14,15 +14,39 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
 import copy
+import datetime
+import json
+import time
+from collections import namedtuple
 from math import ceil, floor
 from itertools import count
+from sqlalchemy import and_, or_
 from werkzeug.datastructures import MultiDict
 
 import urllib
 
 PAGINATION_DEFAULT_PER_PAGE = 30
 
+# The GET parameters holding the markers used by KeysetPagination
+KEYSET_DIRECTIONS = ('before', 'after')
+
+# How long (in seconds) a total count may be reused by cached_count(),
+# and how many of them are kept around
+PAGINATION_COUNT_CACHE_TIME = 60
+PAGINATION_COUNT_CACHE_SIZE = 1000
+
+_MARKER_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# The range of integers in markers, that of a 64 bit column
+MARKER_INT_MIN = -2 ** 63
+MARKER_INT_MAX = 2 ** 63 - 1
+
+PaginationMarker = namedtuple('PaginationMarker', ['direction', 'values'])
+
+_count_cache = {}
+
 
 class Pagination:
     """
@@ -31,9 +55,10 @@ class Pagination:
     Initialization through __init__(self, cursor, page=1, per_page=2),
     get actual data slice through __call__().
     """
+    keyset = False
 
     def __init__(self, page, cursor, per_page=PAGINATION_DEFAULT_PER_PAGE,
-                 jump_to_id=False):
+                 jump_to_id=False, order_by=None, descending=False):
         """
         Initializes Pagination
 
@@ -43,22 +68,53 @@ class Pagination:
          - cursor: db cursor
          - jump_to_id: object id, sets the page to the page containing the
            object with id == jump_to_id.
+         - order_by: the columns the cursor is sorted on, ending with the
+           id column, e.g. (Comment.added, Comment.id).  Lets jump_to_id
+           find its page with a COUNT instead of walking the cursor.
+         - descending: whether the cursor is sorted highest first
         """
         self.page = page
         self.per_page = per_page
         self.cursor = cursor
         self.total_count = self.cursor.count()
         self.active_id = None
+        # Without order_by the cursor is taken to be sorted newest first,
+        # which is what the pagination links say
+        self.descending = descending if order_by is not None else True
 
         if jump_to_id:
-            cursor = copy.copy(self.cursor)
+            if order_by is None:
+                position = self._scan_position(jump_to_id)
+            else:
+                position = self._count_position(
+                    jump_to_id, tuple(order_by), descending)
+
+            if position is not None:
+                self.page = 1 + int(floor(position / self.per_page))
+                self.active_id = jump_to_id
 
-            for (doc, increment) in list(zip(cursor, count(0))):
-                if doc.id == jump_to_id:
-                    self.page = 1 + int(floor(increment / self.per_page))
+    def _scan_position(self, obj_id):
+        """
+        Find the position of obj_id by walking the whole cursor
+        """
+        cursor = copy.copy(self.cursor)
 
-                    self.active_id = jump_to_id
-                    break
+        for (doc, increment) in list(zip(cursor, count(0))):
+            if doc.id == obj_id:
+                return increment
+
+    def _count_position(self, obj_id, order_by, descending):
+        """
+        Find the position of obj_id by counting the rows sorted before it
+        """
+        key = self.cursor.with_entities(*order_by).filter(
+            order_by[-1] == obj_id).first()
+        if key is None:
+            return None
+
+        # Rows before this one are the ones after it in reverse order
+        return self.cursor.order_by(None).filter(
+            keyset_filter(order_by, list(key), not descending)).count()
 
     def __call__(self):
         """
@@ -116,3 +172,265 @@ class Pagination:
         """
         return self.get_page_url_explicit(
             request.full_path, request.GET, page_no)
+
+
+class KeysetPagination(Pagination):
+    """
+    Keyset ("seek") pagination for database queries.
+
+    Rather than slicing with OFFSET, every page is fetched by seeking
+    past the sort key of the last (or first) row of the page before, so
+    page N costs the same as page 1. Pages are linked with opaque
+    'before'/'after' markers instead of page numbers, and no COUNT is
+    run unless total_count is asked for.
+    """
+    keyset = True
+
+    def __init__(self, page, cursor, order_by,
+                 per_page=PAGINATION_DEFAULT_PER_PAGE, marker=None,
+                 descending=True):
+        """
+        Initializes KeysetPagination
+
+        Args:
+         - page: requested page, only used if there is no marker so old
+           ?page= links keep working
+         - cursor: db cursor, its ordering is replaced by order_by
+         - order_by: columns to sort on, the last one has to be unique,
+           e.g. (MediaEntry.created, MediaEntry.id)
+         - per_page: number of objects per page
+         - marker: PaginationMarker (see uses_pagination) or None
+         - descending: whether to show the highest keys first
+        """
+        self.page = page
+        self.per_page = per_page
+        self.cursor = cursor
+        self.order_by = tuple(order_by)
+        self.descending = descending
+        self.active_id = None
+
+        if marker is not None and not self._marker_fits(marker):
+            marker = None
+        self.marker = marker
+
+        self._items = None
+        self._has_prev = False
+        self._has_next = False
+
+    def __call__(self):
+        """
+        Returns a list of the objects on the requested page
+        """
+        if self._items is None:
+            self._items = self._fetch()
+        return self._items
+
+    def _marker_fits(self, marker):
+        """
+        Check a (user supplied) marker matches our sort columns
+        """
+        if len(marker.values) != len(self.order_by):
+            return False
+
+        for column, value in zip(self.order_by, marker.values):
+            try:
+                python_type = column.type.python_type
+            except NotImplementedError:
+                continue
+            if not isinstance(value, python_type):
+                return False
+
+        return True
+
+    def _fetch(self):
+        # Going backwards we fetch in reverse so the rows closest to the
+        # marker come first, and flip them back afterwards.
+        reverse = self.marker is not None and \
+            self.marker.direction == 'before'
+
+        query = self.cursor.order_by(None).order_by(
+            *self._order_clauses(reverse))
+        if self.marker is not None:
+            query = query.filter(self._seek_clause(self.marker, reverse))
+        elif self.page > 1:
+            query = query.offset((self.page - 1) * self.per_page)
+
+        # One extra row tells us whether there is another page
+        items = query.limit(self.per_page + 1).all()
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+
+        if reverse:
+            items.reverse()
+            self._has_prev = has_more
+            self._has_next = True
+        else:
+            self._has_prev = self.marker is not None or self.page > 1
+            self._has_next = has_more
+
+        # No rows, nothing to build markers from
+        if not items:
+            self._has_prev = self._has_next = False
+
+        return items
+
+    def _order_clauses(self, reverse):
+        descending = self.descending != reverse
+        return [column.desc() if descending else column.asc()
+                for column in self.order_by]
+
+    def _seek_clause(self, marker, reverse):
+        return keyset_filter(
+            self.order_by, marker.values, self.descending != reverse)
+
+    def _row_key(self, row):
+        return [getattr(row, column.key) for column in self.order_by]
+
+    @property
+    def total_count(self):
+        return cached_count(self.cursor)
+
+    @property
+    def has_prev(self):
+        self()
+        return self._has_prev
+
+    @property
+    def has_next(self):
+        self()
+        return self._has_next
+
+    def get_marker_url_explicit(self, base_url, get_params, direction):
+        """
+        Get the url of the page 'before' or 'after' this one
+        """
+        items = self()
+        if direction == 'before':
+            row = items[0]
+        else:
+            row = items[-1]
+
+        if isinstance(get_params, MultiDict):
+            new_get_params = get_params.to_dict()
+        else:
+            new_get_params = dict(get_params) or {}
+
+        for key in ('page',) + KEYSET_DIRECTIONS:
+            new_get_params.pop(key, None)
+
+        new_get_params[direction] = encode_pagination_marker(
+            self._row_key(row))
+        return "{}?{}".format(
+            base_url, urllib.parse.urlencode(new_get_params))
+
+    def get_marker_url(self, request, direction):
+        """
+        Get the url of the page 'before' or 'after' this one, based of the
+        request.
+
+        This is a nice wrapper around get_marker_url_explicit()
+        """
+        return self.get_marker_url_explicit(
+            request.full_path, request.GET, direction)
+
+
+def keyset_filter(order_by, values, descending):
+    """
+    Filter for the rows coming after the key values when sorting on the
+    order_by columns: (a, b) < (x, y) becomes a < x OR (a = x AND b < y)
+    """
+    clauses = []
+    for i, column in enumerate(order_by):
+        equal = [c == v for c, v in zip(order_by[:i], values[:i])]
+        if descending:
+            equal.append(column < values[i])
+        else:
+            equal.append(column > values[i])
+        clauses.append(and_(*equal))
+    return or_(*clauses)
+
+
+def encode_pagination_marker(values):
+    """
+    Encode the sort key of a row as an opaque, url-safe marker
+    """
+    serialized = []
+    for value in values:
+        if isinstance(value, datetime.datetime):
+            value = {'dt': value.strftime(_MARKER_DATETIME_FORMAT)}
+        serialized.append(value)
+
+    data = json.dumps(serialized, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_pagination_marker(marker):
+    """
+    Decode a marker made by encode_pagination_marker()
+
+    Raises ValueError if the marker is malformed.
+    """
+    try:
+        data = base64.urlsafe_b64decode(marker + '=' * (-len(marker) % 4))
+        serialized = json.loads(data.decode('utf-8'))
+    except TypeError:
+        raise ValueError('Invalid pagination marker %r' % marker)
+
+    if not isinstance(serialized, list) or not serialized:
+        raise ValueError('Invalid pagination marker %r' % marker)
+
+    values = []
+    for value in serialized:
+        if isinstance(value, dict):
+            try:
+                value = datetime.datetime.strptime(
+                    value['dt'], _MARKER_DATETIME_FORMAT)
+            except (KeyError, TypeError):
+                raise ValueError('Invalid pagination marker %r' % marker)
+        elif not isinstance(value, (int, str)):
+            raise ValueError('Invalid pagination marker %r' % marker)
+        elif isinstance(value, int) and \
+                not MARKER_INT_MIN <= value <= MARKER_INT_MAX:
+            # The database can't compare with it
+            raise ValueError('Invalid pagination marker %r' % marker)
+        values.append(value)
+
+    return values
+
+
+def get_pagination_marker(get_params):
+    """
+    Get the PaginationMarker from the 'before'/'after' GET parameters
+
+    Returns None if there isn't one, raises ValueError if it's malformed.
+    """
+    for direction in KEYSET_DIRECTIONS:
+        marker = get_params.get(direction)
+        if marker:
+            return PaginationMarker(
+                direction, decode_pagination_marker(marker))
+
+    return None
+
+
+def cached_count(cursor, cache_time=PAGINATION_COUNT_CACHE_TIME):
+    """
+    Like cursor.count(), but remembers the result for cache_time seconds
+
+    The count may be slightly off, but it saves a full COUNT over big
+    tables on every page view.
+    """
+    statement = cursor.statement.compile()
+    key = (str(statement), repr(sorted(statement.params.items())))
+
+    now = time.time()
+    cached = _count_cache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    if len(_count_cache) >= PAGINATION_COUNT_CACHE_SIZE:
+        _count_cache.clear()
+
+    total_count = cursor.count()
+    _count_cache[key] = (now + cache_time, total_count)
+    return total_count
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import json
 
 import werkzeug.utils
@@ -22,7 +23,7 @@ from mediagoblin.tools.template import render_template
 from mediagoblin.tools.translate import (lazy_pass_to_ugettext as _,
                                          pass_to_ugettext)
 from mediagoblin.db.models import UserBan, User
-from datetime import date
+from datetime import date, timezone
 
 class Response(wz_Response):
     """Set default response mimetype to HTML, otherwise we get text/plain"""
@@ -184,3 +185,54 @@ def form_response(data, *args, **kwargs):
             )
 
     return response
+
+
+def make_etag(*values):
+    """
+    Make an entity tag out of values (e.g. a row count and timestamps) that
+    change whenever the response would.
+    """
+    return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()
+
+
+def not_modified_response(request, etag, last_modified=None):
+    """
+    Answer a conditional GET before doing the expensive work
+
+    Returns a 304 Not Modified response if the client's copy is still
+    current according to its If-None-Match or If-Modified-Since header,
+    otherwise None so the caller can build the full response (and pass it
+    through add_validators()).
+
+    :param etag: see make_etag()
+    :param last_modified: naive UTC datetime of the newest change, if known
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified is not None:
+        if_modified_since = request.if_modified_since
+        if if_modified_since.tzinfo is not None:
+            if_modified_since = if_modified_since.astimezone(
+                timezone.utc).replace(tzinfo=None)
+        # HTTP dates have no microseconds
+        fresh = last_modified.replace(microsecond=0) <= if_modified_since
+    else:
+        fresh = False
+
+    if not fresh:
+        return None
+
+    return add_validators(wz_Response(status=304), etag, last_modified)
+
+
+def add_validators(response, etag, last_modified=None):
+    """
+    Set the ETag and Last-Modified headers checked by not_modified_response()
+    """
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
@@ -111,6 +111,12 @@ def tag_length_validator(form, field):
 # it anyway
 UNSAFE_MARKDOWN_INSTANCE = markdown.Markdown()
 
+# Stored along with the HTML kept by render_markdown_field().  Bump this
+# whenever a change to the Markdown or cleaner setup changes the output of
+# cleaned_markdown_conversion(), so the stored HTML is redone (and run
+# "gmg rendermarkdown" to redo it for all of the database at once).
+MARKDOWN_RENDERER_VERSION = 1
+
 
 def cleaned_markdown_conversion(text):
     """
@@ -122,3 +128,30 @@ def cleaned_markdown_conversion(text):
         return ''
 
     return clean_html(UNSAFE_MARKDOWN_INSTANCE.convert(text))
+
+
+def render_markdown_field(obj, field, text):
+    """
+    Store the cleaned_markdown_conversion() of text, the (new) value of
+    obj.<field>
+
+    The HTML goes to obj.rendered_<field>, stamped with the current
+    MARKDOWN_RENDERER_VERSION.
+    """
+    setattr(obj, 'rendered_' + field, cleaned_markdown_conversion(text))
+    obj.markdown_version = MARKDOWN_RENDERER_VERSION
+
+
+def rendered_markdown(obj, field):
+    """
+    Get the HTML stored by render_markdown_field() for obj.<field>
+
+    Falls back to converting the text if there is no HTML stored yet or it
+    was made by another version of the renderer.
+    """
+    if obj.markdown_version == MARKDOWN_RENDERER_VERSION:
+        rendered = getattr(obj, 'rendered_' + field)
+        if rendered is not None:
+            return rendered
+
+    return cleaned_markdown_conversion(getattr(obj, field))
@@ -18,17 +18,26 @@ import logging
 import datetime
 import json
 
+from sqlalchemy import and_
+
 from mediagoblin import messages, mg_globals
 from mediagoblin.db.models import (MediaEntry, MediaTag, Collection,
-                                   CollectionItem, LocalUser, Activity)
+                                   CollectionItem, LocalUser, Activity,
+                                   Comment, GenericModelReference)
+from mediagoblin.db.util import (gallery_load_options,
+                                 media_data_load_options,
+                                 collection_item_load_options,
+                                 load_collection_item_objects,
+                                 query_validators)
 from mediagoblin.plugins.api.tools import get_media_file_paths
 from mediagoblin.tools.response import render_to_response, render_404, \
-    redirect, redirect_obj
+    redirect, redirect_obj, make_etag, not_modified_response, add_validators
 from mediagoblin.tools.text import cleaned_markdown_conversion
 from mediagoblin.tools.translate import pass_to_ugettext as _
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.pagination import Pagination, KeysetPagination
 from mediagoblin.tools.federation import create_activity
-from mediagoblin.tools.feeds import AtomFeedWithLinks
+from mediagoblin.tools.feeds import AtomFeedWithLinks, get_cached_feed, \
+    cache_feed
 from mediagoblin.user_pages import forms as user_forms
 from mediagoblin.user_pages.lib import (
     add_media_to_collection, build_report_object)
@@ -63,10 +72,12 @@ def user_home(request, page):
             'mediagoblin/user_pages/user_nonactive.html',
             {'user': user})
 
-    cursor = MediaEntry.query.\
-        filter_by(actor=user.id).order_by(MediaEntry.created.desc())
+    cursor = MediaEntry.query.filter_by(actor=user.id) \
+        .options(*gallery_load_options())
 
-    pagination = Pagination(page, cursor)
+    pagination = KeysetPagination(
+        page, cursor, (MediaEntry.created, MediaEntry.id),
+        marker=request.pagination_marker)
     media_entries = pagination()
 
     # if no data is available, return NotFound
@@ -93,7 +104,7 @@ def user_gallery(request, page, url_user=None):
     tag = request.matchdict.get('tag', None)
     cursor = MediaEntry.query.filter_by(
         actor=url_user.id,
-        state='processed').order_by(MediaEntry.created.desc())
+        state='processed').options(*gallery_load_options())
 
     # Filter potentially by tag too:
     if tag:
@@ -102,7 +113,9 @@ def user_gallery(request, page, url_user=None):
                 MediaTag.slug == request.matchdict['tag']))
 
     # Paginate gallery
-    pagination = Pagination(page, cursor)
+    pagination = KeysetPagination(
+        page, cursor, (MediaEntry.created, MediaEntry.id),
+        marker=request.pagination_marker)
     media_entries = pagination()
 
     #if no data is available, return NotFound
@@ -128,20 +141,24 @@ def media_home(request, media, page, **kwargs):
     'Homepage' of a MediaEntry()
     """
     comment_id = request.matchdict.get('comment', None)
+    comments_ascending = mg_globals.app_config['comments_ascending']
     if comment_id:
         if request.user:
             mark_comment_notification_seen(comment_id, request.user)
 
         pagination = Pagination(
-            page, media.get_comments(
-                mg_globals.app_config['comments_ascending']),
+            page, media.get_comments(comments_ascending),
             MEDIA_COMMENTS_PER_PAGE,
-            comment_id)
+            comment_id,
+            order_by=(Comment.added, Comment.id),
+            descending=not comments_ascending)
     else:
-        pagination = Pagination(
-            page, media.get_comments(
-                mg_globals.app_config['comments_ascending']),
-            MEDIA_COMMENTS_PER_PAGE)
+        pagination = KeysetPagination(
+            page, media.get_comments(comments_ascending),
+            (Comment.added, Comment.id),
+            MEDIA_COMMENTS_PER_PAGE,
+            marker=request.pagination_marker,
+            descending=not comments_ascending)
 
     comments = pagination()
 
@@ -398,10 +415,12 @@ def user_collection(request, page, url_user=None):
     if not collection:
         return render_404(request)
 
-    cursor = collection.get_collection_items()
+    cursor = collection.get_collection_items() \
+        .options(*collection_item_load_options())
 
     pagination = Pagination(page, cursor)
-    collection_items = pagination()
+    collection_items = pagination().all()
+    load_collection_item_objects(collection_items)
 
     # if no data is available, return NotFound
     # TODO: Should an empty collection really also return 404?
@@ -547,8 +566,22 @@ def atom_feed(request):
     link = request.urlgen('mediagoblin.user_pages.user_home',
                           qualified=True, user=request.matchdict['user'])
     cursor = MediaEntry.query.filter_by(actor=user.id, state='processed')
+
+    validators, last_modified = query_validators(
+        cursor, MediaEntry.created, MediaEntry.updated)
+    etag = make_etag(validators)
+    not_modified = not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    feed_data = get_cached_feed(request, etag)
+    if feed_data is not None:
+        response = Response(feed_data, mimetype='application/atom+xml')
+        return add_validators(response, etag, last_modified)
+
     cursor = cursor.order_by(MediaEntry.created.desc())
     cursor = cursor.limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
+    cursor = cursor.options(*gallery_load_options())
 
     """
     ATOM feed id is a tag URI (see http://en.wikipedia.org/wiki/Tag_URI)
@@ -596,11 +629,11 @@ def atom_feed(request):
             updateddate=entry.get('created'),
         )
 
-    response = Response(
-        feed.writeString(encoding='utf-8'),
-        mimetype='application/atom+xml'
-    )
-    return response
+    feed_data = feed.writeString(encoding='utf-8')
+    cache_feed(request, etag, feed_data)
+
+    response = Response(feed_data, mimetype='application/atom+xml')
+    return add_validators(response, etag, last_modified)
 
 
 def collection_atom_feed(request):
@@ -618,10 +651,34 @@ def collection_atom_feed(request):
     if not collection:
         return render_404(request)
 
-    cursor = CollectionItem.query.filter_by(
-                 collection=collection.id) \
-                 .order_by(CollectionItem.added.desc()) \
-                 .limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
+    cursor = CollectionItem.query.filter_by(collection=collection.id)
+
+    # The feed shows the title of the collected entries, so editing one of
+    # them has to change the validators too
+    media_cursor = cursor \
+        .outerjoin(GenericModelReference,
+                   CollectionItem.object_id == GenericModelReference.id) \
+        .outerjoin(MediaEntry, and_(
+            GenericModelReference.model_type == MediaEntry.__tablename__,
+            GenericModelReference.obj_pk == MediaEntry.id))
+    validators, last_modified = query_validators(
+        media_cursor, CollectionItem.added, MediaEntry.created,
+        MediaEntry.updated)
+    etag = make_etag(validators, collection.updated)
+    not_modified = not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    feed_data = get_cached_feed(request, etag)
+    if feed_data is not None:
+        response = Response(feed_data, mimetype='application/atom+xml')
+        return add_validators(response, etag, last_modified)
+
+    cursor = cursor.order_by(CollectionItem.added.desc()) \
+                   .limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS) \
+                   .options(*collection_item_load_options()) \
+                   .all()
+    load_collection_item_objects(cursor)
 
     """
     ATOM feed id is a tag URI (see http://en.wikipedia.org/wiki/Tag_URI)
@@ -641,6 +698,8 @@ def collection_atom_feed(request):
     feed = AtomFeedWithLinks(
                 "MediaGoblin: Feed for %s's collection %s" %
                 (request.matchdict['user'], collection.title),
+                link=collection.url_for_self(request.urlgen, qualified=True),
+                description='',
                 feed_url=request.url,
                 id='tag:{host},{year}:gnu-mediagoblin.{user}.collection.{slug}'\
                     .format(
@@ -652,25 +711,22 @@ def collection_atom_feed(request):
 
     for item in cursor:
         obj = item.get_object()
-        feed.add(
-            obj.get('title'),
-            item.note_html,
-            id=obj.url_for_self(request.urlgen, qualified=True),
-            content_type='html',
-            author={
-                'name': obj.get_actor.username,
-                'uri': request.urlgen(
-                    'mediagoblin.user_pages.user_home',
-                    qualified=True, user=obj.get_actor.username)},
-            updated=item.get('added'),
-            links=[{
-                'href': obj.url_for_self(
-                    request.urlgen,
-                    qualified=True),
-                'rel': 'alternate',
-                'type': 'text/html'}])
+        feed.add_item(
+            title=obj.get('title') or _('Untitled'),
+            link=obj.url_for_self(request.urlgen, qualified=True),
+            description=item.note_html,
+            unique_id=obj.url_for_self(request.urlgen, qualified=True),
+            author_name=obj.get_actor.username,
+            author_link=request.urlgen(
+                'mediagoblin.user_pages.user_home',
+                qualified=True, user=obj.get_actor.username),
+            updateddate=item.get('added'))
+
+    feed_data = feed.writeString(encoding='utf-8')
+    cache_feed(request, etag, feed_data)
 
-    return feed.get_response()
+    response = Response(feed_data, mimetype='application/atom+xml')
+    return add_validators(response, etag, last_modified)
 
 @active_user_from_url
 @uses_pagination
@@ -691,8 +747,8 @@ def processing_panel(request, page, url_user):
             request, 'mediagoblin.user_pages.user_home',
             user=user.username)
     # Get media entries which are in-processing
-    entries = (MediaEntry.query.filter_by(actor=user.id)
-            .order_by(MediaEntry.created.desc()))
+    entries = MediaEntry.query.filter_by(actor=user.id).options(
+        *gallery_load_options(), *media_data_load_options())
 
     try:
         state = request.matchdict['state']
@@ -702,8 +758,9 @@ def processing_panel(request, page, url_user):
         # show all entries
         pass
 
-    pagination = Pagination(page, entries)
-    pagination.per_page = 30
+    pagination = KeysetPagination(
+        page, entries, (MediaEntry.created, MediaEntry.id),
+        per_page=30, marker=request.pagination_marker)
     entries_on_a_page = pagination()
 
     # Render to response
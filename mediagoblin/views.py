@@ -16,7 +16,8 @@
 
 from mediagoblin import mg_globals
 from mediagoblin.db.models import MediaEntry
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.db.util import gallery_load_options
+from mediagoblin.tools.pagination import KeysetPagination
 from mediagoblin.tools.pluginapi import hook_handle
 from mediagoblin.tools.response import render_to_response, render_404
 from mediagoblin.decorators import uses_pagination, user_not_banned
@@ -25,10 +26,12 @@ from mediagoblin.decorators import uses_pagination, user_not_banned
 @user_not_banned
 @uses_pagination
 def default_root_view(request, page):
-    cursor = request.db.query(MediaEntry).filter_by(state='processed').\
-        order_by(MediaEntry.created.desc())
+    cursor = request.db.query(MediaEntry).filter_by(state='processed') \
+        .options(*gallery_load_options())
 
-    pagination = Pagination(page, cursor)
+    pagination = KeysetPagination(
+        page, cursor, (MediaEntry.created, MediaEntry.id),
+        marker=request.pagination_marker)
     media_entries = pagination()
     return render_to_response(
         request, 'mediagoblin/root.html',